@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Asynchronous Lexicon API client for Lexicon Track Adder Bot
+"""
+
+import time
+import asyncio
+import httpx
+import logging
+from typing import Dict, Any, Optional, List
+from error_handler import LexiconError, LexiconRejectedError
+from resilience import RetryPolicy, CircuitBreaker, is_retryable_status
+from lexicon_index import LexiconLibraryIndex
+from lexicon_client import _extract_track_data, _match_tracks, _search_params, _unavailable_error
+from metrics import LEXICON_REQUEST_SECONDS
+from profiling import trace_stage
+
+logger = logging.getLogger(__name__)
+
+
+def _add_error(status_code: int, message: str) -> LexiconError:
+    """Build the error for a failed add: a rejection unless the server itself had a problem."""
+    if status_code >= 500 or is_retryable_status(status_code):
+        return LexiconError(message)
+    return LexiconRejectedError(message)
+
+
+class AsyncLexiconClient:
+    """
+    Asynchronous client for the Lexicon API.
+    
+    All requests go through a single ``httpx.AsyncClient`` so keep-alive
+    connections are pooled and shared by every handler, and a slow Lexicon
+    instance never blocks the bot's event loop.
+    
+    With a ``library_index``, tracks already in the library are not sent
+    again, and lookups and searches are answered from the index once it
+    has been loaded with ``refresh_library``.
+    """
+    
+    def __init__(
+        self,
+        base_url: str = "http://localhost:48624/v1",
+        client: Optional[httpx.AsyncClient] = None,
+        max_connections: int = 10,
+        library_index: Optional[LexiconLibraryIndex] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.library_index = library_index
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(name="Lexicon")
+        self.client = client or httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+    
+    async def close(self) -> None:
+        """Close the underlying connection pool."""
+        await self.client.aclose()
+    
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request, retrying transient failures with backoff.
+        
+        Raises:
+            LexiconUnavailableError: If the circuit breaker is open
+            httpx.HTTPError: If the last attempt failed to connect
+        """
+        for attempt in range(1, self.retry_policy.attempts + 1):
+            if not self.circuit_breaker.allow_request():
+                raise _unavailable_error(self.circuit_breaker)
+            
+            started = time.monotonic()
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                LEXICON_REQUEST_SECONDS.labels(method).observe(time.monotonic() - started)
+                self.circuit_breaker.record_failure()
+                if attempt == self.retry_policy.attempts:
+                    raise
+            else:
+                LEXICON_REQUEST_SECONDS.labels(method).observe(time.monotonic() - started)
+                if not is_retryable_status(response.status_code):
+                    self.circuit_breaker.record_success()
+                    return response
+                self.circuit_breaker.record_failure()
+                if attempt == self.retry_policy.attempts:
+                    return response
+            
+            delay = self.retry_policy.delay(attempt)
+            logger.warning(f"Lexicon request failed, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+    
+    async def test_connection(self) -> bool:
+        """Test connection to the Lexicon API."""
+        try:
+            response = await self.client.get(f"{self.base_url}/tracks", timeout=5)
+            return response.status_code == 200
+        except httpx.HTTPError as e:
+            logger.error(f"Error testing Lexicon connection: {e}")
+            return False
+    
+    @trace_stage
+    async def add_track(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Add a track to the Lexicon library.
+        
+        Args:
+            file_path: Path to the audio file to add
+        
+        Returns:
+            Dictionary with track data if successful, None otherwise
+        
+        Raises:
+            LexiconError: If there's an error adding the track
+        """
+        if self.library_index:
+            known_track = self.library_index.find_location(file_path)
+            if known_track:
+                logger.info(f"Track already in Lexicon, skipping add: {file_path}")
+                return known_track
+        
+        try:
+            data = {"locations": [file_path]}
+            logger.info(f"Adding track to Lexicon: {file_path}")
+            
+            response = await self._request(
+                "POST",
+                f"{self.base_url}/tracks",
+                json=data,
+                timeout=30
+            )
+            
+            logger.info(f"Lexicon API response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                track_data = _extract_track_data(response.json())
+                if self.library_index:
+                    self.library_index.add(track_data)
+                return track_data
+            else:
+                error_msg = f"Error adding track: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise _add_error(response.status_code, error_msg)
+        
+        except httpx.HTTPError as e:
+            error_msg = f"Error adding track to Lexicon: {e}"
+            logger.error(error_msg)
+            raise LexiconError(error_msg)
+    
+    @trace_stage
+    async def add_tracks(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """
+        Add several tracks to the Lexicon library in a single request.
+        
+        Args:
+            file_paths: Paths to the audio files to add
+        
+        Returns:
+            List with one track dictionary per entry in ``file_paths``
+        
+        Raises:
+            LexiconError: If there's an error adding the tracks
+        """
+        if not self.library_index:
+            return await self._post_tracks(file_paths)
+        
+        # Only send locations the library doesn't already hold
+        known = {path: self.library_index.find_location(path) for path in file_paths}
+        new_paths = [path for path, track_data in known.items() if track_data is None]
+        if new_paths:
+            logger.info(f"Skipping {len(known) - len(new_paths)} tracks already in Lexicon")
+            for path, track_data in zip(new_paths, await self._post_tracks(new_paths)):
+                self.library_index.add(track_data)
+                known[path] = track_data
+        
+        return [known[path] for path in file_paths]
+    
+    async def _post_tracks(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """Send a multi-location ``POST /tracks`` request."""
+        try:
+            data = {"locations": list(file_paths)}
+            logger.info(f"Adding {len(file_paths)} tracks to Lexicon")
+            
+            response = await self._request(
+                "POST",
+                f"{self.base_url}/tracks",
+                json=data,
+                timeout=30 + len(file_paths)
+            )
+            
+            logger.info(f"Lexicon API response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                return _match_tracks(file_paths, response.json())
+            else:
+                error_msg = f"Error adding tracks: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise _add_error(response.status_code, error_msg)
+        
+        except httpx.HTTPError as e:
+            error_msg = f"Error adding tracks to Lexicon: {e}"
+            logger.error(error_msg)
+            raise LexiconError(error_msg)
+    
+    @trace_stage
+    async def get_track(self, track_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Get a track from the Lexicon library by ID.
+        
+        Args:
+            track_id: ID of the track to retrieve
+        
+        Returns:
+            Dictionary with track data if successful, None otherwise
+        
+        Raises:
+            LexiconError: If there's an error getting the track
+        """
+        if self.library_index and self.library_index.loaded:
+            return self.library_index.get(track_id)
+        
+        try:
+            response = await self._request(
+                "GET",
+                f"{self.base_url}/track",
+                params={"id": track_id},
+                timeout=10
+            )
+            
+            if response.status_code == 200:
+                return response.json().get("data", {}).get("track")
+            else:
+                error_msg = f"Error getting track: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise LexiconError(error_msg)
+        
+        except httpx.HTTPError as e:
+            error_msg = f"Error getting track from Lexicon: {e}"
+            logger.error(error_msg)
+            raise LexiconError(error_msg)
+    
+    @trace_stage
+    async def search_tracks(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Search for tracks in the Lexicon library.
+        
+        Args:
+            query: Search query string
+            limit: Maximum number of results to return
+        
+        Returns:
+            List of track dictionaries
+        
+        Raises:
+            LexiconError: If there's an error searching tracks
+        """
+        if self.library_index and self.library_index.loaded:
+            return self.library_index.search(query, limit)
+        
+        try:
+            response = await self._request(
+                "GET",
+                f"{self.base_url}/search/tracks",
+                params=_search_params(query, limit),
+                timeout=10
+            )
+            
+            if response.status_code == 200:
+                return response.json().get("data", {}).get("tracks", [])
+            else:
+                error_msg = f"Error searching tracks: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise LexiconError(error_msg)
+        
+        except httpx.HTTPError as e:
+            error_msg = f"Error searching tracks in Lexicon: {e}"
+            logger.error(error_msg)
+            raise LexiconError(error_msg)
+    
+    @trace_stage
+    async def list_tracks(self) -> List[Dict[str, Any]]:
+        """
+        Get every track in the Lexicon library.
+        
+        Returns:
+            List of track dictionaries
+        
+        Raises:
+            LexiconError: If there's an error listing tracks
+        """
+        try:
+            response = await self._request("GET", f"{self.base_url}/tracks", timeout=60)
+            
+            if response.status_code == 200:
+                return response.json().get("data", {}).get("tracks", [])
+            else:
+                error_msg = f"Error listing tracks: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise LexiconError(error_msg)
+        
+        except httpx.HTTPError as e:
+            error_msg = f"Error listing tracks in Lexicon: {e}"
+            logger.error(error_msg)
+            raise LexiconError(error_msg)
+    
+    async def refresh_library(self) -> None:
+        """
+        Sync the library index with Lexicon.
+        
+        The whole track list is fetched each time and diffed against the
+        index in memory, so this costs a full download of the list.
+        
+        Raises:
+            LexiconError: If the track list couldn't be fetched
+        """
+        if not self.library_index:
+            return
+        
+        tracks = await self.list_tracks()
+        changed, removed = self.library_index.update(tracks)
+        logger.info(
+            f"Lexicon library index refreshed: {len(self.library_index)} tracks, "
+            f"{changed} added or changed, {removed} removed"
+        )
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Load-test benchmark for Lexicon Track Adder Bot
+
+Runs the real bot pipeline (handle_document, the download queue,
+DownloadManager and the Lexicon client) against a fake Telegram Bot API
+serving synthetic MP3 files and a fake Lexicon API with configurable
+latency. The fake servers run in a separate process so they don't compete
+with the bot for the GIL or skew its memory usage.
+
+With --local the fake Bot API behaves like a self-hosted server in local
+mode: getFile writes the file to disk and returns its path, so the bot
+takes it over without an HTTP transfer.
+
+Usage:
+    python benchmark.py --files 300 --rate 600 --output baseline.json
+    python benchmark.py --files 300 --rate 600 --baseline baseline.json
+    python benchmark.py --files 300 --rate 600 --local
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qs, urlparse
+from structured_logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+BOT_TOKEN = "123456:benchmark"
+ADMIN_USER_ID = 4242
+
+# A silent 128 kbps MPEG-1 Layer III frame
+_MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def synthetic_mp3(file_id: str, size: int) -> bytes:
+    """
+    Build a fake MP3 file of exactly ``size`` bytes.
+    
+    The file ID is stored in an ID3 tag so every file has different content
+    and isn't collapsed by the bot's duplicate detection.
+    """
+    text = file_id.encode()
+    frame = b"TIT2" + (len(text) + 1).to_bytes(4, "big") + b"\x00\x00\x03" + text
+    tag = b"ID3\x04\x00\x00" + bytes([0, 0, (len(frame) >> 7) & 0x7f, len(frame) & 0x7f]) + frame
+    frames = _MP3_FRAME * (max(0, size - len(tag)) // len(_MP3_FRAME) + 1)
+    return (tag + frames)[:size]
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Answers the Bot API methods the bot uses and serves file downloads."""
+    
+    protocol_version = "HTTP/1.1"
+    file_size = 1024 * 1024
+    # Directory getFile stores files in, acting as a local-mode server
+    local_dir: Optional[str] = None
+    message_ids = iter(range(1_000_000, sys.maxsize))
+    message_ids_lock = threading.Lock()
+    
+    def _params(self) -> Dict[str, Any]:
+        """Decode Bot API parameters sent as JSON or form data."""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        params = {}
+        for key, values in parse_qs(body.decode()).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+    
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        """Answer a Bot API method call."""
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method == "getFile":
+            file_id = params["file_id"]
+            file_path = f"music/{file_id}.mp3"
+            if self.local_dir:
+                file_path = os.path.join(self.local_dir, f"{file_id}.mp3")
+                with open(file_path, 'wb') as f:
+                    f.write(synthetic_mp3(file_id, self.file_size))
+            result = {
+                "file_id": file_id,
+                "file_unique_id": f"u{file_id}",
+                "file_size": self.file_size,
+                "file_path": file_path
+            }
+        elif method in ("sendMessage", "editMessageText"):
+            with self.message_ids_lock:
+                message_id = params.get("message_id") or next(self.message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id"), "type": "group", "title": "Benchmark"},
+                "text": params.get("text", "")
+            }
+        else:
+            result = True
+        
+        self._send(200, json.dumps({"ok": True, "result": result}).encode(), "application/json")
+    
+    def do_GET(self):
+        """Serve a synthetic MP3, honouring Range requests."""
+        path = urlparse(self.path).path
+        if "/music/" not in path:
+            self._send(404, b"", "text/plain")
+            return
+        
+        file_id = path.rsplit('/', 1)[-1][:-len(".mp3")]
+        content = synthetic_mp3(file_id, self.file_size)
+        range_header = self.headers.get("Range")
+        if range_header:
+            offset = int(range_header[len("bytes="):].split('-', 1)[0])
+            self._send(
+                206, content[offset:], "audio/mpeg",
+                {"Content-Range": f"bytes {offset}-{len(content) - 1}/{len(content)}"}
+            )
+        else:
+            self._send(200, content, "audio/mpeg")
+    
+    def log_message(self, format, *args):
+        """Keep benchmark output quiet."""
+
+
+class FakeLexiconHandler(BaseHTTPRequestHandler):
+    """Stores tracks posted to ``/v1/tracks`` after a simulated delay."""
+    
+    protocol_version = "HTTP/1.1"
+    latency = 0.05
+    tracks: List[Dict[str, Any]] = []
+    tracks_lock = threading.Lock()
+    
+    def _send_json(self, data: Dict[str, Any]) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        """List the library."""
+        with self.tracks_lock:
+            tracks = list(self.tracks)
+        self._send_json({"data": {"tracks": tracks}})
+    
+    def do_POST(self):
+        """Add one or more tracks by location."""
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        locations = body.get("locations") or [body.get("location")]
+        time.sleep(self.latency)
+        
+        added = []
+        with self.tracks_lock:
+            for location in locations:
+                track = {
+                    "id": len(self.tracks) + 1,
+                    "location": location,
+                    "title": os.path.splitext(os.path.basename(location))[0],
+                    "artist": "Benchmark"
+                }
+                self.tracks.append(track)
+                added.append(track)
+        self._send_json({"data": {"tracks": added}})
+    
+    def log_message(self, format, *args):
+        """Keep benchmark output quiet."""
+
+
+def serve_fakes(
+    file_size: int,
+    lexicon_latency: float,
+    ports: multiprocessing.Queue,
+    local_dir: Optional[str] = None
+) -> None:
+    """Run both fake servers until the process is terminated."""
+    FakeBotAPIHandler.file_size = file_size
+    FakeBotAPIHandler.local_dir = local_dir
+    FakeLexiconHandler.latency = lexicon_latency
+    
+    bot_api = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPIHandler)
+    lexicon = ThreadingHTTPServer(("127.0.0.1", 0), FakeLexiconHandler)
+    bot_api.daemon_threads = lexicon.daemon_threads = True
+    threading.Thread(target=lexicon.serve_forever, daemon=True).start()
+    ports.put((bot_api.server_port, lexicon.server_port))
+    bot_api.serve_forever()
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process in MiB, where the OS reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def document_update(index: int, chats: int, file_size: int) -> Dict[str, Any]:
+    """Build the JSON of an update carrying an MP3 document."""
+    if chats == 1:
+        # The usual case: the admin forwarding files in their private chat
+        chat = {"id": ADMIN_USER_ID, "type": "private", "first_name": "Admin"}
+    else:
+        chat = {"id": -1000 - index % chats, "type": "group", "title": "Benchmark"}
+    return {
+        "update_id": index + 1,
+        "message": {
+            "message_id": index + 1,
+            "date": int(time.time()),
+            "chat": chat,
+            "from": {"id": ADMIN_USER_ID, "is_bot": False, "first_name": "Admin"},
+            "document": {
+                "file_id": f"file{index}",
+                "file_unique_id": f"ufile{index}",
+                "file_name": f"track_{index:05d}.mp3",
+                "mime_type": "audio/mpeg",
+                "file_size": file_size
+            }
+        }
+    }
+
+
+async def run_load(args: argparse.Namespace, bot_api_url: str, lexicon_url: str) -> Dict[str, Any]:
+    """
+    Push documents through the bot and measure how it copes.
+    
+    Args:
+        args: Parsed command line arguments
+        bot_api_url: Base URL of the fake Bot API
+        lexicon_url: Base URL of the fake Lexicon API
+    
+    Returns:
+        Benchmark results
+    """
+    # Imported here so --help works without the bot's dependencies
+    from telegram import Update
+    from config import Config
+    from job_journal import JobJournal, FINAL_STATES, FAILED
+    from handlers import build_application, startup, shutdown
+    
+    class TimingJournal(JobJournal):
+        """Job journal that notes when each job reaches a final state."""
+        
+        def __init__(self, path: str):
+            super().__init__(path)
+            self.finished: Dict[str, float] = {}
+            self.failed = 0
+            self.all_finished = asyncio.Event()
+        
+        def record(self, key: str, state: str, **fields: Any) -> None:
+            super().record(key, state, **fields)
+            if state in FINAL_STATES and key not in self.finished:
+                self.finished[key] = time.monotonic()
+                self.failed += state == FAILED
+                if len(self.finished) == args.files:
+                    self.all_finished.set()
+    
+    with tempfile.TemporaryDirectory() as work_dir:
+        download_dir = os.path.join(work_dir, "music")
+        os.makedirs(download_dir)
+        config = Config(
+            bot_token=BOT_TOKEN,
+            admin_user_id=ADMIN_USER_ID,
+            download_dir=download_dir,
+            lexicon_enabled=not args.no_lexicon,
+            lexicon_api_url=lexicon_url,
+            download_workers=args.workers,
+            dedup_index_path=os.path.join(work_dir, "dedup_index.db"),
+            job_journal_path=os.path.join(work_dir, "job_journal.jsonl"),
+            telegram_base_url=f"{bot_api_url}/bot",
+            telegram_base_file_url=f"{bot_api_url}/file/bot",
+            telegram_local_mode=args.local
+        )
+        
+        application = build_application(config)
+        application.bot_data['job_journal'].close()
+        journal = application.bot_data['job_journal'] = TimingJournal(config.job_journal_path)
+        submitted: Dict[str, float] = {}
+        interval = 60.0 / args.rate if args.rate > 0 else 0.0
+        
+        async with application:
+            await application.start()
+            await startup(application)
+            
+            started = time.monotonic()
+            for index in range(args.files):
+                # Schedule against the start time so slow puts don't lower the rate
+                delay = started + index * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                data = document_update(index, args.chats, args.file_size)
+                submitted[f"{data['message']['chat']['id']}:{index + 1}"] = time.monotonic()
+                await application.update_queue.put(Update.de_json(data, application.bot))
+            
+            try:
+                await asyncio.wait_for(journal.all_finished.wait(), timeout=args.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out with {args.files - len(journal.finished)} files unfinished")
+            elapsed = time.monotonic() - started
+            
+            await application.stop()
+            await shutdown(application)
+    
+    latencies = [journal.finished[key] - submitted[key] for key in journal.finished if key in submitted]
+    completed = len(journal.finished) - journal.failed
+    return {
+        "files": args.files,
+        "completed": completed,
+        "failed": journal.failed,
+        "unfinished": args.files - len(journal.finished),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_files_per_minute": round(completed / elapsed * 60, 1),
+        "throughput_mib_per_second": round(completed * args.file_size / elapsed / (1024 * 1024), 2),
+        "latency_p50_seconds": round(percentile(latencies, 50), 3),
+        "latency_p95_seconds": round(percentile(latencies, 95), 3),
+        "latency_p99_seconds": round(percentile(latencies, 99), 3),
+        "latency_max_seconds": round(max(latencies, default=0.0), 3),
+        "peak_rss_mib": peak_rss_mb()
+    }
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """Print results, with the change against a baseline if one is given."""
+    for name, value in results.items():
+        line = f"{name:32} {value}"
+        previous = (baseline or {}).get(name)
+        if isinstance(value, (int, float)) and isinstance(previous, (int, float)) and previous:
+            line += f"  ({(value - previous) / previous:+.1%} vs baseline {previous})"
+        print(line)
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='Load-test Lexicon Track Adder Bot')
+    parser.add_argument('--files', type=int, default=200, help='Number of files to send')
+    parser.add_argument('--rate', type=float, default=600, help='Files sent per minute (0 sends them all at once)')
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help='Size of each synthetic MP3 in bytes')
+    parser.add_argument('--chats', type=int, default=1,
+                        help='Number of chats the files are spread over (default 1, a single admin chat)')
+    parser.add_argument('--workers', type=int, default=3, help='Download workers')
+    parser.add_argument('--lexicon-latency', type=float, default=0.05, help='Seconds the fake Lexicon takes per request')
+    parser.add_argument('--no-lexicon', action='store_true', help='Benchmark downloads only')
+    parser.add_argument('--local', action='store_true', help='Act as a local Bot API server that hands over files on disk')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for all files to finish')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --output')
+    parser.add_argument('--verbose', action='store_true', help='Show the bot\'s log output')
+    args = parser.parse_args()
+    
+    setup_logging("INFO" if args.verbose else "WARNING", "text")
+    
+    ports = multiprocessing.Queue()
+    local_dir = tempfile.TemporaryDirectory() if args.local else None
+    fakes = multiprocessing.Process(
+        target=serve_fakes,
+        args=(args.file_size, args.lexicon_latency, ports, local_dir and local_dir.name),
+        daemon=True
+    )
+    fakes.start()
+    try:
+        bot_api_port, lexicon_port = ports.get(timeout=10)
+        results = asyncio.run(run_load(
+            args, f"http://127.0.0.1:{bot_api_port}", f"http://127.0.0.1:{lexicon_port}/v1"
+        ))
+    finally:
+        fakes.terminate()
+        fakes.join()
+        if local_dir:
+            local_dir.cleanup()
+    
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,20 @@
 #!/usr/bin/env python3
 """
-Lexicon Track Adder Bot - Main bot implementation
+Lexicon Track Adder Bot - Command-line entry point
 """
 
 import os
 import sys
 import logging
 import argparse
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import Config, load_config, save_config
-from utils import is_admin, is_mp3_file, validate_directory
-from download_manager import DownloadManager
-from lexicon_client import LexiconClient, test_lexicon_connection
-from error_handler import error_handler, handle_bot_error, ConfigurationError, DownloadError, LexiconError, PermissionError
+from config import Config, ConfigReloader, load_config, save_config
+from utils import validate_directory
+from structured_logging import setup_logging
+
+# Only what setup needs is imported up front. Telegram, HTTP clients and the
+# rest of the bot are imported by the mode that uses them, which keeps
+# --setup, --import and --profile-startup quick to start.
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 
@@ -47,6 +42,8 @@ def setup_lexicon_enabled(enabled):
 
 def setup_lexicon_url(lexicon_url):
     """Setup Lexicon URL configuration."""
+    from lexicon_client import test_lexicon_connection
+    
     # Test connection
     print(f"Testing Lexicon API connection at {lexicon_url}...")
     
@@ -106,168 +103,54 @@ def run_terminal_setup(args):
     print("You can start the bot by running: python bot.py")
 
 
-@handle_bot_error
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle the /start command."""
-    config = context.bot_data.get('config')
-    
-    # Check if user is admin
-    if not is_admin(update.effective_user.id, config):
-        if update.message:
-            await update.message.reply_text("❌ You are not authorized to use this bot.")
-        return
-    
-    if not config.is_configured():
-        if update.message:
-            await update.message.reply_text(
-                "Welcome to Lexicon Track Adder Bot!\n\n"
-                "The bot is not configured yet. Please run the setup script first:\n\n"
-                "`python bot.py --setup --download-dir /path/to/music --lexicon-enabled yes/no`\n\n"
-                "Replace `/path/to/music` with your desired download directory.\n"
-                "After setup is complete, restart the bot and send /start again."
-            )
-        return
-    else:
-        if update.message:
-            await update.message.reply_text(
-                "Welcome back! Send me an MP3 file and I'll download it for you."
-            )
-
-
-@handle_bot_error
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle the /help command."""
-    config = context.bot_data.get('config')
-    
-    # Check if user is admin
-    if not is_admin(update.effective_user.id, config):
-        if update.message:
-            await update.message.reply_text("❌ You are not authorized to use this bot.")
-        return
+def run_import(args, config: Config) -> None:
+    """Import an existing music folder into Lexicon."""
+    from bulk_import import BulkImporter, ImportStats
+    from dedup_index import DedupIndex
+    from lexicon_client import LexiconClient
+    from resilience import RetryPolicy, CircuitBreaker
     
-    help_text = """
-    *Lexicon Track Adder Bot Help*
-    
-    /start - Start the bot
-    /help - Show this help message
-    
-    *Usage:*
-    1. Get an MP3 file from @deezload2bot
-    2. Forward that file to this bot
-    3. The bot will download it to your specified folder
-    4. If enabled, it will add the file to your Lexicon library
-    
-    *Setup:*
-    If the bot is not configured, run:
-    `python bot.py --setup --download-dir /path/to/music --lexicon-enabled yes/no`
-    """
-    if update.message:
-        await update.message.reply_text(help_text, parse_mode="Markdown")
-
-
-@handle_bot_error
-async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle document and audio messages (MP3 files)."""
-    config = context.bot_data.get('config')
-    
-    # Check if user is admin
-    if not is_admin(update.effective_user.id, config):
-        if update.message:
-            await update.message.reply_text("❌ You are not authorized to use this bot.")
-        return
-    
-    # Get the document or audio file
-    document = None
-    file_name = None
+    if not os.path.isdir(args.import_dir):
+        print(f"❌ Not a directory: {args.import_dir}")
+        sys.exit(1)
     
-    if update.message.document:
-        document = update.message.document
-        file_name = document.file_name
-    elif update.message.audio:
-        document = update.message.audio
-        file_name = document.file_name or f"{document.title or 'audio'}.mp3"
-    else:
-        if update.message:
-            await update.message.reply_text("❌ No document or audio file found.")
-        return
+    lexicon_client = LexiconClient(
+        config.lexicon_api_url,
+        retry_policy=RetryPolicy(config.lexicon_retry_attempts, config.lexicon_retry_base_delay),
+        circuit_breaker=CircuitBreaker(
+            config.lexicon_breaker_threshold,
+            config.lexicon_breaker_reset,
+            name="Lexicon"
+        )
+    )
+    if not lexicon_client.test_connection():
+        print(f"❌ Could not connect to Lexicon API at {config.lexicon_api_url}")
+        print("Please make sure Lexicon is running with the API enabled.")
+        sys.exit(1)
     
-    # Check if it's an MP3 file
-    if not is_mp3_file(file_name):
-        if update.message:
-            await update.message.reply_text("❌ Only MP3 files are supported.")
-        return
+    def show_progress(stats: ImportStats) -> None:
+        print(f"📥 Imported {stats.imported} tracks ({stats.failed} failed)")
     
+    dedup_index = DedupIndex(config.dedup_index_path)
     try:
-        # Initialize download manager
-        download_manager = DownloadManager(config.download_dir)
-        
-        # Download the file
-        file_path = await download_manager.download_file(document, context, update)
-        
-        if not file_path:
-            if update.message:
-                await update.message.reply_text("❌ Failed to download the file.")
-            return
-        
-        # If Lexicon integration is enabled, add the track
-        if config.lexicon_enabled:
-            try:
-                if update.message:
-                    await update.message.reply_text("🔄 Adding track to Lexicon...")
-                
-                # Initialize Lexicon client
-                lexicon_client = LexiconClient(config.lexicon_api_url)
-                
-                # Add the track
-                track_data = lexicon_client.add_track(file_path)
-                
-                if track_data:
-                    if update.message:
-                        # Check if we have a success flag but no actual track data
-                        if track_data.get("success") and track_data.get("title") == "Unknown" and track_data.get("artist") == "Unknown":
-                            await update.message.reply_text(
-                                "✅ Track added to Lexicon successfully!\n"
-                                "Track details were not available in the response."
-                            )
-                        else:
-                            await update.message.reply_text(
-                                f"✅ Track added to Lexicon successfully!\n"
-                                f"Title: {track_data.get('title', 'Unknown')}\n"
-                                f"Artist: {track_data.get('artist', 'Unknown')}"
-                            )
-                else:
-                    if update.message:
-                        await update.message.reply_text("⚠️ File downloaded but couldn't add to Lexicon.")
-                    
-            except LexiconError as e:
-                if update.message:
-                    await update.message.reply_text(f"⚠️ Error adding to Lexicon: {str(e)}")
-                logger.error(f"Lexicon error: {e}")
-        
-    except DownloadError as e:
-        if update.message:
-            await update.message.reply_text(f"❌ Download error: {str(e)}")
-        logger.error(f"Download error: {e}")
-    except Exception as e:
-        if update.message:
-            await update.message.reply_text(f"❌ An unexpected error occurred: {str(e)}")
-        logger.error(f"Unexpected error: {e}")
-
-
-@handle_bot_error
-async def handle_unauthorized(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle messages from unauthorized users."""
-    config = context.bot_data.get('config')
-    
-    # Check if user is admin
-    if not is_admin(update.effective_user.id, config):
-        if update.message:
-            await update.message.reply_text("❌ You are not authorized to use this bot.")
-        return
-    
-    # If admin but message wasn't handled by other handlers
-    if update.message:
-        await update.message.reply_text("❌ I don't understand this message. Please send an MP3 file or use /help for commands.")
+        importer = BulkImporter(
+            lexicon_client,
+            dedup_index,
+            batch_size=args.import_batch_size,
+            concurrency=args.import_concurrency,
+            progress=show_progress
+        )
+        stats = importer.run(args.import_dir)
+    finally:
+        dedup_index.close()
+    
+    print(f"\n✅ Import finished: {stats.found} MP3 files found")
+    print(f"   Imported: {stats.imported}")
+    print(f"   Already imported: {stats.already_imported}")
+    print(f"   Duplicates skipped: {stats.duplicates}")
+    if stats.failed:
+        print(f"   Failed: {stats.failed} (run the import again to retry them)")
+        sys.exit(1)
 
 
 def main() -> None:
@@ -280,9 +163,35 @@ def main() -> None:
                         help='Enable Lexicon integration (yes/no)')
     parser.add_argument('--lexicon-url', default='http://localhost:48624/v1', 
                         help='Lexicon API URL (default: http://localhost:48624/v1)')
+    parser.add_argument('--webhook', action='store_true',
+                        help='Receive updates through a local webhook server instead of polling')
+    parser.add_argument('--webhook-listen', help='Address for the webhook server to listen on')
+    parser.add_argument('--webhook-port', type=int, help='Port for the webhook server to listen on')
+    parser.add_argument('--webhook-path', help='URL path the webhook is served under')
+    parser.add_argument('--webhook-url', help='Public base URL Telegram sends updates to')
+    parser.add_argument('--local', action='store_true',
+                        help='Use the self-hosted Bot API server at telegram_base_url, which hands over files on disk')
+    parser.add_argument('--import', dest='import_dir', metavar='DIR',
+                        help='Add every MP3 below DIR to Lexicon, then exit')
+    parser.add_argument('--import-batch-size', type=int, default=200,
+                        help='Tracks per Lexicon request when importing (default: 200)')
+    parser.add_argument('--import-concurrency', type=int, default=4,
+                        help='Lexicon requests in flight at once when importing (default: 4)')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report how long each mode spends importing modules, then exit')
     
     args = parser.parse_args()
     
+    # Load configuration, and watch the file so edits apply while running
+    config = load_config()
+    config_reloader = ConfigReloader()
+    setup_logging(config.log_level, config.log_format, config.log_payloads_per_minute)
+    
+    if args.profile_startup:
+        from startup_profile import print_startup_profile
+        print_startup_profile()
+        return
+    
     # If setup flag is provided, run setup and exit
     if args.setup:
         if not args.download_dir:
@@ -291,8 +200,10 @@ def main() -> None:
         run_terminal_setup(args)
         return
     
-    # Load configuration
-    config = load_config()
+    # Importing only needs Lexicon, not a configured bot
+    if args.import_dir:
+        run_import(args, config)
+        return
     
     if not config.is_configured():
         print("Bot is not configured. Please run setup first:")
@@ -303,28 +214,24 @@ def main() -> None:
         logger.error("No bot token provided. Set TELEGRAM_BOT_TOKEN environment variable or add to config.json")
         return
     
-    # Create the Application
-    application = Application.builder().token(config.bot_token).build()
-    
-    # Store config in bot_data for access in handlers
-    application.bot_data['config'] = config
+    # Command line webhook options override the config file
+    for option in ('webhook_listen', 'webhook_port', 'webhook_path', 'webhook_url'):
+        if getattr(args, option) is not None:
+            setattr(config, option, getattr(args, option))
     
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    
-    # Add handler for documents and audio files
-    application.add_handler(MessageHandler(filters.Document.ALL | filters.AUDIO, handle_document))
+    if args.local:
+        if not config.telegram_base_url:
+            print("Error: --local needs telegram_base_url in config.json to point at your Bot API server")
+            sys.exit(1)
+        config.telegram_local_mode = True
     
-    # Add catch-all handler for unauthorized users (higher group number = lower priority)
-    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_unauthorized), group=2)
+    from handlers import build_application, run_application
     
-    # Add error handler
-    application.add_error_handler(error_handler)
+    application = build_application(config)
+    application.bot_data['config_reloader'] = config_reloader
     
     # Run the bot
-    logger.info("Starting bot...")
-    application.run_polling()
+    run_application(application, config, args.webhook)
 
 
 if __name__ == "__main__":
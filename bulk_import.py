@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Bulk import of existing music folders for Lexicon Track Adder Bot
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Set, Tuple
+from utils import is_mp3_file
+from dedup_index import DedupIndex, hash_file
+from lexicon_client import LexiconClient
+from error_handler import LexiconError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ImportStats:
+    """Counts of what happened to the files found by an import."""
+    found: int = 0
+    already_imported: int = 0
+    duplicates: int = 0
+    imported: int = 0
+    failed: int = 0
+
+
+def find_mp3_files(directory: str) -> Iterator[str]:
+    """Yield the absolute path of every MP3 file below a directory."""
+    for root, dirs, files in os.walk(os.path.abspath(directory)):
+        # Skip hidden folders and the bot's partial downloads
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.') and is_mp3_file(name):
+                yield os.path.join(root, name)
+
+
+class BulkImporter:
+    """
+    Adds every MP3 in a folder tree to Lexicon.
+    
+    Files are hashed on a thread pool and checked against the imports
+    recorded in the dedup index, so content an import already added to
+    Lexicon is skipped. The bot's own download records are not used: a file
+    the bot downloaded may never have reached Lexicon. New files are sent to
+    Lexicon in large multi-location requests, a few at a time. Each file is
+    recorded as imported as soon as its batch has been accepted, so an
+    interrupted import picks up where it left off and does not even re-hash
+    files it already finished.
+    """
+    
+    def __init__(
+        self,
+        lexicon_client: LexiconClient,
+        dedup_index: DedupIndex,
+        batch_size: int = 200,
+        concurrency: int = 4,
+        hash_workers: Optional[int] = None,
+        progress: Optional[Callable[[ImportStats], None]] = None
+    ):
+        self.lexicon_client = lexicon_client
+        self.dedup_index = dedup_index
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.hash_workers = hash_workers or min(8, os.cpu_count() or 1)
+        self.progress = progress
+        self.stats = ImportStats()
+        self._stats_lock = threading.Lock()
+    
+    def _needs_import(self, path: str) -> bool:
+        """Return False for files a previous run already imported unchanged."""
+        recorded = self.dedup_index.lookup_path(path, "imports")
+        return recorded is None or recorded[1] != os.path.getsize(path)
+    
+    def _hash(self, path: str) -> Tuple[str, Optional[str]]:
+        """Hash a file, returning None for files that can't be read."""
+        try:
+            return path, hash_file(path)
+        except OSError as e:
+            logger.warning(f"Could not read {path}: {e}")
+            return path, None
+    
+    def _send_batch(self, batch: List[Tuple[str, str]]) -> None:
+        """Add a batch to Lexicon and record it as imported."""
+        paths = [path for path, _ in batch]
+        try:
+            self.lexicon_client.add_tracks(paths)
+        except LexiconError as e:
+            # Not recorded as imported, so the next run retries them
+            logger.error(f"Failed to import {len(batch)} tracks: {e}")
+            with self._stats_lock:
+                self.stats.failed += len(batch)
+            return
+        
+        for path, sha256 in batch:
+            self.dedup_index.record_import(sha256, path, os.path.getsize(path))
+        with self._stats_lock:
+            self.stats.imported += len(batch)
+            if self.progress:
+                self.progress(self.stats)
+    
+    def run(self, directory: str) -> ImportStats:
+        """
+        Import a folder tree.
+        
+        Args:
+            directory: Folder to scan for MP3 files
+        
+        Returns:
+            What happened to the files that were found
+        """
+        pending = []
+        for path in find_mp3_files(directory):
+            self.stats.found += 1
+            if self._needs_import(path):
+                pending.append(path)
+            else:
+                self.stats.already_imported += 1
+        logger.info(
+            f"Found {self.stats.found} MP3 files, {len(pending)} to import "
+            f"({self.stats.already_imported} imported before)"
+        )
+        
+        seen: Set[str] = set()
+        batch: List[Tuple[str, str]] = []
+        in_flight: List[Future] = []
+        with ThreadPoolExecutor(self.hash_workers, thread_name_prefix="import-hash") as hashers, \
+                ThreadPoolExecutor(self.concurrency, thread_name_prefix="import-lexicon") as senders:
+            for path, sha256 in hashers.map(self._hash, pending):
+                if sha256 is None:
+                    with self._stats_lock:
+                        self.stats.failed += 1
+                    continue
+                existing = self.dedup_index.lookup_import(sha256)
+                if sha256 in seen or (existing and existing != path):
+                    self.stats.duplicates += 1
+                    continue
+                seen.add(sha256)
+                
+                batch.append((path, sha256))
+                if len(batch) >= self.batch_size:
+                    # Bound the batches waiting for a sender so memory stays flat
+                    if len(in_flight) >= self.concurrency:
+                        in_flight.pop(0).result()
+                    in_flight.append(senders.submit(self._send_batch, batch))
+                    batch = []
+            
+            if batch:
+                in_flight.append(senders.submit(self._send_batch, batch))
+            for future in in_flight:
+                future.result()
+        
+        return self.stats
@@ -5,8 +5,21 @@ Configuration management for Lexicon Track Adder Bot
 
 import json
 import os
-from typing import Dict, Any, Optional
-from dataclasses import dataclass, asdict
+from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, asdict, field, fields
+
+# Settings that take effect while the bot is running; the rest need a restart
+RELOADABLE_FIELDS = (
+    "admin_user_id",
+    "users",
+    "download_dir",
+    "download_quota_mb",
+    "min_free_space_mb",
+    "lexicon_enabled",
+    "lexicon_api_url",
+    "status_edits_per_second",
+    "log_level",
+)
 
 
 @dataclass
@@ -14,9 +27,41 @@ class Config:
     """Configuration data class for the bot."""
     bot_token: str = ""
     admin_user_id: Optional[int] = None
+    # Further authorised users: {"user_id", "download_dir", "lexicon_api_url", "weight"}
+    users: List[Dict[str, Any]] = field(default_factory=list)
     download_dir: str = ""
     lexicon_enabled: bool = False
     lexicon_api_url: str = "http://localhost:48624/v1"
+    download_workers: int = 3
+    download_quota_mb: int = 0
+    min_free_space_mb: int = 100
+    status_edits_per_second: float = 1.0
+    messages_per_second: float = 25.0
+    chat_messages_per_second: float = 1.0
+    media_group_window: float = 1.0
+    name_files_from_tags: bool = False
+    dedup_index_path: str = "dedup_index.db"
+    job_journal_path: str = "job_journal.jsonl"
+    lexicon_batch_window: float = 1.0
+    lexicon_batch_size: int = 25
+    lexicon_index_refresh: float = 300.0
+    lexicon_retry_attempts: int = 3
+    lexicon_retry_base_delay: float = 0.5
+    lexicon_breaker_threshold: int = 5
+    lexicon_breaker_reset: float = 30.0
+    telegram_base_url: str = ""
+    telegram_base_file_url: str = ""
+    telegram_local_mode: bool = False
+    webhook_listen: str = "127.0.0.1"
+    webhook_port: int = 8443
+    webhook_path: str = "telegram"
+    webhook_url: str = ""
+    webhook_secret_token: str = ""
+    metrics_listen: str = "127.0.0.1"
+    metrics_port: int = 0
+    log_level: str = "INFO"
+    log_format: str = "json"
+    log_payloads_per_minute: int = 10
     
     def is_configured(self) -> bool:
         """Check if the bot is properly configured."""
@@ -67,6 +112,58 @@ def save_config(config: Config) -> bool:
         return False
 
 
+class ConfigReloader:
+    """
+    Reloads the config file when its modification time changes.
+    
+    Checking costs a single stat() call, so it can be done often; the file
+    is only read and parsed again after it has been edited.
+    """
+    
+    def __init__(self, config_file: str = "config.json"):
+        self.config_file = config_file
+        self._mtime = self._get_mtime()
+        self.config = (self._mtime is not None and self._read()) or Config()
+    
+    def _get_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+    
+    def _read(self) -> Optional[Config]:
+        try:
+            with open(self.config_file, 'r') as f:
+                return Config.from_dict(json.load(f))
+        except (json.JSONDecodeError, IOError, TypeError) as e:
+            print(f"Error loading config: {e}")
+            return None
+    
+    def check(self) -> List[str]:
+        """
+        Reload the config file if it changed since the last check.
+        
+        Returns:
+            Names of the settings that changed; ``config`` holds the new values
+        """
+        mtime = self._get_mtime()
+        if mtime is None or mtime == self._mtime:
+            return []
+        self._mtime = mtime
+        
+        # A half-written or invalid file keeps the previous settings
+        config = self._read()
+        if config is None:
+            return []
+        
+        changed = [
+            field.name for field in fields(Config)
+            if getattr(config, field.name) != getattr(self.config, field.name)
+        ]
+        self.config = config
+        return changed
+
+
 def update_config(updates: Dict[str, Any]) -> bool:
     """Update existing configuration with new values."""
     config = load_config()
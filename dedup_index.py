@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Persistent duplicate detection for Lexicon Track Adder Bot
+"""
+
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """
+    SQLite index of files that have already been downloaded.
+    
+    Files are looked up by Telegram's ``file_unique_id`` (which is stable
+    across forwards) before anything is downloaded, and by the SHA-256 of the
+    content as a fallback for the same track uploaded as a different file.
+    Entries whose file has since been deleted are dropped on lookup.
+    
+    Files added to Lexicon by a bulk import are kept in a table of their
+    own, since a download is not necessarily in Lexicon.
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY, "
+                "file_unique_id TEXT UNIQUE, "
+                "sha256 TEXT NOT NULL, "
+                "path TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS imports ("
+                "id INTEGER PRIMARY KEY, "
+                "sha256 TEXT NOT NULL, "
+                "path TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS imports_sha256 ON imports (sha256)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS imports_path ON imports (path)")
+    
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+    
+    def lookup(self, file_unique_id: str) -> Optional[str]:
+        """
+        Find an existing download by Telegram file_unique_id.
+        
+        Args:
+            file_unique_id: The Telegram file_unique_id
+        
+        Returns:
+            Path to the existing file, or None if unknown
+        """
+        if not file_unique_id:
+            return None
+        return self._lookup("file_unique_id", file_unique_id)
+    
+    def lookup_hash(self, sha256: str) -> Optional[str]:
+        """
+        Find an existing download by content hash.
+        
+        Args:
+            sha256: SHA-256 hex digest of the content
+        
+        Returns:
+            Path to the existing file, or None if unknown
+        """
+        return self._lookup("sha256", sha256)
+    
+    def lookup_path(self, path: str, table: str = "files") -> Optional[Tuple[str, int]]:
+        """
+        Find what was recorded for a file path.
+        
+        Args:
+            path: Where the file is stored
+            table: "files" for downloads, or "imports" for files a bulk import added to Lexicon
+        
+        Returns:
+            Tuple of (sha256, size), or None if the path is unknown
+        """
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT sha256, size FROM {table} WHERE path = ? ORDER BY id DESC LIMIT 1", (path,)
+            ).fetchone()
+    
+    def lookup_import(self, sha256: str) -> Optional[str]:
+        """
+        Find a file with this content that a bulk import added to Lexicon.
+        
+        Args:
+            sha256: SHA-256 hex digest of the content
+        
+        Returns:
+            Path of the imported file, or None if the content was never imported
+        """
+        return self._lookup("sha256", sha256, "imports")
+    
+    def record_import(self, sha256: str, path: str, size: int) -> None:
+        """
+        Record a file a bulk import added to Lexicon.
+        
+        Args:
+            sha256: SHA-256 hex digest of the content
+            path: Where the file is stored
+            size: File size in bytes
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO imports (sha256, path, size, created) VALUES (?, ?, ?, ?)",
+                (sha256, path, size, time.time())
+            )
+    
+    def record(self, sha256: str, path: str, size: int, file_unique_id: Optional[str] = None) -> None:
+        """
+        Record a downloaded file.
+        
+        Args:
+            sha256: SHA-256 hex digest of the content
+            path: Where the file is stored
+            size: File size in bytes
+            file_unique_id: The Telegram file_unique_id, if known
+        """
+        with self._lock, self._conn:
+            if file_unique_id:
+                self._conn.execute("DELETE FROM files WHERE file_unique_id = ?", (file_unique_id,))
+            self._conn.execute(
+                "INSERT INTO files (file_unique_id, sha256, path, size, created) VALUES (?, ?, ?, ?, ?)",
+                (file_unique_id or None, sha256, path, size, time.time())
+            )
+    
+    def _lookup(self, column: str, value: str, table: str = "files") -> Optional[str]:
+        """Return the first entry for ``column = value`` whose file still exists."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, path FROM {table} WHERE {column} = ? ORDER BY id", (value,)
+            ).fetchall()
+            
+            for row_id, path in rows:
+                if os.path.exists(path):
+                    return path
+                # The file was moved or deleted since it was recorded
+                logger.info(f"Dropping stale dedup entry: {path}")
+                with self._conn:
+                    self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+        
+        return None
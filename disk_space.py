@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Disk space admission control for Lexicon Track Adder Bot
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+from utils import format_file_size
+from error_handler import InsufficientSpaceError
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# How long a download waits for others to make room before giving up
+SPACE_WAIT_SECONDS = 300.0
+
+# Free space can also change outside the bot, so waiters re-check this often
+SPACE_POLL_SECONDS = 5.0
+
+# Files can be added or removed outside the bot, so the directory is
+# rescanned when its last scan is older than this
+USED_RESCAN_SECONDS = 60.0
+
+
+class DiskSpaceManager:
+    """
+    Reserves disk space for downloads before they start.
+    
+    Telegram reports a file's size up front, so each queued or running
+    download reserves that much space. A download is admitted only if it
+    fits in the free space left after existing reservations, less a safety
+    margin, and within the optional quota for the download directory. A
+    download that could fit once others finish waits; one that cannot fit
+    at all is refused before any bandwidth is spent on it.
+    
+    Space a running download has already written counts against both the
+    free space and its reservation until it finishes, which errs on the side
+    of caution. The size of the directory is kept up to date by the bot's
+    own downloads and rescanned in a thread now and then, and always before
+    a download is refused for the quota.
+    """
+    
+    def __init__(self, directory: str, quota_bytes: int = 0, min_free_bytes: int = 0):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self._lock = threading.Lock()
+        self._reservations: Dict[str, int] = {}
+        self._used: Optional[int] = None
+        self._scanned_at = 0.0
+        self._scan: Optional[asyncio.Future] = None
+        self._space_freed: Optional[asyncio.Event] = None
+    
+    @property
+    def reserved(self) -> int:
+        """Bytes reserved by queued and running downloads."""
+        with self._lock:
+            return sum(self._reservations.values())
+    
+    @property
+    def used(self) -> int:
+        """Bytes used by files in the download directory, scanned on first use."""
+        if self._used is None:
+            self._used = self._scan_used()
+            self._scanned_at = time.monotonic()
+        return self._used
+    
+    def _scan_used(self) -> int:
+        """Add up the size of the files in the download directory."""
+        total = 0
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        except OSError as e:
+            logger.error(f"Error scanning download directory {self.directory}: {e}")
+        return total
+    
+    async def refresh(self, max_age: float = USED_RESCAN_SECONDS) -> None:
+        """
+        Rescan the download directory in a thread if the last scan is too old.
+        
+        Args:
+            max_age: Seconds a scan stays good for; 0 always rescans
+        """
+        if self._scan is None:
+            if self._used is not None and time.monotonic() - self._scanned_at < max_age:
+                return
+            # Callers arriving while a scan runs wait for the same one
+            self._scan = asyncio.ensure_future(self._rescan())
+        await asyncio.shield(self._scan)
+    
+    async def _rescan(self) -> None:
+        try:
+            self._used = await asyncio.to_thread(self._scan_used)
+            self._scanned_at = time.monotonic()
+        finally:
+            self._scan = None
+    
+    async def check_fresh(self, size: int) -> Optional[str]:
+        """
+        Like ``check``, with the directory rescanned first if the last scan is
+        old, and again before refusing in case files were removed since.
+        """
+        await self.refresh()
+        reason = self.check(size)
+        if reason and self.quota_bytes:
+            await self.refresh(max_age=0)
+            reason = self.check(size)
+        return reason
+    
+    def _capacity(self) -> Optional[int]:
+        """Bytes a download could use if nothing else were reserved, or None if unknown."""
+        try:
+            capacity = shutil.disk_usage(self.directory).free - self.min_free_bytes
+        except OSError as e:
+            logger.warning(f"Could not check free space in {self.directory}: {e}")
+            return None
+        if self.quota_bytes:
+            capacity = min(capacity, self.quota_bytes - self.used)
+        return capacity
+    
+    def check(self, size: int) -> Optional[str]:
+        """
+        Check whether a download could ever fit.
+        
+        Args:
+            size: Size of the file in bytes
+        
+        Returns:
+            Why the download must be refused, or None if it fits now or once
+            other downloads finish
+        """
+        capacity = self._capacity()
+        if capacity is None or size <= capacity:
+            return None
+        if self.quota_bytes and self.quota_bytes - self.used < size:
+            return (
+                f"Download folder quota of {format_file_size(self.quota_bytes)} reached "
+                f"({format_file_size(self.used)} used, file is {format_file_size(size)})"
+            )
+        return f"Not enough free disk space for a {format_file_size(size)} file"
+    
+    def reserve(self, key: str, size: int) -> bool:
+        """
+        Reserve space for a download if there is room now.
+        
+        Args:
+            key: Identifier of the download; reserving again keeps one reservation
+            size: Size of the file in bytes
+        
+        Returns:
+            True if the space is reserved
+        """
+        capacity = self._capacity()
+        with self._lock:
+            if key in self._reservations:
+                return True
+            if capacity is not None and size > capacity - sum(self._reservations.values()):
+                return False
+            self._reservations[key] = size
+            return True
+    
+    async def acquire(self, key: str, size: int, timeout: float = SPACE_WAIT_SECONDS) -> None:
+        """
+        Reserve space for a download, waiting for other downloads to make room.
+        
+        Args:
+            key: Identifier of the download
+            size: Size of the file in bytes
+            timeout: Seconds to wait before giving up
+        
+        Raises:
+            InsufficientSpaceError: If the file can't fit, now or within ``timeout``
+        """
+        deadline = time.monotonic() + timeout
+        while not self.reserve(key, size):
+            reason = await self.check_fresh(size)
+            if reason:
+                raise InsufficientSpaceError(reason)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise InsufficientSpaceError(
+                    f"Timed out waiting for disk space for a {format_file_size(size)} file"
+                )
+            
+            if self._space_freed is None:
+                self._space_freed = asyncio.Event()
+            self._space_freed.clear()
+            try:
+                await asyncio.wait_for(self._space_freed.wait(), min(remaining, SPACE_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+    
+    def release(self, key: str) -> None:
+        """Drop a download's reservation without writing anything."""
+        with self._lock:
+            size = self._reservations.pop(key, None)
+        if size is not None and self._space_freed is not None:
+            self._space_freed.set()
+    
+    def commit(self, key: str, size: int) -> None:
+        """
+        Turn a download's reservation into a file on disk.
+        
+        Args:
+            key: Identifier of the download
+            size: Size of the file that was kept
+        """
+        self.release(key)
+        if self._used is not None:
+            self._used += size
@@ -4,25 +4,398 @@ Download manager for handling file downloads from Telegram
 """
 
 import os
+import errno
+import shutil
 import asyncio
 import logging
-from typing import Optional, Callable
+import time
+import weakref
+import threading
+import httpx
+from typing import Optional, Callable, Dict, Set, Tuple
 from telegram import Update, Document
 from telegram.ext import ContextTypes
-from utils import sanitize_filename, format_file_size
-from error_handler import handle_bot_error, DownloadError
+from utils import sanitize_filename, format_file_size, redact_bot_token
+from error_handler import DownloadError
+from dedup_index import DedupIndex, hash_file
+from disk_space import DiskSpaceManager
+from id3 import read_tags
+from metrics import TELEGRAM_GET_FILE_SECONDS, DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT
+from profiling import trace_stage
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_ATTEMPTS = 3
+
+# Largest file the cloud Bot API lets bots download; a local server has no limit
+CLOUD_FILE_SIZE_LIMIT = 20 * 1024 * 1024
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _fsync_directory(directory: str) -> None:
+    """Flush a directory entry to disk so a new link survives a crash."""
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_file(file_path: str) -> None:
+    """Flush a file's data to disk."""
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def is_local_file(file_path: Optional[str]) -> bool:
+    """Check whether getFile returned a path on this machine (local Bot API server)."""
+    return bool(file_path) and os.path.isabs(file_path) and os.path.isfile(file_path)
+
+
+def _copy_file(source: str, destination: str) -> None:
+    """
+    Copy a file, inside the kernel where possible.
+    
+    ``os.copy_file_range`` avoids moving the data through user space (and
+    can share blocks on filesystems that support it). If it isn't available
+    or refuses the pair of filesystems, the rest is copied in chunks.
+    """
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except OSError as e:
+                # Older kernels can't copy between filesystems
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+        if remaining > 0:
+            # Both files are positioned where the fast path stopped
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+
+def take_local_file(source: str, destination: str) -> str:
+    """
+    Move a file stored by a local Bot API server to ``destination`` without HTTP.
+    
+    A hard link is tried first: nothing is copied and the server keeps its
+    own copy. If a link can't be made, for example across filesystems, the
+    file is copied. The server's file is never moved or changed, since the
+    server may still serve or clean it up itself.
+    
+    Args:
+        source: Path returned by getFile
+        destination: Where the file should end up
+    
+    Returns:
+        How the file was taken: "hardlink" or "copy"
+    """
+    if os.path.exists(destination):
+        os.remove(destination)
+    
+    try:
+        os.link(source, destination)
+        # The server may not have flushed the data it wrote
+        _fsync_file(destination)
+        return "hardlink"
+    except OSError as e:
+        logger.debug(f"Can't link {source} to {destination}, copying instead: {e}")
+    
+    _copy_file(source, destination)
+    return "copy"
+
+
+class ActiveDownload:
+    """Progress of a download that is running."""
+    __slots__ = ("file_name", "size", "done", "started")
+    
+    def __init__(self, file_name: str, size: int):
+        self.file_name = file_name
+        self.size = size
+        self.done = 0
+        self.started = time.monotonic()
+
+
+class FilenameIndex:
+    """
+    In-memory index of the file names in a download directory.
+    
+    The directory is scanned once, after which unique names are allocated
+    without touching the filesystem. Each ``name``/``ext`` pair remembers
+    the next free ``_n`` suffix, so resolving a clash does not re-probe
+    every earlier duplicate. Allocation reserves the name immediately, so
+    concurrent downloads never pick the same path.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._names: Set[str] = set()
+        self._next_suffix: Dict[Tuple[str, str], int] = {}
+        self.refresh()
+    
+    @staticmethod
+    def _key(filename: str) -> str:
+        """Normalise a name so case-insensitive filesystems are handled."""
+        return filename.casefold()
+    
+    def refresh(self) -> None:
+        """Rebuild the index from the directory contents."""
+        names = set()
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    names.add(self._key(entry.name))
+        except OSError as e:
+            logger.error(f"Error scanning download directory {self.directory}: {e}")
+        
+        with self._lock:
+            self._names = names
+            self._next_suffix = {}
+    
+    def allocate(self, filename: str) -> str:
+        """
+        Reserve a unique path for a file name.
+        
+        Args:
+            filename: The sanitized file name
+        
+        Returns:
+            Full path that no other file or allocation is using
+        """
+        with self._lock:
+            if self._key(filename) not in self._names:
+                self._names.add(self._key(filename))
+                return os.path.join(self.directory, filename)
+            
+            name, ext = os.path.splitext(filename)
+            suffix_key = (self._key(name), self._key(ext))
+            counter = self._next_suffix.get(suffix_key, 1)
+            candidate = f"{name}_{counter}{ext}"
+            while self._key(candidate) in self._names:
+                counter += 1
+                candidate = f"{name}_{counter}{ext}"
+            
+            self._next_suffix[suffix_key] = counter + 1
+            self._names.add(self._key(candidate))
+            return os.path.join(self.directory, candidate)
+    
+    def release(self, file_path: str) -> None:
+        """Forget a path whose file was removed or never written."""
+        with self._lock:
+            self._names.discard(self._key(os.path.basename(file_path)))
+
 
 class DownloadManager:
     """Manages file downloads from Telegram."""
     
-    def __init__(self, download_dir: str):
+    def __init__(
+        self,
+        download_dir: str,
+        dedup_index: Optional[DedupIndex] = None,
+        filename_index: Optional[FilenameIndex] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        name_from_tags: bool = False,
+        disk_space: Optional[DiskSpaceManager] = None
+    ):
         self.download_dir = download_dir
-        self.active_downloads = {}  # Track active downloads by message_id
+        self.dedup_index = dedup_index
+        self.disk_space = disk_space
+        self.name_from_tags = name_from_tags
+        self._filename_index = filename_index
+        self._http_client = http_client
+        # Running downloads by the path reserved for them
+        self.active_downloads: Dict[str, ActiveDownload] = {}
+        # Held while a part file is being written and moved into place
+        self._part_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
     
-    @handle_bot_error
+    def find_existing(self, document) -> Optional[str]:
+        """
+        Find a previous download of the same Telegram file.
+        
+        Args:
+            document: The Telegram document or audio object
+        
+        Returns:
+            Path to the existing file, or None if it hasn't been downloaded
+        """
+        if not self.dedup_index:
+            return None
+        return self.dedup_index.lookup(getattr(document, 'file_unique_id', None))
+    
+    @property
+    def filename_index(self) -> FilenameIndex:
+        """Index used to allocate unique file names, built on first use."""
+        if self._filename_index is None:
+            self._filename_index = FilenameIndex(self.download_dir)
+        return self._filename_index
+    
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """HTTP client used to fetch file contents, created on first use."""
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=30)
+        return self._http_client
+    
+    def part_path(self, document) -> str:
+        """
+        Path of the temporary file a document is downloaded into.
+        
+        The name only depends on the Telegram file, so an interrupted
+        download is picked up again by the next attempt. Downloads of the
+        same file take turns with it rather than write it at the same time.
+        """
+        part_id = getattr(document, 'file_unique_id', None) or document.file_id
+        return os.path.join(self.download_dir, f".{sanitize_filename(part_id)}.part")
+    
+    async def _fetch_to_part(
+        self,
+        url: str,
+        part_path: str,
+        expected_size: int,
+        progress_callback: Optional[Callable] = None
+    ) -> int:
+        """
+        Download a URL into a part file in chunks, resuming what is there.
+        
+        Args:
+            url: The file URL
+            part_path: Temporary file to write to
+            expected_size: Size reported by Telegram, or 0 if unknown
+            progress_callback: Optional coroutine called with (bytes_done, total_bytes)
+        
+        Returns:
+            Size of the part file once complete
+        
+        Raises:
+            DownloadError: If the file could not be fetched after all attempts
+        """
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if expected_size and offset == expected_size:
+                return offset
+            if expected_size and offset > expected_size:
+                os.remove(part_path)
+                offset = 0
+            
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                async with self.http_client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 416:
+                        # Our part file doesn't line up with the server's copy
+                        os.remove(part_path)
+                        continue
+                    if response.status_code not in (200, 206):
+                        raise DownloadError(f"Telegram file server returned {response.status_code}")
+                    
+                    # A plain 200 means the server ignored the range, so start over
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    done = offset if response.status_code == 206 else 0
+                    with open(part_path, mode) as f:
+                        async for chunk in response.aiter_bytes():
+                            f.write(chunk)
+                            done += len(chunk)
+                            DOWNLOAD_BYTES.inc(len(chunk))
+                            if progress_callback:
+                                await progress_callback(done, expected_size)
+                        f.flush()
+                        await asyncio.to_thread(os.fsync, f.fileno())
+                
+                size = os.path.getsize(part_path)
+                if expected_size and size != expected_size:
+                    raise DownloadError(f"Incomplete download: got {size} of {expected_size} bytes")
+                return size
+            
+            except (httpx.HTTPError, DownloadError) as e:
+                # File URLs contain the bot token, and httpx errors can quote them
+                reason = redact_bot_token(str(e))
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    raise DownloadError(f"Download failed after {attempt} attempts: {reason}") from None
+                logger.warning(f"Download interrupted ({reason}), resuming (attempt {attempt + 1})")
+                await asyncio.sleep(attempt)
+        
+        raise DownloadError("File could not be downloaded.")
+    
+    def _tag_file_path(self, part_path: str, file_path: str) -> str:
+        """Swap a reserved path for one named "Artist - Title.mp3" from the file's tags."""
+        tags = read_tags(part_path)
+        if not tags or not tags.artist or not tags.title:
+            return file_path
+        
+        tag_path = self.filename_index.allocate(sanitize_filename(f"{tags.artist} - {tags.title}.mp3"))
+        self.filename_index.release(file_path)
+        return tag_path
+    
+    def _move_into_place(self, part_path: str, file_path: str) -> str:
+        """
+        Move a finished part file to its reserved path without overwriting.
+        
+        A file may have been added to the directory after it was indexed,
+        so the part file is hard-linked to the path, which fails rather than
+        replace it, and only then unlinked. If the name turns out to be
+        taken, it stays reserved in the index and the next free name is tried.
+        
+        Args:
+            part_path: The complete part file
+            file_path: Path reserved for it in the filename index
+        
+        Returns:
+            The path the file ended up at
+        """
+        while True:
+            try:
+                os.link(part_path, file_path)
+                break
+            except FileExistsError:
+                logger.warning(f"{file_path} appeared since the directory was indexed, picking another name")
+                file_path = self.filename_index.allocate(os.path.basename(file_path))
+        os.unlink(part_path)
+        return file_path
+    
+    @trace_stage
+    async def register_download(self, document, file_path: str) -> str:
+        """
+        Record a finished download in the dedup index.
+        
+        If a file with identical content already exists, the new copy is
+        removed and the existing path is returned instead.
+        
+        Args:
+            document: The Telegram document or audio object
+            file_path: Path to the newly downloaded file
+        
+        Returns:
+            Path of the file to use for this document
+        """
+        if not self.dedup_index:
+            return file_path
+        
+        sha256 = await asyncio.to_thread(hash_file, file_path)
+        file_unique_id = getattr(document, 'file_unique_id', None)
+        
+        existing = self.dedup_index.lookup_hash(sha256)
+        if existing and existing != file_path:
+            logger.info(f"Removing duplicate of {existing}: {file_path}")
+            os.remove(file_path)
+            self.filename_index.release(file_path)
+            file_path = existing
+        
+        self.dedup_index.record(sha256, file_path, os.path.getsize(file_path), file_unique_id)
+        return file_path
+    
+    @trace_stage
     async def download_file(
         self, 
         document, 
@@ -37,10 +410,14 @@ class DownloadManager:
             document: The Telegram document or audio object
             context: The Telegram context
             update: The Telegram update
-            progress_callback: Optional callback for progress updates
-            
+            progress_callback: Optional coroutine called with (bytes_done, total_bytes);
+                when given, it replaces the start and completion replies
+        
         Returns:
             Path to the downloaded file, or None if failed
+        
+        Raises:
+            DownloadError: If the file could not be downloaded
         """
         file_name = getattr(document, 'file_name', None) or f"{getattr(document, 'title', 'audio')}.mp3"
         file_id = document.file_id
@@ -50,54 +427,83 @@ class DownloadManager:
         if not file_name or not file_id:
             raise DownloadError("Invalid file information provided.")
         
-        # Sanitize filename
+        # Sanitize filename and reserve a unique path for it
         safe_filename = sanitize_filename(file_name)
-        file_path = os.path.join(self.download_dir, safe_filename)
+        file_path = self.filename_index.allocate(safe_filename)
+        
+        reserved_path = file_path
+        active = self.active_downloads[reserved_path] = ActiveDownload(safe_filename, file_size or 0)
+        user_callback = progress_callback
         
-        # Handle duplicate filenames
-        counter = 1
-        original_path = file_path
-        while os.path.exists(file_path):
-            name, ext = os.path.splitext(original_path)
-            file_path = f"{name}_{counter}{ext}"
-            counter += 1
+        async def track_progress(done: int, total: int) -> None:
+            active.done = done
+            if user_callback:
+                await user_callback(done, total)
         
         try:
             # Get file object from Telegram
+            started = time.monotonic()
             file = await context.bot.get_file(file_id)
+            TELEGRAM_GET_FILE_SECONDS.observe(time.monotonic() - started)
             
             # Send initial message
-            await update.message.reply_text(
-                f"📥 Starting download: {safe_filename}\n"
-                f"Size: {format_file_size(file_size)}"
-            )
-            
-            # Download the file
-            await file.download_to_drive(file_path)
-            
-            # Verify file was downloaded
-            if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            if progress_callback:
+                await progress_callback(0, file_size)
+            else:
                 await update.message.reply_text(
-                    f"✅ Download complete: {safe_filename}\n"
-                    f"Saved to: {file_path}"
+                    f"📥 Starting download: {safe_filename}\n"
+                    f"Size: {format_file_size(file_size)}"
                 )
-                return file_path
-            else:
-                raise DownloadError("File was not saved correctly.")
+            
+            # Download into a part file, then move it into place in one step
+            # so only complete files ever appear in the download directory
+            part_path = self.part_path(document)
+            async with self._part_locks.setdefault(part_path, asyncio.Lock()):
+                if is_local_file(file.file_path):
+                    # A local Bot API server has already stored the file on disk
+                    method = await asyncio.to_thread(take_local_file, file.file_path, part_path)
+                    size = os.path.getsize(part_path)
+                    logger.debug(f"Took {file.file_path} from the local Bot API server by {method}")
+                    if file_size and size != file_size:
+                        raise DownloadError(f"Incomplete file: got {size} of {file_size} bytes")
+                    await track_progress(size, file_size)
+                else:
+                    started = time.monotonic()
+                    size = await self._fetch_to_part(file.file_path, part_path, file_size, track_progress)
+                    elapsed = time.monotonic() - started
+                    if size > 0 and elapsed > 0:
+                        DOWNLOAD_THROUGHPUT.observe(size / elapsed)
                 
+                # Verify file was downloaded
+                if size <= 0:
+                    raise DownloadError("File was not saved correctly.")
+                if self.name_from_tags:
+                    file_path = self._tag_file_path(part_path, file_path)
+                file_path = self._move_into_place(part_path, file_path)
+        
         except Exception as e:
-            # Clean up partial download if it exists
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError:
-                    logger.error(f"Failed to remove partial download: {file_path}")
+            # The part file is kept so the next attempt can resume it
+            self.filename_index.release(file_path)
             
             # Re-raise as DownloadError
             if isinstance(e, DownloadError):
                 raise
             else:
-                raise DownloadError(f"Failed to download file: {str(e)}")
+                raise DownloadError(f"Failed to download file: {redact_bot_token(str(e))}") from None
+        finally:
+            self.active_downloads.pop(reserved_path, None)
+        
+        # The file is in place from here on, so its name stays taken whatever happens
+        try:
+            await asyncio.to_thread(_fsync_directory, self.download_dir)
+        except OSError as e:
+            logger.warning(f"Could not flush {self.download_dir} to disk: {e}")
+        if not progress_callback:
+            await update.message.reply_text(
+                f"✅ Download complete: {safe_filename}\n"
+                f"Saved to: {file_path}"
+            )
+        return file_path
     
     def get_download_info(self, file_path: str) -> dict:
         """Get information about a downloaded file."""
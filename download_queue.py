@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Download job queue for Lexicon Track Adder Bot
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DownloadJob:
+    """A single file, or an album of files, waiting to be downloaded."""
+    job_id: int
+    chat_id: int
+    document: Any
+    file_name: str
+    update: Any = None
+    context: Any = None
+    status: Any = None
+    key: str = ""
+    message_id: Optional[int] = None
+    created: float = field(default_factory=time.monotonic)
+    # Telegram user who sent the file; jobs are shared fairly between users
+    user_id: Optional[int] = None
+    # The files of an album, which are processed together as one job
+    parts: List['DownloadJob'] = field(default_factory=list)
+    # Resolved once the job's final result is shown, and that of the chat's
+    # previous job, so results can be shown in the order files were sent
+    reported: Optional[asyncio.Future] = None
+    previous: Optional[asyncio.Future] = None
+
+
+class DownloadQueue:
+    """
+    Bounded pool of async download workers with weighted fair sharing.
+    
+    Up to ``workers`` jobs run in parallel, including several from the same
+    chat. Each job is chained to the previous job of its chat through
+    ``previous`` and ``reported``, so whoever shows the results can keep
+    them in the order the files were sent.
+    
+    Free workers are shared between users by start-time fair queuing: jobs
+    wait in one queue per user, each tagged with a virtual start time one
+    file's worth (divided by the user's weight) after the previous job of
+    the same user, and the waiting job with the earliest tag runs next.
+    Users sharing a group chat are therefore treated as fairly as users in
+    their own chats; the order of results within a chat only depends on
+    the ``previous``/``reported`` chain. Someone forwarding hundreds
+    of tracks therefore only gets their share of the workers, and a single
+    track from anyone else starts as soon as a worker frees up.
+    """
+    
+    def __init__(
+        self,
+        process: Callable[[DownloadJob], Awaitable[None]],
+        workers: int = 3,
+        weight: Optional[Callable[[Hashable], float]] = None
+    ):
+        self.process = process
+        self.workers = max(1, workers)
+        self.weight = weight or (lambda flow: 1.0)
+        self._job_ids = itertools.count(1)
+        self._flows: Dict[Hashable, Deque[DownloadJob]] = {}
+        self._last_reported: Dict[int, asyncio.Future] = {}
+        self._tags: Dict[int, float] = {}
+        self._last_tag: Dict[Hashable, float] = {}
+        self._virtual_time = 0.0
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.active_jobs: Dict[int, DownloadJob] = {}
+    
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return sum(len(jobs) for jobs in list(self._flows.values()))
+    
+    @property
+    def backlog(self) -> int:
+        """Number of jobs waiting or in progress."""
+        return self.pending + len(self.active_jobs)
+    
+    def next_job_id(self) -> int:
+        """Allocate the next job number."""
+        return next(self._job_ids)
+    
+    @staticmethod
+    def flow(job: DownloadJob) -> Hashable:
+        """Who a job is shared fairly on behalf of: its user, or else its chat."""
+        return job.user_id if job.user_id is not None else ("chat", job.chat_id)
+    
+    def submit(self, job: DownloadJob) -> int:
+        """
+        Add a job to the queue.
+        
+        Args:
+            job: The job to process
+        
+        Returns:
+            Number of jobs queued ahead of this one
+        """
+        ahead = self.backlog
+        
+        # An album costs as much as the files in it
+        flow = self.flow(job)
+        cost = max(1, len(job.parts)) / max(self.weight(flow), 0.001)
+        start = max(self._virtual_time, self._last_tag.get(flow, 0.0))
+        self._tags[job.job_id] = start
+        self._last_tag[flow] = start + cost
+        
+        if job.reported is None:
+            job.reported = asyncio.get_running_loop().create_future()
+        job.previous = self._last_reported.get(job.chat_id)
+        self._last_reported[job.chat_id] = job.reported
+        job.reported.add_done_callback(lambda future: self._forget_reported(job.chat_id, future))
+        
+        self._flows.setdefault(flow, deque()).append(job)
+        self._ready_queue().put_nowait(None)
+        return ahead
+    
+    def start(self) -> None:
+        """Start the worker tasks."""
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"download-worker-{index}"))
+        logger.info(f"Started {self.workers} download workers")
+    
+    async def stop(self) -> None:
+        """Stop the worker tasks, abandoning jobs that have not started."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def _forget_reported(self, chat_id: int, future: asyncio.Future) -> None:
+        """Stop chaining to a job once its result is shown and nothing follows it."""
+        if self._last_reported.get(chat_id) is future:
+            del self._last_reported[chat_id]
+    
+    def _ready_queue(self) -> asyncio.Queue:
+        """One token per event that may have made a job eligible to run."""
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+        return self._ready
+    
+    def _next_job(self) -> Optional[DownloadJob]:
+        """Take the eligible job with the earliest start tag."""
+        best = None
+        # Tags only grow within a flow, so each flow's first job is its earliest
+        for jobs in self._flows.values():
+            if not jobs:
+                continue
+            if best is None or self._tags[jobs[0].job_id] < self._tags[best[0].job_id]:
+                best = jobs
+        if best is None:
+            return None
+        
+        job = best.popleft()
+        self._virtual_time = max(self._virtual_time, self._tags.pop(job.job_id))
+        if not best:
+            del self._flows[self.flow(job)]
+        return job
+    
+    async def _worker(self) -> None:
+        """Process jobs until cancelled."""
+        ready = self._ready_queue()
+        while True:
+            await ready.get()
+            job = self._next_job()
+            if job is None:
+                continue
+            self.active_jobs[job.job_id] = job
+            
+            try:
+                await self.process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error processing job #{job.job_id}: {e}")
+                # No result will be shown, so don't hold up the chat's later jobs
+                if not job.reported.done():
+                    job.reported.set_result(None)
+            finally:
+                del self.active_jobs[job.job_id]
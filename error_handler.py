@@ -4,15 +4,19 @@ Error handling for Lexicon Track Adder Bot
 """
 
 import logging
-import traceback
-from typing import Optional
-from telegram import Update
-from telegram.ext import ContextTypes
+from typing import TYPE_CHECKING, Optional
+from metrics import ERRORS
+
+if TYPE_CHECKING:
+    # Only needed for annotations; keeps the Lexicon client and bulk import
+    # usable without loading telegram
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 logger = logging.getLogger(__name__)
 
 
-async def error_handler(update: Optional[Update], context: ContextTypes.DEFAULT_TYPE) -> None:
+async def error_handler(update: Optional['Update'], context: 'ContextTypes.DEFAULT_TYPE') -> None:
     """
     Log the error and send a telegram message to notify the user.
     
@@ -21,8 +25,8 @@ async def error_handler(update: Optional[Update], context: ContextTypes.DEFAULT_
         context: The context of the error
     """
     # Log the error
-    logger.error(f"Exception while handling an update: {context.error}")
-    logger.error(traceback.format_exc())
+    ERRORS.labels(type(context.error).__name__).inc()
+    logger.error(f"Exception while handling an update: {context.error}", exc_info=context.error)
     
     # Only send error message if we have a chat to send to
     if update and update.effective_chat:
@@ -34,6 +38,7 @@ async def error_handler(update: Optional[Update], context: ContextTypes.DEFAULT_
                      "Please try again or contact the administrator if the problem persists."
             )
         except Exception as e:
+            ERRORS.labels(type(e).__name__).inc()
             # If we can't even send the error message, just log it
             logger.error(f"Failed to send error message: {e}")
 
@@ -53,11 +58,26 @@ class DownloadError(BotError):
     pass
 
 
+class InsufficientSpaceError(DownloadError):
+    """Exception raised when there is no room on disk for a download."""
+    pass
+
+
 class LexiconError(BotError):
     """Exception raised for Lexicon API errors."""
     pass
 
 
+class LexiconUnavailableError(LexiconError):
+    """Exception raised when Lexicon is known to be down and requests fail fast."""
+    pass
+
+
+class LexiconRejectedError(LexiconError):
+    """Exception raised when Lexicon refuses a request and retrying it would not help."""
+    pass
+
+
 class PermissionError(BotError):
     """Exception raised for permission errors."""
     pass
@@ -69,6 +89,7 @@ def handle_bot_error(func):
         try:
             return await func(*args, **kwargs)
         except ConfigurationError as e:
+            ERRORS.labels(type(e).__name__).inc()
             # Handle configuration errors
             update = args[0] if args else None
             if update and hasattr(update, 'message') and update.message:
@@ -78,6 +99,7 @@ def handle_bot_error(func):
                 )
             logger.error(f"Configuration error: {e}")
         except DownloadError as e:
+            ERRORS.labels(type(e).__name__).inc()
             # Handle download errors
             update = args[0] if args else None
             if update and hasattr(update, 'message') and update.message:
@@ -87,6 +109,7 @@ def handle_bot_error(func):
                 )
             logger.error(f"Download error: {e}")
         except LexiconError as e:
+            ERRORS.labels(type(e).__name__).inc()
             # Handle Lexicon API errors
             update = args[0] if args else None
             if update and hasattr(update, 'message') and update.message:
@@ -96,6 +119,7 @@ def handle_bot_error(func):
                 )
             logger.error(f"Lexicon error: {e}")
         except PermissionError as e:
+            ERRORS.labels(type(e).__name__).inc()
             # Handle permission errors
             update = args[0] if args else None
             if update and hasattr(update, 'message') and update.message:
@@ -105,9 +129,9 @@ def handle_bot_error(func):
                 )
             logger.error(f"Permission error: {e}")
         except Exception as e:
+            ERRORS.labels(type(e).__name__).inc()
             # Handle unexpected errors
-            logger.error(f"Unexpected error in {func.__name__}: {e}")
-            logger.error(traceback.format_exc())
+            logger.error(f"Unexpected error in {func.__name__}: {e}", exc_info=True)
             
             update = args[0] if args else None
             if update and hasattr(update, 'message') and update.message:
@@ -0,0 +1,1197 @@
+#!/usr/bin/env python3
+"""
+Telegram handlers and application setup for Lexicon Track Adder Bot
+"""
+
+import os
+import logging
+import asyncio
+import secrets
+import time
+import importlib.util
+import dataclasses
+import httpx
+from typing import Any, Dict, List, Optional, Tuple
+from telegram import Update, Document
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from config import Config, ConfigReloader, RELOADABLE_FIELDS
+from users import UserProfile, load_user_profiles
+from utils import is_admin, is_authorized, is_mp3_file, validate_directory, format_file_size
+from download_manager import DownloadManager, FilenameIndex, ActiveDownload, CLOUD_FILE_SIZE_LIMIT
+from download_queue import DownloadJob, DownloadQueue
+from dedup_index import DedupIndex
+from disk_space import DiskSpaceManager, MB
+from status_message import StatusMessage
+from outbound import OutboundScheduler
+from media_group import MediaGroupCollector
+from id3 import TrackTags, read_tags
+from job_journal import JobJournal, RECEIVED, DOWNLOADING, DOWNLOADED, LEXICON_ADDED, DONE, FAILED
+from async_lexicon_client import AsyncLexiconClient
+from lexicon_batcher import LexiconBatcher
+from lexicon_index import LexiconLibraryIndex
+from resilience import RetryPolicy, CircuitBreaker
+from pipeline_stats import PipelineStats
+from profiling import (
+    trace_stage, trace_update, is_profiling, profile_for, PROFILE_MODES, DEFAULT_PROFILE_SECONDS,
+    MAX_PROFILE_SECONDS
+)
+from metrics import (
+    ERRORS, QUEUE_DEPTH, OUTBOUND_PENDING, DISK_RESERVED_BYTES, UPDATE_LATENCY_SECONDS, start_metrics_server
+)
+from error_handler import (
+    error_handler, handle_bot_error, DownloadError, LexiconError, LexiconRejectedError, LexiconUnavailableError
+)
+
+logger = logging.getLogger(__name__)
+
+# Dedup index kept in the download directory of each user with their own
+USER_DEDUP_INDEX = ".dedup_index.db"
+
+# Longest a job's result waits for that of the chat's previous job
+RESULT_ORDER_WAIT = 60.0
+
+
+@handle_bot_error
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /start command."""
+    config = context.bot_data.get('config')
+    
+    # Check if user is authorised
+    if not is_authorized(update.effective_user.id, context.bot_data['users']):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+    
+    if not config.is_configured():
+        if update.message:
+            await update.message.reply_text(
+                "Welcome to Lexicon Track Adder Bot!\n\n"
+                "The bot is not configured yet. Please run the setup script first:\n\n"
+                "`python bot.py --setup --download-dir /path/to/music --lexicon-enabled yes/no`\n\n"
+                "Replace `/path/to/music` with your desired download directory.\n"
+                "After setup is complete, restart the bot and send /start again."
+            )
+        return
+    else:
+        if update.message:
+            await update.message.reply_text(
+                "Welcome back! Send me an MP3 file and I'll download it for you."
+            )
+
+
+@handle_bot_error
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /help command."""
+    # Check if user is authorised
+    if not is_authorized(update.effective_user.id, context.bot_data['users']):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+    
+    help_text = """
+    *Lexicon Track Adder Bot Help*
+    
+    /start - Start the bot
+    /help - Show this help message
+    /status - Show downloads and recent statistics (administrator only)
+    /profile [seconds] [cpu|tasks] - Profile the bot (administrator only)
+    
+    *Usage:*
+    1. Get an MP3 file from @deezload2bot
+    2. Forward that file to this bot
+    3. The bot will download it to your specified folder
+    4. If enabled, it will add the file to your Lexicon library
+    
+    *Setup:*
+    If the bot is not configured, run:
+    `python bot.py --setup --download-dir /path/to/music --lexicon-enabled yes/no`
+    """
+    if update.message:
+        await update.message.reply_text(help_text, parse_mode="Markdown")
+
+
+def describe_download(download: ActiveDownload) -> str:
+    """Summarise the progress of a running download in one line."""
+    line = f"📥 {download.file_name}: {format_file_size(download.done)}"
+    if download.size:
+        line += f" of {format_file_size(download.size)} ({download.done * 100 // download.size}%)"
+    elapsed = time.monotonic() - download.started
+    if download.done and elapsed > 0:
+        line += f", {format_file_size(int(download.done / elapsed))}/s"
+    return line
+
+
+def describe_status(bot_data: Dict[str, Any]) -> str:
+    """
+    Describe what the bot is doing and how it has been performing.
+    
+    Args:
+        bot_data: The application's bot_data
+    
+    Returns:
+        Status report for the /status command
+    """
+    lines = ["📊 Status"]
+    
+    download_queue = bot_data.get('download_queue')
+    summary = bot_data['pipeline_stats'].summary() if bot_data.get('pipeline_stats') else None
+    if download_queue:
+        line = f"Jobs: {len(download_queue.active_jobs)} running, {download_queue.pending} queued"
+        if summary and summary.awaiting_lexicon:
+            line += f", {summary.awaiting_lexicon} waiting for Lexicon"
+        lines.append(line)
+    
+    download_managers = [bot_data['download_manager']] if bot_data.get('download_manager') else []
+    download_managers.extend(bot_data.get('user_download_managers', {}).values())
+    for download_manager in download_managers:
+        lines.extend(describe_download(download) for download in list(download_manager.active_downloads.values()))
+    
+    if summary:
+        span = f"{summary.window:.0f}s" if summary.window < 120 else f"{summary.window / 60:.0f} min"
+        lines.append(
+            f"\nLast {span}: {summary.completed} done, {summary.failed} failed, "
+            f"{format_file_size(summary.bytes_completed)} downloaded "
+            f"({format_file_size(int(summary.throughput))}/s)"
+        )
+        if summary.stage_averages:
+            stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in summary.stage_averages.items())
+            lines.append(f"Average time per job: {stages}")
+    
+    config = bot_data.get('config')
+    lexicon_clients = [bot_data['lexicon_client']] if bot_data.get('lexicon_client') else []
+    lexicon_clients.extend(client for client, _ in bot_data.get('user_lexicon_targets', {}).values())
+    lines.append("")
+    if not config or not config.lexicon_enabled:
+        lines.append("Lexicon: disabled")
+    for lexicon_client in lexicon_clients:
+        breaker = lexicon_client.circuit_breaker
+        if breaker.state == breaker.CLOSED:
+            health = "✅ healthy"
+        elif breaker.state == breaker.OPEN:
+            health = f"❌ unavailable, retrying in {breaker.retry_after():.0f}s"
+        else:
+            health = "⚠️ recovering"
+        lines.append(f"Lexicon ({lexicon_client.base_url}): {health}")
+    
+    outbound = bot_data.get('outbound')
+    if outbound and outbound.pending:
+        lines.append(f"Outgoing messages waiting: {outbound.pending}")
+    return "\n".join(lines)
+
+
+@handle_bot_error
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /status command."""
+    if not is_admin(update.effective_user.id, context.bot_data['config']):
+        if update.message:
+            await update.message.reply_text("❌ Only the administrator can see the bot's status.")
+        return
+    
+    await reply(update, context, describe_status(context.bot_data))
+
+
+@handle_bot_error
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /profile command: profile the running bot and report the results."""
+    if not is_admin(update.effective_user.id, context.bot_data['config']):
+        if update.message:
+            await update.message.reply_text("❌ Only the administrator can profile the bot.")
+        return
+    
+    args = context.args or []
+    try:
+        seconds = float(args[0]) if args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        seconds = 0
+    mode = args[1].lower() if len(args) > 1 else PROFILE_MODES[0]
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or mode not in PROFILE_MODES:
+        await reply(
+            update,
+            context,
+            f"Usage: /profile [seconds] [{'|'.join(PROFILE_MODES)}]\n"
+            f"Profiles for up to {MAX_PROFILE_SECONDS:g} seconds (default {DEFAULT_PROFILE_SECONDS:g})."
+        )
+        return
+    if is_profiling():
+        await reply(update, context, "⏱️ A profile is already running.")
+        return
+    
+    # Updates are handled concurrently, so the bot keeps working meanwhile
+    await reply(update, context, f"⏱️ Profiling for {seconds:g}s ({mode})...")
+    try:
+        summary = await profile_for(seconds, mode)
+    except RuntimeError:
+        # Another /profile started while the reply above was being sent
+        await reply(update, context, "⏱️ A profile is already running.")
+        return
+    await reply(update, context, summary)
+
+
+@handle_bot_error
+async def reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+    """Reply to an update's message, queueing the reply when there is an outbound scheduler."""
+    outbound = context.bot_data.get('outbound')
+    if outbound:
+        outbound.send(update.effective_chat.id, text, update.message.message_id)
+    else:
+        await update.message.reply_text(text)
+
+
+@handle_bot_error
+@trace_update
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle document and audio messages (MP3 files)."""
+    # Check if user is authorised
+    if not is_authorized(update.effective_user.id, context.bot_data['users']):
+        if update.message:
+            await reply(update, context, "❌ You are not authorized to use this bot.")
+        return
+    
+    # Get the document or audio file
+    document = None
+    file_name = None
+    
+    if update.message.document:
+        document = update.message.document
+        file_name = document.file_name
+    elif update.message.audio:
+        document = update.message.audio
+        file_name = document.file_name or f"{document.title or 'audio'}.mp3"
+    else:
+        if update.message:
+            await reply(update, context, "❌ No document or audio file found.")
+        return
+    
+    # Check if it's an MP3 file
+    if not is_mp3_file(file_name):
+        if update.message:
+            await reply(update, context, "❌ Only MP3 files are supported.")
+        return
+    
+    # The cloud Bot API refuses to hand out large files, so don't queue them
+    if not context.bot_data['config'].telegram_local_mode and (document.file_size or 0) > CLOUD_FILE_SIZE_LIMIT:
+        await reply(
+            update,
+            context,
+            f"❌ {file_name} is larger than the {format_file_size(CLOUD_FILE_SIZE_LIMIT)} Telegram lets bots "
+            "download. Run the bot against a local Bot API server (--local) to handle larger files."
+        )
+        return
+    
+    # Queue the file for the download workers
+    download_queue = context.bot_data['download_queue']
+    job = DownloadJob(
+        job_id=download_queue.next_job_id(),
+        chat_id=update.effective_chat.id,
+        document=document,
+        file_name=file_name,
+        update=update,
+        context=context,
+        key=f"{update.effective_chat.id}:{update.message.message_id}",
+        message_id=update.message.message_id,
+        user_id=update.effective_user.id
+    )
+    
+    record_job(
+        job,
+        RECEIVED,
+        chat_id=job.chat_id,
+        message_id=job.message_id,
+        user_id=job.user_id,
+        file_id=document.file_id,
+        file_unique_id=document.file_unique_id,
+        file_name=file_name,
+        file_size=document.file_size
+    )
+    
+    # Files of a forwarded album are held back briefly and handled as one job
+    if update.message.media_group_id:
+        context.bot_data['media_group_collector'].add(f"{job.chat_id}:{update.message.media_group_id}", job)
+        return
+    
+    await queue_job(job, f"🕒 Queued (#{job.job_id}): {file_name}")
+
+
+async def admit_job(job: DownloadJob) -> Optional[str]:
+    """
+    Reserve disk space for the files of a job before it is queued.
+    
+    Files that are already on disk need no space. If the rest don't fit
+    beside the reservations of other jobs yet, the job is still queued and
+    waits for space in ``fetch_file``.
+    
+    Args:
+        job: The file or album to admit
+    
+    Returns:
+        Why the job must be refused, or None if it was admitted
+    """
+    download_manager = download_manager_for(job)
+    disk_space = download_manager.disk_space
+    if disk_space is None:
+        return None
+    
+    parts = [part for part in job.parts or [job] if not download_manager.find_existing(part.document)]
+    reason = await disk_space.check_fresh(sum(part.document.file_size or 0 for part in parts))
+    if reason:
+        return reason
+    for part in parts:
+        disk_space.reserve(part.key, part.document.file_size or 0)
+    return None
+
+
+async def queue_job(job: DownloadJob, text: str) -> None:
+    """Send a job's status message and hand the job to the download workers."""
+    config = job.context.bot_data['config']
+    download_queue = job.context.bot_data['download_queue']
+    
+    # Refuse files there is no room for before any bandwidth is spent on them
+    reason = await admit_job(job)
+    if reason:
+        for part in job.parts or [job]:
+            record_job(part, FAILED)
+        await report_status(job, f"❌ {reason}", final=True)
+        logger.warning(f"Refused job #{job.job_id}: {reason}")
+        return
+    
+    # A single status message per job is edited as it moves through the
+    # pipeline, so it must exist before a worker can pick the job up
+    if job.update and job.update.message:
+        job.status = await StatusMessage.send(
+            job.update.message,
+            f"{text}\n{download_queue.backlog} ahead",
+            config.status_edits_per_second,
+            job.context.bot_data.get('outbound')
+        )
+    download_queue.submit(job)
+
+
+async def queue_album(parts: List[DownloadJob]) -> None:
+    """Queue the collected files of an album as a single job."""
+    if len(parts) == 1:
+        await queue_job(parts[0], f"🕒 Queued (#{parts[0].job_id}): {parts[0].file_name}")
+        return
+    
+    parts.sort(key=lambda part: part.message_id)
+    first = parts[0]
+    album = DownloadJob(
+        job_id=first.context.bot_data['download_queue'].next_job_id(),
+        chat_id=first.chat_id,
+        document=None,
+        file_name=f"Album ({len(parts)} files)",
+        update=first.update,
+        context=first.context,
+        key=f"{first.key}:album",
+        message_id=first.message_id,
+        created=min(part.created for part in parts),
+        user_id=first.user_id,
+        parts=parts
+    )
+    await queue_job(album, f"🕒 Queued album (#{album.job_id}): {len(parts)} files")
+
+
+def user_profile(job: DownloadJob) -> Optional[UserProfile]:
+    """Return the profile of the user who sent a job's file, if known."""
+    return job.context.bot_data.get('users', {}).get(job.user_id)
+
+
+def download_manager_for(job: DownloadJob) -> DownloadManager:
+    """
+    Return the download manager for the download directory of a job's user.
+    
+    Users with their own directory get their own manager, created on first
+    use, with its own dedup index so each directory keeps a full copy of
+    what its user sent.
+    """
+    bot_data = job.context.bot_data
+    download_manager = bot_data['download_manager']
+    profile = user_profile(job)
+    if profile is None or profile.download_dir == download_manager.download_dir:
+        return download_manager
+    
+    user_download_managers = bot_data.setdefault('user_download_managers', {})
+    if profile.download_dir not in user_download_managers:
+        user_download_managers[profile.download_dir] = DownloadManager(
+            profile.download_dir,
+            DedupIndex(os.path.join(profile.download_dir, USER_DEDUP_INDEX)),
+            http_client=download_manager.http_client,
+            name_from_tags=download_manager.name_from_tags,
+            disk_space=build_disk_space(bot_data['config'], profile.download_dir)
+        )
+    return user_download_managers[profile.download_dir]
+
+
+def lexicon_for(job: DownloadJob) -> Tuple[AsyncLexiconClient, LexiconBatcher]:
+    """Return the Lexicon client and batcher for the Lexicon target of a job's user."""
+    bot_data = job.context.bot_data
+    lexicon_client = bot_data['lexicon_client']
+    profile = user_profile(job)
+    if profile is None or profile.lexicon_api_url.rstrip('/') == lexicon_client.base_url:
+        return lexicon_client, bot_data['lexicon_batcher']
+    
+    # Other targets are added to without a local library index
+    lexicon_targets = bot_data.setdefault('user_lexicon_targets', {})
+    api_url = profile.lexicon_api_url.rstrip('/')
+    if api_url not in lexicon_targets:
+        config = bot_data['config']
+        client = create_lexicon_client(config, api_url)
+        lexicon_targets[api_url] = (client, create_lexicon_batcher(config, client))
+    return lexicon_targets[api_url]
+
+
+def record_job(job: DownloadJob, state: str, **fields) -> None:
+    """Write a job state change to the journal and the pipeline statistics, if configured."""
+    job_journal = job.context.bot_data.get('job_journal')
+    if job_journal:
+        job_journal.record(job.key, state, **fields)
+    pipeline_stats = job.context.bot_data.get('pipeline_stats')
+    if pipeline_stats:
+        pipeline_stats.record(job.key, state, job.document.file_size if job.document else 0)
+
+
+async def report_status(job: DownloadJob, text: str, final: bool = False) -> None:
+    """
+    Show a job's progress in its status message.
+    
+    Jobs of a chat run in parallel, but their final results are shown in
+    the order the files were sent: a job that finishes before the chat's
+    previous one shows its result once that one has, without holding up
+    its worker meanwhile.
+    """
+    if final and job.previous is not None and not job.previous.done():
+        job.context.application.create_task(report_in_order(job, text), update=job.update)
+        return
+    await show_status(job, text, final)
+
+
+async def report_in_order(job: DownloadJob, text: str) -> None:
+    """Show a job's final result once the chat's previous job has shown its own."""
+    await asyncio.wait({job.previous}, timeout=RESULT_ORDER_WAIT)
+    await show_status(job, text, final=True)
+
+
+async def show_status(job: DownloadJob, text: str, final: bool = False) -> None:
+    """Update a job's status message, or reply if it has none."""
+    if final:
+        UPDATE_LATENCY_SECONDS.observe(time.monotonic() - job.created)
+    outbound = job.context.bot_data.get('outbound')
+    try:
+        if job.status:
+            await job.status.update(f"#{job.job_id} {job.file_name}\n{text}", final=final)
+        elif outbound:
+            outbound.send(job.chat_id, text, job.message_id)
+        elif job.update and job.update.message:
+            await job.update.message.reply_text(text)
+        else:
+            await job.context.bot.send_message(job.chat_id, text)
+    finally:
+        if final and job.reported and not job.reported.done():
+            job.reported.set_result(None)
+
+
+@trace_stage
+async def fetch_file(job: DownloadJob, progress_callback=None) -> Tuple[str, Optional[str]]:
+    """
+    Download a job's file unless an identical one is already on disk.
+    
+    Args:
+        job: The job whose file to fetch
+        progress_callback: Optional coroutine called with (bytes_done, total_bytes)
+    
+    Returns:
+        Tuple of (file path, reason an existing file was used instead, or None)
+    
+    Raises:
+        DownloadError: If the file could not be downloaded
+    """
+    download_manager = download_manager_for(job)
+    disk_space = download_manager.disk_space
+    
+    # Skip files we already have before asking Telegram for them
+    existing_path = download_manager.find_existing(job.document)
+    if existing_path:
+        if disk_space:
+            disk_space.release(job.key)
+        record_job(job, DONE, file_path=existing_path)
+        return existing_path, "Already downloaded"
+    
+    # Wait for running downloads to make room if the disk is nearly full
+    size = job.document.file_size or 0
+    if disk_space:
+        await disk_space.refresh()
+    if disk_space and not disk_space.reserve(job.key, size):
+        if job.status:
+            await job.status.update(f"#{job.job_id} {job.file_name}\n⏸️ Waiting for disk space...")
+        await disk_space.acquire(job.key, size)
+    
+    kept_size = 0
+    try:
+        record_job(job, DOWNLOADING)
+        file_path = await download_manager.download_file(job.document, job.context, job.update, progress_callback)
+        if not file_path:
+            raise DownloadError("Failed to download the file.")
+        
+        # Fall back to the content hash for the same track sent as a new file
+        existing_path = await download_manager.register_download(job.document, file_path)
+        if existing_path != file_path:
+            record_job(job, DONE, file_path=existing_path)
+            return existing_path, "Identical file already downloaded"
+        
+        # Downloads are checked against the reported size, so it only needs
+        # reading from disk when Telegram didn't report one
+        kept_size = size or os.path.getsize(file_path)
+        return file_path, None
+    finally:
+        if disk_space:
+            disk_space.commit(job.key, kept_size)
+
+
+def describe_tags(tags: Optional[TrackTags]) -> str:
+    """Summarise a track's tags in one line, or return an empty string."""
+    if not tags or not (tags.title or tags.artist):
+        return ""
+    line = f"🎵 {tags.artist or 'Unknown artist'} - {tags.title or 'Unknown title'}"
+    if tags.bpm:
+        line += f" ({tags.bpm:g} BPM)"
+    return line
+
+
+@trace_update
+async def process_job(job: DownloadJob) -> None:
+    """Process a queued file or album."""
+    if job.parts:
+        await process_album(job)
+    else:
+        await process_download_job(job)
+
+
+async def process_download_job(job: DownloadJob) -> None:
+    """Download a queued file and hand it over to Lexicon."""
+    update, context = job.update, job.context
+    config = context.bot_data.get('config')
+    
+    try:
+        # Download the file
+        async def download_progress(done: int, total: int) -> None:
+            if job.status:
+                await job.status.progress(f"#{job.job_id} {job.file_name}\n📥 Downloading", done, total)
+        
+        # Progress goes to the status message, so the download manager
+        # doesn't send replies of its own
+        file_path, existing = await fetch_file(job, download_progress)
+        if existing:
+            await report_status(job, f"♻️ {existing}: {file_path}", final=True)
+            return
+        
+        # If Lexicon integration is enabled, add the track without holding
+        # up the worker so the next download can start while it is batched.
+        # The file's own tags are shown straight away, before Lexicon answers.
+        track_line = describe_tags(read_tags(file_path))
+        if config.lexicon_enabled:
+            record_job(job, DOWNLOADED, file_path=file_path)
+            text = "\n".join(filter(None, [f"✅ Downloaded to: {file_path}", track_line, "🔄 Adding track to Lexicon..."]))
+            await report_status(job, text)
+            context.application.create_task(add_to_lexicon(job, file_path), update=update)
+        else:
+            record_job(job, DONE, file_path=file_path)
+            text = "\n".join(filter(None, ["✅ Download complete", track_line, f"Saved to: {file_path}"]))
+            await report_status(job, text, final=True)
+    
+    except DownloadError as e:
+        ERRORS.labels(type(e).__name__).inc()
+        record_job(job, FAILED)
+        await report_status(job, f"❌ Download error: {str(e)}", final=True)
+        logger.error(f"Download error: {e}")
+    except Exception as e:
+        ERRORS.labels(type(e).__name__).inc()
+        record_job(job, FAILED)
+        await report_status(job, f"❌ An unexpected error occurred: {str(e)}", final=True)
+        logger.error(f"Unexpected error: {e}")
+
+
+@trace_update
+async def add_to_lexicon(job: DownloadJob, file_path: str) -> None:
+    """Add a downloaded file to Lexicon and report the result."""
+    context = job.context
+    
+    try:
+        # Add the track as part of the next Lexicon batch. While Lexicon is
+        # down the circuit breaker fails fast, so wait for it to allow a probe
+        # instead of giving up on the track.
+        lexicon_client, lexicon_batcher = lexicon_for(job)
+        circuit_breaker = lexicon_client.circuit_breaker
+        while True:
+            try:
+                track_data = await lexicon_batcher.add_track(file_path)
+                break
+            except LexiconUnavailableError as e:
+                if not context.application.running:
+                    raise
+                await report_status(
+                    job,
+                    f"✅ Downloaded to: {file_path}\n"
+                    f"⏸️ {str(e)}. The track will be added when it recovers."
+                )
+                await asyncio.sleep(max(1.0, circuit_breaker.retry_after()))
+        
+        if track_data:
+            record_job(job, LEXICON_ADDED)
+            # Without track data in the response, fall back to the file's tags
+            if track_data.get("success") and track_data.get("title") == "Unknown" and track_data.get("artist") == "Unknown":
+                tags = read_tags(file_path)
+                if tags and (tags.title or tags.artist):
+                    track_data = {"title": tags.title or "Unknown", "artist": tags.artist or "Unknown"}
+            
+            if track_data.get("success") and track_data.get("title") == "Unknown" and track_data.get("artist") == "Unknown":
+                await report_status(
+                    job,
+                    f"✅ Downloaded to: {file_path}\n"
+                    "✅ Track added to Lexicon successfully!\n"
+                    "Track details were not available in the response.",
+                    final=True
+                )
+            else:
+                await report_status(
+                    job,
+                    f"✅ Downloaded to: {file_path}\n"
+                    f"✅ Track added to Lexicon successfully!\n"
+                    f"Title: {track_data.get('title', 'Unknown')}\n"
+                    f"Artist: {track_data.get('artist', 'Unknown')}",
+                    final=True
+                )
+        else:
+            record_job(job, FAILED)
+            await report_status(job, f"⚠️ File downloaded to {file_path} but couldn't add to Lexicon.", final=True)
+    
+    except LexiconRejectedError as e:
+        ERRORS.labels(type(e).__name__).inc()
+        # Retrying on restart would only be rejected again
+        record_job(job, FAILED)
+        await report_status(job, f"✅ Downloaded to: {file_path}\n❌ Lexicon refused the track: {str(e)}", final=True)
+        logger.error(f"Lexicon rejected {file_path}: {e}")
+    except LexiconError as e:
+        ERRORS.labels(type(e).__name__).inc()
+        # The job stays in the downloaded state, so the add is retried on restart
+        await report_status(job, f"✅ Downloaded to: {file_path}\n⚠️ Error adding to Lexicon: {str(e)}", final=True)
+        logger.error(f"Lexicon error: {e}")
+    except Exception as e:
+        # The chat's later results wait for this one, so it must always be shown
+        ERRORS.labels(type(e).__name__).inc()
+        record_job(job, FAILED)
+        logger.error(f"Unexpected error adding {file_path} to Lexicon: {e}", exc_info=e)
+        await report_status(job, f"✅ Downloaded to: {file_path}\n❌ An unexpected error occurred: {str(e)}", final=True)
+
+
+async def process_album(job: DownloadJob) -> None:
+    """Download the files of an album in parallel and add them to Lexicon together."""
+    config = job.context.bot_data['config']
+    progress = {part.key: 0 for part in job.parts}
+    total = sum(part.document.file_size or 0 for part in job.parts)
+    
+    async def fetch_part(part: DownloadJob) -> Tuple[str, Optional[str]]:
+        async def part_progress(done: int, _total: int) -> None:
+            progress[part.key] = done
+            if job.status:
+                await job.status.progress(
+                    f"#{job.job_id} {job.file_name}\n📥 Downloading", sum(progress.values()), total
+                )
+        
+        try:
+            return await fetch_file(part, part_progress)
+        except Exception as e:
+            ERRORS.labels(type(e).__name__).inc()
+            record_job(part, FAILED)
+            logger.error(f"Error downloading {part.file_name}: {e}")
+            raise
+    
+    results = await asyncio.gather(*(fetch_part(part) for part in job.parts), return_exceptions=True)
+    
+    lines = []
+    downloaded = []
+    for part, result in zip(job.parts, results):
+        if isinstance(result, BaseException):
+            lines.append(f"❌ {part.file_name}: {result}")
+        elif result[1]:
+            lines.append(f"♻️ {part.file_name}: {result[1].lower()}")
+        else:
+            downloaded.append((part, result[0]))
+    
+    if downloaded and config.lexicon_enabled:
+        for part, file_path in downloaded:
+            record_job(part, DOWNLOADED, file_path=file_path)
+        await report_status(job, f"✅ Downloaded {len(downloaded)} files\n🔄 Adding tracks to Lexicon...")
+        job.context.application.create_task(add_album_to_lexicon(job, downloaded, lines), update=job.update)
+        return
+    
+    for part, file_path in downloaded:
+        record_job(part, DONE, file_path=file_path)
+        track_line = describe_tags(read_tags(file_path))
+        lines.append(f"✅ {part.file_name}" + (f"\n   {track_line}" if track_line else ""))
+    header = f"✅ Downloaded {len(downloaded)} of {len(job.parts)} files to {download_manager_for(job).download_dir}"
+    await report_status(job, "\n".join([header] + lines), final=True)
+
+
+@trace_update
+async def add_album_to_lexicon(job: DownloadJob, downloaded: List[Tuple[DownloadJob, str]], lines: List[str]) -> None:
+    """Add an album's new files to Lexicon in one request and report the result."""
+    context = job.context
+    lexicon_client, _ = lexicon_for(job)
+    paths = [file_path for _, file_path in downloaded]
+    
+    try:
+        while True:
+            try:
+                tracks = await lexicon_client.add_tracks(paths)
+                break
+            except LexiconUnavailableError as e:
+                if not context.application.running:
+                    raise
+                await report_status(
+                    job,
+                    f"✅ Downloaded {len(paths)} files\n"
+                    f"⏸️ {str(e)}. The tracks will be added when it recovers."
+                )
+                await asyncio.sleep(max(1.0, lexicon_client.circuit_breaker.retry_after()))
+        
+        for (part, file_path), track_data in zip(downloaded, tracks):
+            record_job(part, LEXICON_ADDED)
+            if track_data.get("title") == "Unknown" and track_data.get("artist") == "Unknown":
+                track_line = describe_tags(read_tags(file_path))
+                lines.append(f"✅ {part.file_name}" + (f"\n   {track_line}" if track_line else ""))
+            else:
+                lines.append(f"✅ {part.file_name}: {track_data.get('artist')} - {track_data.get('title')}")
+        header = f"✅ Added {len(paths)} of {len(job.parts)} files to Lexicon"
+    
+    except LexiconRejectedError as e:
+        ERRORS.labels(type(e).__name__).inc()
+        # Retrying on restart would only be rejected again
+        logger.error(f"Lexicon rejected an album: {e}")
+        for part, _ in downloaded:
+            record_job(part, FAILED)
+        lines.extend(f"❌ {part.file_name}: downloaded, refused by Lexicon" for part, _ in downloaded)
+        header = f"✅ Downloaded {len(paths)} files\n❌ Lexicon refused the tracks: {str(e)}"
+    except LexiconError as e:
+        ERRORS.labels(type(e).__name__).inc()
+        # The files stay in the downloaded state, so the add is retried on restart
+        logger.error(f"Lexicon error: {e}")
+        lines.extend(f"⚠️ {part.file_name}: downloaded, not added to Lexicon" for part, _ in downloaded)
+        header = f"✅ Downloaded {len(paths)} files\n⚠️ Error adding to Lexicon: {str(e)}"
+    except Exception as e:
+        # The chat's later results wait for this one, so it must always be shown
+        ERRORS.labels(type(e).__name__).inc()
+        logger.error(f"Unexpected error adding an album to Lexicon: {e}", exc_info=e)
+        for part, _ in downloaded:
+            record_job(part, FAILED)
+        header = f"✅ Downloaded {len(paths)} files\n❌ An unexpected error occurred: {str(e)}"
+    
+    await report_status(job, "\n".join([header] + lines), final=True)
+
+
+async def resume_unfinished_jobs(application: Application) -> None:
+    """Requeue jobs the journal shows were still in flight at the last shutdown."""
+    config = application.bot_data['config']
+    download_queue = application.bot_data['download_queue']
+    
+    for entry in application.bot_data['job_journal'].unfinished():
+        document = Document(
+            file_id=entry["file_id"],
+            file_unique_id=entry["file_unique_id"],
+            file_name=entry["file_name"],
+            file_size=entry.get("file_size")
+        )
+        job = DownloadJob(
+            job_id=download_queue.next_job_id(),
+            chat_id=entry["chat_id"],
+            document=document,
+            file_name=entry["file_name"],
+            context=ContextTypes.DEFAULT_TYPE(application, chat_id=entry["chat_id"]),
+            key=entry["key"],
+            message_id=entry.get("message_id"),
+            user_id=entry.get("user_id")
+        )
+        
+        job.status = StatusMessage.queue(
+            application.bot_data['outbound'],
+            job.chat_id,
+            f"🔁 Resuming (#{job.job_id}): {job.file_name}",
+            job.message_id,
+            config.status_edits_per_second
+        )
+        
+        file_path = entry.get("file_path")
+        if entry["state"] == DOWNLOADED and config.lexicon_enabled and file_path and os.path.exists(file_path):
+            application.create_task(add_to_lexicon(job, file_path))
+        else:
+            download_queue.submit(job)
+        logger.info(f"Resumed job {job.key} from state {entry['state']}")
+
+
+async def refresh_lexicon_library(lexicon_client: AsyncLexiconClient, interval: float) -> None:
+    """Keep the local Lexicon library index in sync."""
+    while True:
+        try:
+            await lexicon_client.refresh_library()
+        except LexiconError as e:
+            logger.warning(f"Could not refresh Lexicon library index: {e}")
+        await asyncio.sleep(interval)
+
+
+def create_lexicon_client(
+    config: Config,
+    api_url: str,
+    library_index: Optional[LexiconLibraryIndex] = None
+) -> AsyncLexiconClient:
+    """Create a Lexicon client with the configured retry and circuit breaker settings."""
+    return AsyncLexiconClient(
+        api_url,
+        library_index=library_index,
+        retry_policy=RetryPolicy(config.lexicon_retry_attempts, config.lexicon_retry_base_delay),
+        circuit_breaker=CircuitBreaker(
+            config.lexicon_breaker_threshold,
+            config.lexicon_breaker_reset,
+            name="Lexicon"
+        )
+    )
+
+
+def create_lexicon_batcher(config: Config, lexicon_client: AsyncLexiconClient) -> LexiconBatcher:
+    """Create a batcher that groups adds to a Lexicon client."""
+    return LexiconBatcher(
+        lexicon_client,
+        window=config.lexicon_batch_window,
+        max_size=config.lexicon_batch_size
+    )
+
+
+def setup_lexicon(application: Application, config: Config) -> None:
+    """Create the Lexicon client and batcher shared by all handlers."""
+    # Keep a local copy of the library so known tracks and searches skip the network
+    library_index = LexiconLibraryIndex() if config.lexicon_index_refresh > 0 else None
+    lexicon_client = create_lexicon_client(config, config.lexicon_api_url, library_index)
+    application.bot_data['lexicon_client'] = lexicon_client
+    application.bot_data['lexicon_batcher'] = create_lexicon_batcher(config, lexicon_client)
+
+
+def start_lexicon_refresh(application: Application) -> None:
+    """Start syncing the Lexicon library index in the background."""
+    config = application.bot_data['config']
+    lexicon_client = application.bot_data.get('lexicon_client')
+    if lexicon_client and lexicon_client.library_index is not None:
+        lexicon_refresh_task = application.bot_data.get('lexicon_refresh_task')
+        if lexicon_refresh_task:
+            lexicon_refresh_task.cancel()
+        application.bot_data['lexicon_refresh_task'] = asyncio.create_task(
+            refresh_lexicon_library(lexicon_client, config.lexicon_index_refresh)
+        )
+
+
+def build_disk_space(config: Config, download_dir: str) -> DiskSpaceManager:
+    """Create the disk space manager for a download directory."""
+    return DiskSpaceManager(download_dir, config.download_quota_mb * MB, config.min_free_space_mb * MB)
+
+
+def apply_config(application: Application, new_config: Config, changed: List[str]) -> None:
+    """
+    Apply edited settings to the running bot.
+    
+    Args:
+        application: The running Application
+        new_config: Settings read from the edited config file
+        changed: Names of the settings that changed
+    """
+    restart_needed = [name for name in changed if name not in RELOADABLE_FIELDS]
+    if restart_needed:
+        logger.warning(f"Restart the bot to apply changes to: {', '.join(restart_needed)}")
+    
+    changed = [name for name in changed if name in RELOADABLE_FIELDS]
+    if 'download_dir' in changed and not validate_directory(new_config.download_dir):
+        logger.error(f"Ignoring invalid download directory: {new_config.download_dir}")
+        changed.remove('download_dir')
+    if not changed:
+        return
+    
+    # Handlers read the config from bot_data per update, so swapping it in
+    # is enough for most settings; jobs already running keep the old one
+    config = dataclasses.replace(
+        application.bot_data['config'],
+        **{name: getattr(new_config, name) for name in changed}
+    )
+    application.bot_data['config'] = config
+    
+    if 'download_dir' in changed:
+        download_manager = application.bot_data['download_manager']
+        application.bot_data['download_manager'] = DownloadManager(
+            config.download_dir,
+            download_manager.dedup_index,
+            http_client=download_manager.http_client,
+            name_from_tags=download_manager.name_from_tags,
+            disk_space=build_disk_space(config, config.download_dir)
+        )
+    if 'download_quota_mb' in changed or 'min_free_space_mb' in changed:
+        download_managers = [application.bot_data['download_manager']]
+        download_managers.extend(application.bot_data.get('user_download_managers', {}).values())
+        for download_manager in download_managers:
+            download_manager.disk_space.quota_bytes = config.download_quota_mb * MB
+            download_manager.disk_space.min_free_bytes = config.min_free_space_mb * MB
+    
+    if 'log_level' in changed:
+        logging.getLogger().setLevel(config.log_level.upper())
+    
+    # Who is authorised, and where their tracks go, follows the admin's settings too
+    application.bot_data['users'] = load_user_profiles(config)
+    
+    if config.lexicon_enabled:
+        lexicon_client = application.bot_data.get('lexicon_client')
+        if lexicon_client is None:
+            setup_lexicon(application, config)
+            start_lexicon_refresh(application)
+        elif lexicon_client.base_url != config.lexicon_api_url.rstrip('/'):
+            lexicon_client.base_url = config.lexicon_api_url.rstrip('/')
+            # Re-sync the library index against the new server
+            start_lexicon_refresh(application)
+    
+    logger.info(f"Reloaded settings from config file: {', '.join(changed)}")
+
+
+async def watch_config(application: Application, reloader: ConfigReloader, interval: float = 1.0) -> None:
+    """Apply edits to the config file without a restart."""
+    while True:
+        await asyncio.sleep(interval)
+        changed = reloader.check()
+        if changed:
+            apply_config(application, reloader.config, changed)
+
+
+async def startup(application: Application) -> None:
+    """Start background workers once the event loop is running."""
+    application.bot_data['outbound'].start()
+    application.bot_data['download_queue'].start()
+    start_lexicon_refresh(application)
+    
+    config_reloader = application.bot_data.get('config_reloader')
+    if config_reloader:
+        application.bot_data['config_watch_task'] = asyncio.create_task(
+            watch_config(application, config_reloader)
+        )
+    
+    await resume_unfinished_jobs(application)
+
+
+async def shutdown(application: Application) -> None:
+    """Release shared resources when the application stops."""
+    # Albums still being collected are resumed file by file from the journal
+    media_group_collector = application.bot_data.get('media_group_collector')
+    if media_group_collector:
+        await media_group_collector.close()
+    
+    download_queue = application.bot_data.get('download_queue')
+    if download_queue:
+        await download_queue.stop()
+    
+    for task_name in ('lexicon_refresh_task', 'config_watch_task'):
+        task = application.bot_data.get(task_name)
+        if task:
+            task.cancel()
+    
+    lexicon_batcher = application.bot_data.get('lexicon_batcher')
+    if lexicon_batcher:
+        await lexicon_batcher.close()
+    
+    lexicon_client = application.bot_data.get('lexicon_client')
+    if lexicon_client:
+        await lexicon_client.close()
+    
+    for client, batcher in application.bot_data.get('user_lexicon_targets', {}).values():
+        await batcher.close()
+        await client.close()
+    
+    # Deliver the final status messages before the bot stops
+    outbound = application.bot_data.get('outbound')
+    if outbound:
+        await outbound.close()
+    
+    download_http_client = application.bot_data.get('download_http_client')
+    if download_http_client:
+        await download_http_client.aclose()
+    
+    dedup_index = application.bot_data.get('dedup_index')
+    if dedup_index:
+        dedup_index.close()
+    for download_manager in application.bot_data.get('user_download_managers', {}).values():
+        download_manager.dedup_index.close()
+    
+    job_journal = application.bot_data.get('job_journal')
+    if job_journal:
+        job_journal.close()
+    
+    metrics_server = application.bot_data.get('metrics_server')
+    if metrics_server:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+
+
+@handle_bot_error
+async def handle_unauthorized(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle messages from unauthorized users."""
+    # Check if user is authorised
+    if not is_authorized(update.effective_user.id, context.bot_data['users']):
+        if update.message:
+            await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+    
+    # If admin but message wasn't handled by other handlers
+    if update.message:
+        await update.message.reply_text("❌ I don't understand this message. Please send an MP3 file or use /help for commands.")
+
+
+def build_webhook_options(config: Config) -> Dict[str, Any]:
+    """
+    Build the keyword arguments for ``Application.run_webhook``.
+    
+    Args:
+        config: The bot configuration
+    
+    Returns:
+        Dictionary of webhook options
+    """
+    url_path = config.webhook_path.strip('/')
+    webhook_url = config.webhook_url or f"http://{config.webhook_listen}:{config.webhook_port}"
+    
+    return {
+        "listen": config.webhook_listen,
+        "port": config.webhook_port,
+        "url_path": url_path,
+        "webhook_url": f"{webhook_url.rstrip('/')}/{url_path}",
+        # Telegram echoes this back in a header so forged requests are rejected
+        "secret_token": config.webhook_secret_token or secrets.token_urlsafe(32)
+    }
+
+
+def webhook_unavailable_reason(config: Config) -> Optional[str]:
+    """Return why webhook mode can't be used, or None if it can."""
+    if importlib.util.find_spec("tornado") is None:
+        return "webhook support is not installed (pip install \"python-telegram-bot[webhooks]\")"
+    if not config.webhook_url and not config.telegram_base_url:
+        return "no webhook_url is configured for the cloud Bot API to reach"
+    return None
+
+
+def run_application(application: Application, config: Config, use_webhook: bool) -> None:
+    """Serve updates through a webhook, falling back to long polling."""
+    if use_webhook:
+        reason = webhook_unavailable_reason(config)
+        if reason is None:
+            options = build_webhook_options(config)
+            logger.info(f"Starting bot with webhook on {options['listen']}:{options['port']}/{options['url_path']}...")
+            application.run_webhook(**options)
+            return
+        logger.warning(f"Webhook mode unavailable, falling back to polling: {reason}")
+    
+    logger.info("Starting bot...")
+    application.run_polling()
+
+
+def build_application(config: Config) -> Application:
+    """
+    Create the Application and the shared objects its handlers use.
+    
+    Args:
+        config: Bot configuration
+    
+    Returns:
+        The configured Application, ready to run
+    """
+    # Create the Application
+    builder = (
+        Application.builder()
+        .token(config.bot_token)
+        .concurrent_updates(True)
+        .post_init(startup)
+        .post_shutdown(shutdown)
+    )
+    
+    # Allow pointing the bot at a self-hosted or fake Bot API server
+    if config.telegram_base_url:
+        builder = builder.base_url(config.telegram_base_url)
+    if config.telegram_base_file_url:
+        builder = builder.base_file_url(config.telegram_base_file_url)
+    # A local server returns file paths on this machine instead of download URLs
+    if config.telegram_local_mode:
+        builder = builder.local_mode(True)
+    
+    application = builder.build()
+    
+    # Store config in bot_data for access in handlers
+    application.bot_data['config'] = config
+    
+    # Authorised users, keyed by user ID for constant-time checks
+    application.bot_data['users'] = load_user_profiles(config)
+    
+    # Remember downloaded files across restarts to skip re-forwarded tracks
+    application.bot_data['dedup_index'] = DedupIndex(config.dedup_index_path)
+    
+    # Journal job states so unfinished work resumes after a restart
+    application.bot_data['job_journal'] = JobJournal(config.job_journal_path)
+    
+    # Timings of recent jobs for /status, in a fixed amount of memory
+    application.bot_data['pipeline_stats'] = PipelineStats()
+    
+    # Share one download manager, and with it one connection pool for fetching
+    # file contents and one in-memory index of names in the download directory
+    application.bot_data['download_http_client'] = httpx.AsyncClient(timeout=30)
+    application.bot_data['download_manager'] = DownloadManager(
+        config.download_dir,
+        application.bot_data['dedup_index'],
+        FilenameIndex(config.download_dir),
+        application.bot_data['download_http_client'],
+        name_from_tags=config.name_files_from_tags,
+        disk_space=build_disk_space(config, config.download_dir)
+    )
+    DISK_RESERVED_BYTES.set_function(lambda: application.bot_data['download_manager'].disk_space.reserved)
+    
+    # Replies and status edits are queued and sent within Telegram's flood limits
+    outbound = OutboundScheduler(
+        application.bot,
+        config.messages_per_second,
+        config.chat_messages_per_second
+    )
+    application.bot_data['outbound'] = outbound
+    OUTBOUND_PENDING.set_function(lambda: outbound.pending)
+    
+    # Downloads run on a bounded pool of workers fed by handle_document
+    download_queue = DownloadQueue(
+        process_job,
+        workers=config.download_workers,
+        weight=lambda user_id: getattr(application.bot_data['users'].get(user_id), 'weight', 1.0)
+    )
+    application.bot_data['download_queue'] = download_queue
+    QUEUE_DEPTH.set_function(lambda: download_queue.pending)
+    application.bot_data['media_group_collector'] = MediaGroupCollector(
+        queue_album,
+        window=config.media_group_window
+    )
+    
+    # Share one Lexicon client (and connection pool) across all handlers
+    if config.lexicon_enabled:
+        setup_lexicon(application, config)
+    
+    # Expose metrics for scraping when a port is configured
+    if config.metrics_port:
+        application.bot_data['metrics_server'] = start_metrics_server(config.metrics_listen, config.metrics_port)
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    
+    # Add handler for documents and audio files
+    application.add_handler(MessageHandler(filters.Document.ALL | filters.AUDIO, handle_document))
+    
+    # Add catch-all handler for unauthorized users (higher group number = lower priority)
+    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_unauthorized), group=2)
+    
+    # Add error handler
+    application.add_error_handler(error_handler)
+    
+    return application
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+ID3 tag reader for Lexicon Track Adder Bot
+"""
+
+import mmap
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ID3V1_SIZE = 128
+
+# Frame IDs of the fields we read, for ID3v2.2 and ID3v2.3/2.4
+_FRAMES_V22 = {b"TT2": "title", b"TP1": "artist", b"TAL": "album", b"TBP": "bpm"}
+_FRAMES_V23 = {b"TIT2": "title", b"TPE1": "artist", b"TALB": "album", b"TBPM": "bpm"}
+
+_TEXT_ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+
+@dataclass
+class TrackTags:
+    """Track metadata read from ID3 tags."""
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    bpm: Optional[float] = None
+
+
+def _syncsafe(data: bytes) -> int:
+    """Decode a syncsafe integer (7 bits per byte)."""
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+    return value
+
+
+def _decode_text(data: bytes) -> Optional[str]:
+    """Decode the value of an ID3v2 text frame, keeping the first of several values."""
+    if not data:
+        return None
+    encoding = _TEXT_ENCODINGS.get(data[0], "latin-1")
+    try:
+        text = data[1:].decode(encoding)
+    except UnicodeDecodeError:
+        text = data[1:].decode("latin-1")
+    text = text.split("\x00", 1)[0].strip()
+    return text or None
+
+
+def _parse_id3v2(buffer, start: int, end: int, version: int, flags: int) -> Dict[str, str]:
+    """
+    Read the text frames we care about from an ID3v2 tag.
+    
+    Frames are walked in place, so only frame headers and the wanted frame
+    bodies are copied out of ``buffer``, not large frames such as artwork.
+    """
+    if flags & 0x80 and version < 4:
+        # Tag-wide unsynchronisation (ID3v2.2/2.3) needs the whole tag decoded
+        buffer = buffer[start:end].replace(b"\xff\x00", b"\xff")
+        start, end = 0, len(buffer)
+    
+    position = start
+    if flags & 0x40 and version >= 3:
+        # Skip the extended header
+        if version == 3:
+            position += 4 + int.from_bytes(buffer[position:position + 4], "big")
+        else:
+            position += _syncsafe(buffer[position:position + 4])
+    
+    if version == 2:
+        frames, id_size, header_size = _FRAMES_V22, 3, 6
+    else:
+        frames, id_size, header_size = _FRAMES_V23, 4, 10
+    
+    values = {}
+    while position + header_size <= end and len(values) < len(frames):
+        header = buffer[position:position + header_size]
+        frame_id = header[:id_size]
+        if not frame_id.strip(b"\x00"):
+            # Padding after the last frame
+            break
+        if version == 4:
+            size = _syncsafe(header[id_size:id_size * 2])
+        else:
+            size = int.from_bytes(header[id_size:id_size * 2], "big")
+        data_start = position + header_size
+        position = data_start + size
+        
+        field = frames.get(frame_id)
+        if field is None or size <= 0:
+            continue
+        data = buffer[data_start:min(position, end)]
+        
+        if version == 4:
+            format_flags = header[9]
+            if format_flags & 0x01:
+                # Data length indicator
+                data = data[4:]
+            if format_flags & 0x02:
+                data = data.replace(b"\xff\x00", b"\xff")
+        
+        text = _decode_text(data)
+        if text:
+            values[field] = text
+    return values
+
+
+def _parse_id3v1(tag: bytes) -> Dict[str, str]:
+    """Read title, artist and album from a 128-byte ID3v1 tag."""
+    values = {}
+    for field, start in (("title", 3), ("artist", 33), ("album", 63)):
+        text = tag[start:start + 30].split(b"\x00", 1)[0].decode("latin-1").strip()
+        if text:
+            values[field] = text
+    return values
+
+
+def read_tags(file_path: str) -> Optional[TrackTags]:
+    """
+    Read the ID3 tags of an MP3 file.
+    
+    The file is memory-mapped and only the ID3v2 frame headers and text
+    frames at the start and the ID3v1 block at the end are touched, so the
+    cost doesn't depend on the size of the audio or embedded artwork. ID3v2 values take precedence; ID3v1
+    fills in anything they lack.
+    
+    Args:
+        file_path: Path to the MP3 file
+    
+    Returns:
+        The tags found, or None if the file has no readable tags
+    """
+    try:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            values: Dict[str, str] = {}
+            if len(mm) >= 10 and mm[0:3] == b"ID3":
+                version, flags = mm[3], mm[5]
+                size = _syncsafe(mm[6:10])
+                if 2 <= version <= 4:
+                    values = _parse_id3v2(mm, 10, min(10 + size, len(mm)), version, flags)
+            if len(mm) >= ID3V1_SIZE and mm[-ID3V1_SIZE:-ID3V1_SIZE + 3] == b"TAG":
+                for field, value in _parse_id3v1(mm[-ID3V1_SIZE:]).items():
+                    values.setdefault(field, value)
+    except (OSError, ValueError) as e:
+        # ValueError: an empty file can't be mapped
+        logger.debug(f"Could not read tags from {file_path}: {e}")
+        return None
+    
+    if not values:
+        return None
+    
+    bpm = None
+    if "bpm" in values:
+        try:
+            bpm = float(values["bpm"])
+        except ValueError:
+            pass
+    return TrackTags(values.get("title"), values.get("artist"), values.get("album"), bpm)
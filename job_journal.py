@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Write-ahead job journal for Lexicon Track Adder Bot
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job states, in the order a job normally moves through them
+RECEIVED = "received"
+DOWNLOADING = "downloading"
+DOWNLOADED = "downloaded"
+LEXICON_ADDED = "lexicon_added"
+# Finished without Lexicon work (duplicate, or Lexicon disabled)
+DONE = "done"
+FAILED = "failed"
+
+FINAL_STATES = {LEXICON_ADDED, DONE, FAILED}
+
+# The journal is compacted once this many jobs have finished since the last compaction
+COMPACT_AFTER_FINISHED = 1000
+
+
+class JobJournal:
+    """
+    Append-only journal of job state changes.
+    
+    Every state change is written as one JSON line, so after a crash or
+    restart the journal tells which jobs were still in flight. Writing and
+    fsyncing happen on a writer thread, in the order the changes were
+    recorded, so recording never blocks the event loop; changes that arrive
+    together share one fsync. A crash can lose the last few changes, which
+    only means a resumed job repeats a step.
+    
+    Replaying merges each job's lines into its latest state. The file is
+    compacted to only unfinished jobs when it is opened, and again by the
+    writer every ``compact_after`` finished jobs, so it stays small however
+    long the bot runs.
+    """
+    
+    def __init__(self, path: str, compact_after: int = COMPACT_AFTER_FINISHED):
+        self.path = path
+        self.compact_after = compact_after
+        self._unfinished = self._replay()
+        self._compact(self._unfinished)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        # Jobs in flight as the writer sees them, for compaction
+        self._jobs: Dict[str, Dict[str, Any]] = {key: dict(job) for key, job in self._unfinished.items()}
+        self._finished_since_compact = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_entries, name="job-journal", daemon=True)
+        self._writer.start()
+    
+    def _replay(self) -> Dict[str, Dict[str, Any]]:
+        """Read the journal and return the latest state of unfinished jobs."""
+        jobs: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.path):
+            return jobs
+        
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write is expected
+                    logger.warning(f"Skipping corrupt journal line {line_number} in {self.path}")
+                    continue
+                jobs.setdefault(entry["key"], {}).update(entry)
+        
+        return {key: job for key, job in jobs.items() if job.get("state") not in FINAL_STATES}
+    
+    def _compact(self, jobs: Dict[str, Dict[str, Any]]) -> None:
+        """Rewrite the journal so it only holds the given unfinished jobs."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for job in jobs.values():
+                f.write(json.dumps(job) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+    
+    def _write_entries(self) -> None:
+        """Writer thread: append queued entries, one fsync per batch, until closed."""
+        closing = False
+        while not closing:
+            entries: List[Optional[Dict[str, Any]]] = [self._queue.get()]
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                for entry in entries:
+                    if entry is None:
+                        closing = True
+                        break
+                    self._file.write(json.dumps(entry) + "\n")
+                    self._track(entry)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                
+                if self._finished_since_compact >= self.compact_after:
+                    self._file.close()
+                    self._compact(self._jobs)
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                    self._finished_since_compact = 0
+            except (OSError, ValueError) as e:
+                logger.error(f"Error writing job journal {self.path}: {e}")
+        
+        self._file.close()
+    
+    def _track(self, entry: Dict[str, Any]) -> None:
+        """Merge a written entry into the jobs in flight."""
+        if entry["state"] in FINAL_STATES:
+            self._jobs.pop(entry["key"], None)
+            self._finished_since_compact += 1
+        else:
+            self._jobs.setdefault(entry["key"], {}).update(entry)
+    
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """
+        Jobs that had not finished when the journal was opened.
+        
+        Returns:
+            List of job records, oldest first
+        """
+        return list(self._unfinished.values())
+    
+    def record(self, key: str, state: str, **fields: Any) -> None:
+        """
+        Record a job state change; it is written and fsynced by the writer thread.
+        
+        Args:
+            key: Stable identifier of the job
+            state: The new state
+            **fields: Extra job data to store with the state
+        """
+        self._queue.put({"key": key, "state": state, "time": time.time(), **fields})
+    
+    def close(self) -> None:
+        """Write any recorded changes and close the journal file."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Batched Lexicon ingestion for Lexicon Track Adder Bot
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Set, Tuple
+from error_handler import LexiconError
+
+logger = logging.getLogger(__name__)
+
+
+class LexiconBatcher:
+    """
+    Coalesces individual ``add_track`` calls into multi-location POSTs.
+    
+    Tracks are collected until either ``window`` seconds have passed since
+    the first pending track or ``max_size`` tracks are waiting, then sent to
+    Lexicon in one request. Each caller still receives its own track data.
+    """
+    
+    def __init__(self, client, window: float = 1.0, max_size: int = 25):
+        self.client = client
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+    
+    async def add_track(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Queue a track for the next batch and wait for its result.
+        
+        Args:
+            file_path: Path to the audio file to add
+        
+        Returns:
+            Dictionary with track data if successful
+        
+        Raises:
+            LexiconError: If the batch containing this track failed
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((file_path, future))
+        
+        if len(self._pending) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        
+        return await future
+    
+    def _start_flush(self) -> None:
+        """Schedule a flush of the pending tracks."""
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def flush(self) -> None:
+        """Send all pending tracks to Lexicon in a single request."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        
+        # Batches are sent one at a time so results resolve in arrival order
+        try:
+            async with self._flush_lock:
+                file_paths = [file_path for file_path, _ in batch]
+                try:
+                    tracks = await self.client.add_tracks(file_paths)
+                except Exception as e:
+                    error = e if isinstance(e, LexiconError) else LexiconError(str(e))
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(error)
+                    return
+                
+                logger.info(f"Added batch of {len(batch)} tracks to Lexicon")
+                for (_, future), track_data in zip(batch, tracks):
+                    if not future.done():
+                        future.set_result(track_data)
+        finally:
+            # Callers must never wait forever, also when the flush is cancelled
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(LexiconError("The batch was not sent to Lexicon"))
+    
+    async def close(self) -> None:
+        """Flush any pending tracks and wait for in-flight batches."""
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
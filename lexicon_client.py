@@ -3,20 +3,159 @@
 Lexicon API client implementation
 """
 
+import os
+import time
+import json
 import requests
 import logging
 from typing import Dict, Any, Optional, List
-from error_handler import LexiconError
+from error_handler import LexiconError, LexiconUnavailableError
+from resilience import RetryPolicy, CircuitBreaker, is_retryable_status
+from metrics import LEXICON_REQUEST_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
+def _extract_track_data(response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract the added track from a Lexicon ``POST /tracks`` response.
+    
+    Args:
+        response_data: Decoded JSON body of the response
+    
+    Returns:
+        Dictionary with track data, or a minimal success marker if the
+        response shape was not recognised
+    """
+    logger.info("Lexicon API response data", extra={"payload": response_data})
+    
+    # Extract track data from the actual response structure
+    track_data = None
+    
+    # Check for tracks array in data (actual structure from Lexicon)
+    if "data" in response_data and "tracks" in response_data["data"] and response_data["data"]["tracks"]:
+        track_data = response_data["data"]["tracks"][0]
+    # Check for track in data.track (fallback)
+    elif "data" in response_data and "track" in response_data["data"]:
+        track_data = response_data["data"]["track"]
+    # Check for tracks array directly (fallback)
+    elif "tracks" in response_data and response_data["tracks"]:
+        track_data = response_data["tracks"][0]
+    # Check for track directly (fallback)
+    elif "track" in response_data:
+        track_data = response_data["track"]
+    
+    if track_data:
+        logger.info("Successfully extracted track data", extra={"payload": track_data})
+        return track_data
+    else:
+        logger.warning("Track was added but couldn't extract track data from response")
+        # Return a minimal track object to indicate success
+        return {"title": "Unknown", "artist": "Unknown", "success": True}
+
+
+def _match_tracks(file_paths: List[str], response_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Map the tracks in a multi-location ``POST /tracks`` response back to
+    the locations that were sent.
+    
+    Args:
+        file_paths: Locations in the order they were sent
+        response_data: Decoded JSON body of the response
+    
+    Returns:
+        One track dictionary per entry in ``file_paths``
+    """
+    logger.info("Lexicon API response data", extra={"payload": response_data})
+    
+    tracks = None
+    if isinstance(response_data.get("data"), dict):
+        tracks = response_data["data"].get("tracks")
+    if tracks is None:
+        tracks = response_data.get("tracks")
+    tracks = [track for track in tracks or [] if isinstance(track, dict)]
+    
+    by_location = {
+        os.path.normpath(track["location"]): track
+        for track in tracks if track.get("location")
+    }
+    
+    matched = []
+    for index, file_path in enumerate(file_paths):
+        track_data = by_location.get(os.path.normpath(file_path))
+        # Fall back to response order when Lexicon omits locations
+        if track_data is None and not by_location and len(tracks) == len(file_paths):
+            track_data = tracks[index]
+        if track_data is None:
+            logger.warning(f"Track was added but couldn't match it in the response: {file_path}")
+            track_data = {"title": "Unknown", "artist": "Unknown", "success": True}
+        matched.append(track_data)
+    
+    return matched
+
+
+def _search_params(query: str, limit: int) -> Dict[str, Any]:
+    """Build query parameters for ``GET /search/tracks``."""
+    # Simple search by title or artist
+    return {
+        "filter": json.dumps({"title": query}),
+        "limit": limit
+    }
+
+
+def _unavailable_error(circuit_breaker: CircuitBreaker) -> LexiconUnavailableError:
+    """Build the error raised while the circuit breaker is open."""
+    return LexiconUnavailableError(
+        f"Lexicon is unavailable, next attempt in {circuit_breaker.retry_after():.0f}s"
+    )
+
+
 class LexiconClient:
     """Client for interacting with the Lexicon API."""
     
-    def __init__(self, base_url: str = "http://localhost:48624/v1"):
+    def __init__(
+        self,
+        base_url: str = "http://localhost:48624/v1",
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ):
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(name="Lexicon")
+    
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying transient failures with backoff.
+        
+        Raises:
+            LexiconUnavailableError: If the circuit breaker is open
+            requests.RequestException: If the last attempt failed to connect
+        """
+        for attempt in range(1, self.retry_policy.attempts + 1):
+            if not self.circuit_breaker.allow_request():
+                raise _unavailable_error(self.circuit_breaker)
+            
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                LEXICON_REQUEST_SECONDS.labels(method).observe(time.monotonic() - started)
+                self.circuit_breaker.record_failure()
+                if attempt == self.retry_policy.attempts:
+                    raise
+            else:
+                LEXICON_REQUEST_SECONDS.labels(method).observe(time.monotonic() - started)
+                if not is_retryable_status(response.status_code):
+                    self.circuit_breaker.record_success()
+                    return response
+                self.circuit_breaker.record_failure()
+                if attempt == self.retry_policy.attempts:
+                    return response
+            
+            delay = self.retry_policy.delay(attempt)
+            logger.warning(f"Lexicon request failed, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            time.sleep(delay)
     
     def test_connection(self) -> bool:
         """Test connection to the Lexicon API."""
@@ -33,10 +172,10 @@ class LexiconClient:
         
         Args:
             file_path: Path to the audio file to add
-            
+        
         Returns:
             Dictionary with track data if successful, None otherwise
-            
+        
         Raises:
             LexiconError: If there's an error adding the track
         """
@@ -44,7 +183,8 @@ class LexiconClient:
             data = {"locations": [file_path]}
             logger.info(f"Adding track to Lexicon: {file_path}")
             
-            response = self.session.post(
+            response = self._request(
+                "POST",
                 f"{self.base_url}/tracks",
                 json=data,
                 timeout=30
@@ -53,57 +193,71 @@ class LexiconClient:
             logger.info(f"Lexicon API response status: {response.status_code}")
             
             if response.status_code == 200:
-                response_data = response.json()
-                logger.info(f"Lexicon API response data: {response_data}")
-                
-                # Extract track data from the actual response structure
-                track_data = None
-                
-                # Check for tracks array in data (actual structure from Lexicon)
-                if "data" in response_data and "tracks" in response_data["data"] and response_data["data"]["tracks"]:
-                    track_data = response_data["data"]["tracks"][0]
-                # Check for track in data.track (fallback)
-                elif "data" in response_data and "track" in response_data["data"]:
-                    track_data = response_data["data"]["track"]
-                # Check for tracks array directly (fallback)
-                elif "tracks" in response_data and response_data["tracks"]:
-                    track_data = response_data["tracks"][0]
-                # Check for track directly (fallback)
-                elif "track" in response_data:
-                    track_data = response_data["track"]
-                
-                if track_data:
-                    logger.info(f"Successfully extracted track data: {track_data}")
-                    return track_data
-                else:
-                    logger.warning("Track was added but couldn't extract track data from response")
-                    # Return a minimal track object to indicate success
-                    return {"title": "Unknown", "artist": "Unknown", "success": True}
+                return _extract_track_data(response.json())
             else:
                 error_msg = f"Error adding track: {response.status_code} - {response.text}"
                 logger.error(error_msg)
                 raise LexiconError(error_msg)
-                
+        
         except requests.RequestException as e:
             error_msg = f"Error adding track to Lexicon: {e}"
             logger.error(error_msg)
             raise LexiconError(error_msg)
     
+    def add_tracks(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """
+        Add several tracks to the Lexicon library in a single request.
+        
+        Args:
+            file_paths: Paths to the audio files to add
+        
+        Returns:
+            List with one track dictionary per entry in ``file_paths``
+        
+        Raises:
+            LexiconError: If there's an error adding the tracks
+        """
+        try:
+            data = {"locations": list(file_paths)}
+            logger.info(f"Adding {len(file_paths)} tracks to Lexicon")
+            
+            response = self._request(
+                "POST",
+                f"{self.base_url}/tracks",
+                json=data,
+                timeout=30 + len(file_paths)
+            )
+            
+            logger.info(f"Lexicon API response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                return _match_tracks(file_paths, response.json())
+            else:
+                error_msg = f"Error adding tracks: {response.status_code} - {response.text}"
+                logger.error(error_msg)
+                raise LexiconError(error_msg)
+        
+        except requests.RequestException as e:
+            error_msg = f"Error adding tracks to Lexicon: {e}"
+            logger.error(error_msg)
+            raise LexiconError(error_msg)
+    
     def get_track(self, track_id: int) -> Optional[Dict[str, Any]]:
         """
         Get a track from the Lexicon library by ID.
         
         Args:
             track_id: ID of the track to retrieve
-            
+        
         Returns:
             Dictionary with track data if successful, None otherwise
-            
+        
         Raises:
             LexiconError: If there's an error getting the track
         """
         try:
-            response = self.session.get(
+            response = self._request(
+                "GET",
                 f"{self.base_url}/track",
                 params={"id": track_id},
                 timeout=10
@@ -115,7 +269,7 @@ class LexiconClient:
                 error_msg = f"Error getting track: {response.status_code} - {response.text}"
                 logger.error(error_msg)
                 raise LexiconError(error_msg)
-                
+        
         except requests.RequestException as e:
             error_msg = f"Error getting track from Lexicon: {e}"
             logger.error(error_msg)
@@ -128,25 +282,18 @@ class LexiconClient:
         Args:
             query: Search query string
             limit: Maximum number of results to return
-            
+        
         Returns:
             List of track dictionaries
-            
+        
         Raises:
             LexiconError: If there's an error searching tracks
         """
         try:
-            # Simple search by title or artist
-            data = {
-                "filter": {
-                    "title": query
-                },
-                "limit": limit
-            }
-            
-            response = self.session.get(
+            response = self._request(
+                "GET",
                 f"{self.base_url}/search/tracks",
-                params=data,
+                params=_search_params(query, limit),
                 timeout=10
             )
             
@@ -156,7 +303,7 @@ class LexiconClient:
                 error_msg = f"Error searching tracks: {response.status_code} - {response.text}"
                 logger.error(error_msg)
                 raise LexiconError(error_msg)
-                
+        
         except requests.RequestException as e:
             error_msg = f"Error searching tracks in Lexicon: {e}"
             logger.error(error_msg)
@@ -169,7 +316,7 @@ def test_lexicon_connection(base_url: str = "http://localhost:48624/v1") -> bool
     
     Args:
         base_url: Base URL of the Lexicon API
-        
+    
     Returns:
         True if connection is successful, False otherwise
     """
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Local index of the Lexicon library for Lexicon Track Adder Bot
+"""
+
+import os
+import re
+import bisect
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _tokenize(text: Optional[str]) -> List[str]:
+    """Split text into case-folded words."""
+    return _TOKEN_PATTERN.findall((text or "").casefold())
+
+
+def normalize_location(location: str) -> str:
+    """Normalise a file location so equivalent paths compare equal."""
+    return os.path.normcase(os.path.normpath(location))
+
+
+class LexiconLibraryIndex:
+    """
+    In-memory index of the tracks in a Lexicon library.
+    
+    Tracks are indexed by ID, by location and by the words in their title
+    and artist, so existence checks and searches never need a network
+    round trip. Lexicon has no way to list only recent changes, so every
+    refresh downloads the full track list; it is diffed against the index
+    in memory, and only tracks that changed are re-indexed.
+    """
+    
+    def __init__(self):
+        self.loaded = False
+        self._tracks: Dict[Any, Dict[str, Any]] = {}
+        self._locations: Dict[str, Any] = {}
+        self._title_artist: Dict[Tuple[str, str], Set[Any]] = {}
+        self._words: Dict[str, Set[Any]] = {}
+        self._sorted_words: List[str] = []
+        self._defer_sort = False
+    
+    def __len__(self) -> int:
+        return len(self._tracks)
+    
+    def get(self, track_id: Any) -> Optional[Dict[str, Any]]:
+        """Return a track by ID."""
+        return self._tracks.get(track_id)
+    
+    def find_location(self, location: str) -> Optional[Dict[str, Any]]:
+        """Return the track stored at a file location."""
+        track_id = self._locations.get(normalize_location(location))
+        return self._tracks.get(track_id) if track_id is not None else None
+    
+    def find_title_artist(self, title: str, artist: str) -> List[Dict[str, Any]]:
+        """Return tracks with exactly this title and artist (case-insensitive)."""
+        key = ((title or "").casefold(), (artist or "").casefold())
+        return [self._tracks[track_id] for track_id in self._title_artist.get(key, ())]
+    
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Find tracks whose title or artist contain every word of the query.
+        
+        The last word may be incomplete, so "daft pu" matches "Daft Punk".
+        
+        Args:
+            query: Search query string
+            limit: Maximum number of results to return
+        
+        Returns:
+            List of track dictionaries
+        """
+        words = _tokenize(query)
+        if not words:
+            return []
+        
+        *whole_words, partial = words
+        matches: Optional[Set[Any]] = None
+        for word in whole_words:
+            ids = self._words.get(word, set())
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        
+        prefixed: Set[Any] = set()
+        index = bisect.bisect_left(self._sorted_words, partial)
+        while index < len(self._sorted_words) and self._sorted_words[index].startswith(partial):
+            prefixed |= self._words[self._sorted_words[index]]
+            index += 1
+        matches = prefixed if matches is None else matches & prefixed
+        
+        return [self._tracks[track_id] for track_id in sorted(matches, key=str)[:limit]]
+    
+    def add(self, track: Dict[str, Any]) -> bool:
+        """
+        Add or update a single track.
+        
+        Args:
+            track: Track dictionary as returned by Lexicon
+        
+        Returns:
+            True if the index changed
+        """
+        track_id = track.get("id")
+        if track_id is None:
+            return False
+        
+        existing = self._tracks.get(track_id)
+        if existing == track:
+            return False
+        if existing is not None:
+            self._unindex(track_id, existing)
+        
+        self._tracks[track_id] = track
+        if track.get("location"):
+            self._locations[normalize_location(track["location"])] = track_id
+        key = ((track.get("title") or "").casefold(), (track.get("artist") or "").casefold())
+        self._title_artist.setdefault(key, set()).add(track_id)
+        for word in set(_tokenize(track.get("title")) + _tokenize(track.get("artist"))):
+            ids = self._words.get(word)
+            if ids is None:
+                ids = self._words[word] = set()
+                if not self._defer_sort:
+                    bisect.insort(self._sorted_words, word)
+            ids.add(track_id)
+        return True
+    
+    def update(self, tracks: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Bring the index in line with a full track list from Lexicon.
+        
+        This is a full refresh: the list is compared with the index in
+        memory, and only tracks that were added, changed or removed are
+        re-indexed.
+        
+        Args:
+            tracks: Every track currently in the library
+        
+        Returns:
+            Tuple of (tracks added or changed, tracks removed)
+        """
+        seen = set()
+        changed = 0
+        
+        # The sorted word list is rebuilt once at the end instead of being
+        # kept in order word by word, which matters for the initial load
+        self._defer_sort = True
+        try:
+            for track in tracks:
+                if track.get("id") is None:
+                    continue
+                seen.add(track["id"])
+                if self.add(track):
+                    changed += 1
+            
+            removed = [track_id for track_id in self._tracks if track_id not in seen]
+            for track_id in removed:
+                self._unindex(track_id, self._tracks.pop(track_id))
+        finally:
+            self._defer_sort = False
+            self._sorted_words = sorted(self._words)
+        
+        self.loaded = True
+        return changed, len(removed)
+    
+    def _unindex(self, track_id: Any, track: Dict[str, Any]) -> None:
+        """Remove a track's entries from the lookup tables."""
+        if track.get("location"):
+            location = normalize_location(track["location"])
+            if self._locations.get(location) == track_id:
+                del self._locations[location]
+        
+        key = ((track.get("title") or "").casefold(), (track.get("artist") or "").casefold())
+        ids = self._title_artist.get(key)
+        if ids is not None:
+            ids.discard(track_id)
+            if not ids:
+                del self._title_artist[key]
+        
+        for word in set(_tokenize(track.get("title")) + _tokenize(track.get("artist"))):
+            ids = self._words.get(word)
+            if ids is None:
+                continue
+            ids.discard(track_id)
+            if not ids:
+                del self._words[word]
+                if not self._defer_sort:
+                    del self._sorted_words[bisect.bisect_left(self._sorted_words, word)]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Album (media group) collection for Lexicon Track Adder Bot
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupCollector:
+    """
+    Collects the files of a forwarded album into one batch.
+    
+    Telegram delivers an album as one update per file, all sharing a
+    ``media_group_id``. Items are held until no new file has arrived for
+    ``window`` seconds, then the whole group is passed to ``on_complete``.
+    """
+    
+    def __init__(self, on_complete: Callable[[List[Any]], Awaitable[None]], window: float = 1.0):
+        self.on_complete = on_complete
+        self.window = window
+        self._groups: Dict[str, List[Any]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def add(self, group_id: str, item: Any) -> None:
+        """
+        Add an item to its group, restarting the group's window.
+        
+        Args:
+            group_id: Identifier shared by every item of the group
+            item: The item to collect
+        """
+        self._groups.setdefault(group_id, []).append(item)
+        
+        timer = self._timers.pop(group_id, None)
+        if timer:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timers[group_id] = loop.call_later(self.window, self._complete, group_id)
+    
+    def _complete(self, group_id: str) -> None:
+        """Hand a finished group over to the callback."""
+        self._timers.pop(group_id, None)
+        items = self._groups.pop(group_id)
+        logger.info(f"Collected media group {group_id} with {len(items)} items")
+        
+        task = asyncio.create_task(self.on_complete(items))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+    
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Error handling media group: {task.exception()}")
+    
+    async def close(self) -> None:
+        """Stop collecting, dropping groups whose window has not closed."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._groups.clear()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style metrics for Lexicon Track Adder Bot
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+THROUGHPUT_BUCKETS = tuple(float(2 ** power) for power in range(14, 28, 2))  # 16 KiB/s .. 64 MiB/s
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Render a Prometheus label set."""
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base class for a metric family with optional labels."""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+    
+    def labels(self, *values: str) -> '_Metric':
+        """Return the child metric for a set of label values."""
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+    
+    def _new_child(self) -> '_Metric':
+        return type(self)(self.name, self.documentation)
+    
+    def _series(self) -> List[Tuple[Tuple[str, ...], '_Metric']]:
+        """Return (label values, metric) pairs to render."""
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return sorted(self._children.items())
+    
+    def _samples(self, labelnames: Tuple[str, ...], labels: Tuple[str, ...]) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        """Render the metric family in the text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, metric in self._series():
+            lines.extend(metric._samples(self.labelnames, labels))
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+    
+    def inc(self, amount: float = 1.0) -> None:
+        """Increase the counter."""
+        with self._lock:
+            self._value += amount
+    
+    @property
+    def value(self) -> float:
+        return self._value
+    
+    def _samples(self, labelnames: Tuple[str, ...], labels: Tuple[str, ...]) -> List[str]:
+        return [f"{self.name}{_format_labels(labelnames, labels)} {_format_value(self._value)}"]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or is read from a callback."""
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+    
+    def set(self, value: float) -> None:
+        """Set the gauge."""
+        self._value = value
+    
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the gauge from ``function`` whenever metrics are collected."""
+        self._function = function
+    
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception as e:
+                logger.warning(f"Error collecting gauge {self.name}: {e}")
+        return self._value
+    
+    def _samples(self, labelnames: Tuple[str, ...], labels: Tuple[str, ...]) -> List[str]:
+        return [f"{self.name} {_format_value(self.value)}"]
+
+
+class Histogram(_Metric):
+    """Counts observations into cumulative buckets."""
+    
+    kind = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+    
+    def observe(self, value: float) -> None:
+        """Record an observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+    
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+    
+    def _new_child(self) -> 'Histogram':
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+    
+    def _samples(self, labelnames: Tuple[str, ...], labels: Tuple[str, ...]) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+        label_text = _format_labels(labelnames, labels)
+        lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+        lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+    
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+    
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric to the registry."""
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        """Render every metric in the text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+TELEGRAM_GET_FILE_SECONDS = REGISTRY.register(Histogram(
+    "telegram_get_file_seconds", "Latency of Telegram getFile calls."
+))
+DOWNLOAD_BYTES = REGISTRY.register(Counter(
+    "download_bytes_total", "Bytes downloaded from Telegram."
+))
+DOWNLOAD_THROUGHPUT = REGISTRY.register(Histogram(
+    "download_throughput_bytes_per_second", "Transfer rate of completed downloads.",
+    buckets=THROUGHPUT_BUCKETS
+))
+LEXICON_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "lexicon_request_seconds", "Latency of Lexicon API requests.", ["method"]
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "download_queue_depth", "Jobs waiting for a download worker."
+))
+OUTBOUND_PENDING = REGISTRY.register(Gauge(
+    "outbound_messages_pending", "Messages and edits waiting for Telegram's flood limits."
+))
+DISK_RESERVED_BYTES = REGISTRY.register(Gauge(
+    "download_disk_reserved_bytes", "Disk space reserved for queued and running downloads."
+))
+ERRORS = REGISTRY.register(Counter(
+    "bot_errors_total", "Errors by exception type.", ["type"]
+))
+UPDATE_LATENCY_SECONDS = REGISTRY.register(Histogram(
+    "update_latency_seconds", "Time from receiving a file to its final status.",
+    buckets=DEFAULT_BUCKETS + (120.0, 300.0)
+))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry on /metrics."""
+    
+    registry = REGISTRY
+    
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request: {format % args}")
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """
+    Serve metrics over HTTP from a background thread.
+    
+    Args:
+        host: Address to listen on
+        port: Port to listen on (0 picks a free port)
+    
+    Returns:
+        The running server; call ``shutdown()`` to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
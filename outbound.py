@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Outgoing message scheduling for Lexicon Track Adder Bot
+"""
+
+import time
+import asyncio
+import logging
+import warnings
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Hashable, List, Optional, Set
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+SEND = "send"
+EDIT = "edit"
+
+# Messages a chat may send back to back before its rate applies
+CHAT_BURST = 3
+
+# Telegram's limit on the length of a message
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, with bursts of up to ``burst``."""
+    
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+    
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (1.0 - self._tokens) / self.rate)
+    
+    def full(self, now: float) -> bool:
+        """Check whether the bucket has refilled to its burst."""
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self._tokens >= self.burst
+    
+    def take(self, now: float) -> None:
+        """Use a token; call only once ``wait_time`` is zero."""
+        if self.rate > 0:
+            self._refill(now)
+            self._tokens -= 1.0
+
+
+@dataclass
+class _Outgoing:
+    """A message waiting to be sent, or an edit waiting to be made."""
+    kind: str
+    text: str
+    key: Optional[Hashable] = None
+    reply_to_message_id: Optional[int] = None
+    # For edits: the message, or a future that resolves to it once sent
+    message: Any = None
+    futures: List[asyncio.Future] = field(default_factory=list)
+
+
+class _ChatQueue:
+    """Outgoing messages of one chat, sent one at a time in order."""
+    
+    def __init__(self, chat_id: int, rate: float):
+        self.chat_id = chat_id
+        self.items: Deque[_Outgoing] = deque()
+        self.bucket = TokenBucket(rate, CHAT_BURST)
+        self.blocked_until = 0.0
+        self.busy = False
+
+
+class OutboundScheduler:
+    """
+    Sends the bot's messages within Telegram's flood limits.
+    
+    Callers queue a message or edit and carry on; a single dispatcher sends
+    them, taking a token from a global bucket and from the chat's own bucket
+    for each. Chats take turns, and each chat's messages go out in order.
+    
+    While messages wait, they are coalesced: an item queued with the same
+    ``key`` as a pending one replaces its text, so a status message that
+    changes several times is sent or edited only once, and plain replies to
+    the same chat are merged into a single message. A ``RetryAfter`` pauses
+    only the affected chat, and nobody waits on it unless they await the
+    returned future.
+    """
+    
+    def __init__(self, bot: Bot, messages_per_second: float = 25.0, chat_messages_per_second: float = 1.0):
+        self.bot = bot
+        self.chat_messages_per_second = chat_messages_per_second
+        self._bucket = TokenBucket(messages_per_second, max(1.0, messages_per_second))
+        self._chats: 'OrderedDict[int, _ChatQueue]' = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._deliveries: Set[asyncio.Task] = set()
+    
+    @property
+    def pending(self) -> int:
+        """Number of messages and edits waiting to be sent."""
+        return sum(len(chat.items) for chat in list(self._chats.values()))
+    
+    def send(self, chat_id: int, text: str, reply_to_message_id: Optional[int] = None,
+             key: Optional[Hashable] = None) -> asyncio.Future:
+        """
+        Queue a new message.
+        
+        Args:
+            chat_id: Chat to send the message to
+            text: Message text
+            reply_to_message_id: Optional message to reply to; merged replies
+                answer the first message
+            key: Identifies a message whose later edits replace its text while
+                it waits; without one, the text may be merged with other replies
+        
+        Returns:
+            Future resolving to the sent Message, or None if it couldn't be sent
+        """
+        chat = self._chat(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        
+        last = chat.items[-1] if chat.items else None
+        if (key is None and last is not None and last.kind == SEND and last.key is None
+                and len(last.text) + len(text) + 2 <= MAX_MESSAGE_LENGTH):
+            last.text = f"{last.text}\n\n{text}"
+            last.futures.append(future)
+        else:
+            chat.items.append(_Outgoing(SEND, text, key, reply_to_message_id, futures=[future]))
+        self._notify()
+        return future
+    
+    def edit(self, chat_id: int, message: Any, text: str, key: Optional[Hashable] = None) -> asyncio.Future:
+        """
+        Queue an edit of a message's text.
+        
+        Args:
+            chat_id: Chat the message is in
+            message: The Message, or the future returned by ``send`` for it
+            text: New message text
+            key: Identifies the message, so newer edits replace older ones
+                (and the text of its send, if that is still waiting)
+        
+        Returns:
+            Future resolving to the edited Message, or None if it couldn't be edited
+        """
+        chat = self._chat(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        
+        if key is not None:
+            for item in chat.items:
+                if item.key == key:
+                    item.text = text
+                    item.futures.append(future)
+                    return future
+        chat.items.append(_Outgoing(EDIT, text, key, message=message, futures=[future]))
+        self._notify()
+        return future
+    
+    def start(self) -> None:
+        """Start the dispatcher task."""
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-dispatcher")
+    
+    async def close(self, timeout: float = 5.0) -> None:
+        """Send what is queued, waiting up to ``timeout`` seconds, then stop."""
+        deadline = time.monotonic() + timeout
+        while (self.pending or self._deliveries) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending:
+            logger.warning(f"Dropping {self.pending} outgoing messages on shutdown")
+        
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for task in list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+    
+    def _chat(self, chat_id: int) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(chat_id, self.chat_messages_per_second)
+        return chat
+    
+    def _notify(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+    
+    async def _dispatch(self) -> None:
+        """Start deliveries as the rate limits allow."""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        while True:
+            now = time.monotonic()
+            delay: Optional[float] = None
+            
+            for chat_id in list(self._chats):
+                chat = self._chats[chat_id]
+                if chat.busy:
+                    continue
+                if not chat.items:
+                    # Forget an idle chat only once its bucket is full again, as
+                    # a new queue for it would start out with a full burst
+                    if chat.blocked_until <= now and chat.bucket.full(now):
+                        del self._chats[chat_id]
+                    continue
+                
+                wait = max(chat.blocked_until - now, chat.bucket.wait_time(now), self._bucket.wait_time(now))
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                    continue
+                
+                chat.bucket.take(now)
+                self._bucket.take(now)
+                chat.busy = True
+                # Send this chat's next message after the other chats have had a turn
+                self._chats.move_to_end(chat_id)
+                task = asyncio.create_task(self._deliver(chat, chat.items.popleft()))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _deliver(self, chat: _ChatQueue, item: _Outgoing) -> None:
+        """Send one message or edit and resolve its futures."""
+        result = None
+        try:
+            if item.kind == SEND:
+                result = await self.bot.send_message(
+                    chat.chat_id,
+                    item.text,
+                    reply_to_message_id=item.reply_to_message_id,
+                    allow_sending_without_reply=True
+                )
+            else:
+                message = item.message
+                if isinstance(message, asyncio.Future):
+                    message = await message
+                if message is not None:
+                    result = message
+                    await self.bot.edit_message_text(item.text, chat_id=chat.chat_id, message_id=message.message_id)
+        except RetryAfter as e:
+            ERRORS.labels(type(e).__name__).inc()
+            with warnings.catch_warnings():
+                # PTB is moving retry_after from int seconds to a timedelta
+                warnings.simplefilter("ignore", DeprecationWarning)
+                retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+            logger.warning(f"Flood limit hit in chat {chat.chat_id}, pausing its messages for {seconds:g}s")
+            chat.blocked_until = time.monotonic() + seconds
+            # Try again later, still open to newer text for the same key
+            chat.items.appendleft(item)
+            return
+        except BadRequest as e:
+            # An edit to the text the message already has is harmless
+            if "not modified" not in str(e).lower():
+                result = None
+                ERRORS.labels(type(e).__name__).inc()
+                logger.warning(f"Failed to send message to chat {chat.chat_id}: {e}")
+        except TelegramError as e:
+            result = None
+            ERRORS.labels(type(e).__name__).inc()
+            logger.warning(f"Failed to send message to chat {chat.chat_id}: {e}")
+        finally:
+            chat.busy = False
+            self._notify()
+        
+        for future in item.futures:
+            if not future.done():
+                future.set_result(result)
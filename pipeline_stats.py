@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Recent job statistics for Lexicon Track Adder Bot
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+from job_journal import RECEIVED, DOWNLOADING, DOWNLOADED, LEXICON_ADDED, DONE, FAILED, FINAL_STATES
+
+# Finished jobs kept for statistics; older ones are overwritten
+RECENT_JOBS = 1000
+
+# Throughput is reported over this many seconds
+THROUGHPUT_WINDOW = 300.0
+
+# Stages of a job, as (name, start timestamp, end timestamp) attributes of JobRecord
+STAGES = (
+    ("queued", "received", "downloading"),
+    ("download", "downloading", "downloaded"),
+    ("lexicon", "downloaded", "lexicon_added"),
+    ("total", "received", "finished"),
+)
+
+
+class JobRecord:
+    """Size and timestamps of one job; a timestamp of 0 means it never got there."""
+    __slots__ = ("key", "size", "received", "downloading", "downloaded", "lexicon_added", "finished", "failed")
+    
+    def __init__(self, key: str, size: int = 0):
+        self.key = key
+        self.size = size
+        self.received = 0.0
+        self.downloading = 0.0
+        self.downloaded = 0.0
+        self.lexicon_added = 0.0
+        self.finished = 0.0
+        self.failed = False
+
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent items, overwriting the oldest."""
+    __slots__ = ("_items", "_next", "_count")
+    
+    def __init__(self, capacity: int):
+        self._items: List[Optional[JobRecord]] = [None] * max(1, capacity)
+        self._next = 0
+        self._count = 0
+    
+    def append(self, item: JobRecord) -> None:
+        self._items[self._next] = item
+        self._next = (self._next + 1) % len(self._items)
+        self._count = min(self._count + 1, len(self._items))
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def __iter__(self) -> Iterator[JobRecord]:
+        """Iterate from oldest to newest."""
+        start = (self._next - self._count) % len(self._items)
+        for offset in range(self._count):
+            yield self._items[(start + offset) % len(self._items)]
+
+
+@dataclass
+class PipelineSummary:
+    """What the pipeline has been doing recently."""
+    downloading: int = 0
+    awaiting_lexicon: int = 0
+    completed: int = 0
+    failed: int = 0
+    bytes_completed: int = 0
+    window: float = 0.0
+    # Average seconds per stage over the recent jobs that went through it
+    stage_averages: Dict[str, float] = field(default_factory=dict)
+    
+    @property
+    def throughput(self) -> float:
+        """Bytes per second of completed downloads over the window."""
+        return self.bytes_completed / self.window if self.window > 0 else 0.0
+
+
+class PipelineStats:
+    """
+    Keeps timestamps of the jobs the bot has handled, in bounded memory.
+    
+    Jobs in flight are tracked by key until they reach a final state, then
+    moved into a ring buffer of the most recent jobs. Jobs left unfinished
+    for a restart to pick up are dropped once ``capacity`` others are in
+    flight, so memory stays flat however long the bot runs.
+    """
+    
+    def __init__(self, capacity: int = RECENT_JOBS):
+        self.capacity = capacity
+        self.recent = RingBuffer(capacity)
+        self.started = time.monotonic()
+        self._active: Dict[str, JobRecord] = {}
+    
+    def record(self, key: str, state: str, size: int = 0, now: Optional[float] = None) -> None:
+        """
+        Note that a job reached a state.
+        
+        Args:
+            key: Identifier of the job
+            state: One of the job journal states
+            size: Size of the job's file in bytes, if known
+            now: Monotonic time of the change
+        """
+        now = time.monotonic() if now is None else now
+        record = self._active.get(key)
+        if record is None:
+            if len(self._active) >= self.capacity:
+                del self._active[next(iter(self._active))]
+            record = self._active[key] = JobRecord(key, size or 0)
+        
+        if state == RECEIVED:
+            record.received = now
+        elif state == DOWNLOADING:
+            record.downloading = now
+        elif state == DOWNLOADED:
+            record.downloaded = now
+        
+        if state in FINAL_STATES:
+            # Without Lexicon, a download goes straight to done
+            if state == DONE and record.downloading and not record.downloaded:
+                record.downloaded = now
+            elif state == LEXICON_ADDED:
+                record.lexicon_added = now
+            record.finished = now
+            record.failed = state == FAILED
+            del self._active[key]
+            self.recent.append(record)
+    
+    def summary(self, window: float = THROUGHPUT_WINDOW, now: Optional[float] = None) -> PipelineSummary:
+        """
+        Summarise jobs in flight and recently finished.
+        
+        Args:
+            window: Seconds of finished jobs to count and measure throughput over
+            now: Monotonic time to summarise at
+        
+        Returns:
+            The summary
+        """
+        now = time.monotonic() if now is None else now
+        summary = PipelineSummary(window=min(window, now - self.started))
+        
+        for record in list(self._active.values()):
+            if record.downloaded:
+                summary.awaiting_lexicon += 1
+            elif record.downloading:
+                summary.downloading += 1
+        
+        totals = {name: 0.0 for name, _, _ in STAGES}
+        counts = {name: 0 for name, _, _ in STAGES}
+        for record in self.recent:
+            if record.finished >= now - window:
+                if record.failed:
+                    summary.failed += 1
+                else:
+                    summary.completed += 1
+                    if record.downloaded:
+                        summary.bytes_completed += record.size
+            if record.failed:
+                continue
+            for name, start, end in STAGES:
+                started, ended = getattr(record, start), getattr(record, end)
+                if started and ended:
+                    totals[name] += ended - started
+                    counts[name] += 1
+        
+        summary.stage_averages = {name: totals[name] / counts[name] for name in totals if counts[name]}
+        return summary
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling and stage tracing for Lexicon Track Adder Bot
+"""
+
+import os
+import time
+import asyncio
+import cProfile
+import functools
+import logging
+import pstats
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CPU = "cpu"
+TASKS = "tasks"
+PROFILE_MODES = (CPU, TASKS)
+
+DEFAULT_PROFILE_SECONDS = 30.0
+MAX_PROFILE_SECONDS = 600.0
+
+# How often the tasks mode looks at where every task is waiting
+TASK_SAMPLE_INTERVAL = 0.01
+
+# Lines per section of a profile summary
+SUMMARY_LINES = 10
+
+# Awaits are attributed to the innermost frame in the bot's own code
+_BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class Trace:
+    """Stage timings of one update or job."""
+    name: str
+    started: float = field(default_factory=time.perf_counter)
+    stages: Dict[str, float] = field(default_factory=dict)
+    
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+@dataclass
+class StageStats:
+    """How often a traced stage ran during a profile, and how long it took."""
+    count: int = 0
+    total: float = 0.0
+    slowest: float = 0.0
+    
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.slowest = max(self.slowest, seconds)
+
+
+def _waiting_frame(task: asyncio.Task):
+    """
+    Find the frame a task is waiting in.
+    
+    ``Task.get_stack`` only returns the task's own coroutine, so the chain of
+    coroutines it awaits is followed instead, down to the innermost one in
+    the bot's code rather than in asyncio or an HTTP library.
+    """
+    outer = found = None
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None)
+        if frame is None:
+            break
+        if outer is None:
+            outer = frame
+        if frame.f_code.co_filename.startswith(_BOT_DIR):
+            found = frame
+        coro = coro.cr_await
+    return found or outer
+
+
+class ProfileSession:
+    """
+    Collects a profile of the running bot until stopped.
+    
+    In ``cpu`` mode cProfile records every function call on the event loop
+    thread. In ``tasks`` mode nothing is hooked into calls; instead the
+    await point of every task is sampled, which shows where time is spent
+    waiting rather than computing. Both record the stage timings of traced
+    functions.
+    """
+    
+    def __init__(self, mode: str = CPU):
+        self.mode = mode
+        self.stages: Dict[str, StageStats] = {}
+        self.waits: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        """Start profiling; call from the event loop."""
+        self.started = time.perf_counter()
+        if self.mode == CPU:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = asyncio.create_task(self._sample_tasks(), name="profile-sampler")
+    
+    async def stop(self) -> None:
+        """Stop profiling."""
+        self.elapsed = time.perf_counter() - self.started
+        if self._profile:
+            self._profile.disable()
+        if self._sampler:
+            self._sampler.cancel()
+            await asyncio.gather(self._sampler, return_exceptions=True)
+    
+    def record_stage(self, stage: str, seconds: float) -> None:
+        self.stages.setdefault(stage, StageStats()).add(seconds)
+    
+    async def _sample_tasks(self) -> None:
+        """Count where each task is suspended, once per interval."""
+        current = asyncio.current_task()
+        while True:
+            for task in asyncio.all_tasks():
+                if task is current or task.done():
+                    continue
+                frame = _waiting_frame(task)
+                if frame is not None:
+                    code = frame.f_code
+                    self.waits[(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)] += 1
+            self.samples += 1
+            await asyncio.sleep(TASK_SAMPLE_INTERVAL)
+    
+    def summary(self) -> str:
+        """Describe the hottest functions, busiest waits and slowest stages."""
+        lines = [f"📊 Profile of {self.elapsed:.1f}s ({self.mode})"]
+        
+        if self._profile:
+            stats = pstats.Stats(self._profile).stats
+            hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:SUMMARY_LINES]
+            lines.append("\nHottest functions (own time, calls):")
+            for (file_name, line, function), (_, calls, own, _, _) in hottest:
+                where = f"{os.path.basename(file_name)}:{line} {function}" if line else function
+                lines.append(f"{own * 1000:9.1f} ms {calls:7} {where}")
+        
+        if self.waits:
+            lines.append("\nSlowest awaits (task time spent waiting there):")
+            for (file_name, line, function), count in self.waits.most_common(SUMMARY_LINES):
+                lines.append(f"{count * self.elapsed / max(self.samples, 1):8.2f} s  {file_name}:{line} {function}")
+        
+        if self.stages:
+            lines.append("\nSlowest stages (runs, average, slowest):")
+            slowest = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)[:SUMMARY_LINES]
+            for stage, stats in slowest:
+                lines.append(
+                    f"{stats.count:6} {stats.total / stats.count * 1000:9.1f} ms {stats.slowest * 1000:9.1f} ms  {stage}"
+                )
+        else:
+            lines.append("\nNo traced stages ran.")
+        return "\n".join(lines)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_session: Optional[ProfileSession] = None
+
+
+def is_profiling() -> bool:
+    """Check whether a profile is being collected."""
+    return _session is not None
+
+
+async def profile_for(seconds: float, mode: str = CPU) -> str:
+    """
+    Profile the running bot for a while.
+    
+    Args:
+        seconds: How long to profile for
+        mode: "cpu" for cProfile, or "tasks" to sample where tasks wait
+    
+    Returns:
+        Summary of the profile
+    
+    Raises:
+        RuntimeError: If a profile is already being collected
+    """
+    global _session
+    if _session is not None:
+        raise RuntimeError("A profile is already running")
+    
+    session = _session = ProfileSession(mode)
+    try:
+        session.start()
+        logger.info(f"Profiling for {seconds:g}s ({mode})")
+        await asyncio.sleep(seconds)
+    finally:
+        _session = None
+        await session.stop()
+    return session.summary()
+
+
+def _record(stage: str, seconds: float) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+    if _session is not None:
+        _session.record_stage(stage, seconds)
+
+
+def trace_stage(func):
+    """Decorator recording how long a coroutine function takes, as a stage of the current trace."""
+    stage = func.__qualname__
+    
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _record(stage, time.perf_counter() - started)
+    return wrapper
+
+
+def trace_update(func):
+    """
+    Decorator tracing a handler or job from start to finish.
+    
+    Stages awaited inside it are recorded in its trace, which is logged at
+    debug level when it returns; its own duration is a stage of any trace
+    it runs in and of the profile being collected.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        trace = Trace(func.__qualname__)
+        token = _current_trace.set(trace)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+            total = time.perf_counter() - trace.started
+            _record(trace.name, total)
+            if logger.isEnabledFor(logging.DEBUG):
+                stages = {stage: round(seconds * 1000, 1) for stage, seconds in trace.stages.items()}
+                logger.debug(f"{trace.name} took {total * 1000:.1f} ms", extra={"stages": stages})
+    return wrapper
+
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Retry and circuit breaker helpers for Lexicon Track Adder Bot
+"""
+
+import time
+import random
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: the server is overloaded or restarting
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter."""
+    
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before retrying after a failed attempt.
+        
+        Args:
+            attempt: The attempt that just failed, starting at 1
+        
+        Returns:
+            A random delay up to the exponential backoff cap
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Stops calling a service that keeps failing.
+    
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    requests fail immediately. Once ``reset_timeout`` seconds have passed it
+    half-opens and lets a single probe request through: success closes the
+    breaker again, failure re-opens it for another timeout.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, name: str = "service"):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+    
+    @property
+    def state(self) -> str:
+        """Current state, accounting for an expired open timeout."""
+        with self._lock:
+            if self._state == self.OPEN and self.retry_after() == 0:
+                return self.HALF_OPEN
+            return self._state
+    
+    def retry_after(self) -> float:
+        """Seconds until an open breaker will let a probe through."""
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+    
+    def allow_request(self) -> bool:
+        """Return True if a request may be sent now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self.retry_after() > 0:
+                return False
+            # Half-open: only one probe at a time, unless the last one was
+            # abandoned without reporting back
+            if self._probe_in_flight and time.monotonic() - self._probe_started < self.reset_timeout:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            self._probe_started = time.monotonic()
+            return True
+    
+    def record_success(self) -> None:
+        """Record a successful request."""
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"{self.name} recovered, closing circuit breaker")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+    
+    def record_failure(self) -> None:
+        """Record a failed request."""
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(
+                        f"{self.name} unavailable, opening circuit breaker for {self.reset_timeout:g}s"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+def is_retryable_status(status_code: Optional[int]) -> bool:
+    """Return True for responses that indicate a transient server problem."""
+    return status_code in RETRYABLE_STATUS_CODES
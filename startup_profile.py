@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Startup import profiling for Lexicon Track Adder Bot
+"""
+
+import os
+import sys
+import time
+import subprocess
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Modules each mode imports, in order, before it can do any work
+STARTUP_MODES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    # Setup tests the Lexicon connection with the synchronous client
+    ("setup", ("bot", "lexicon_client")),
+    ("import", ("bulk_import",)),
+    ("bot", ("handlers",)),
+)
+
+
+@dataclass
+class ImportTiming:
+    """One line of ``python -X importtime`` output."""
+    name: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """
+    Parse the stderr of ``python -X importtime``.
+    
+    Args:
+        output: Text written by the interpreter
+    
+    Returns:
+        Timings in the order the interpreter reported them
+    """
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # The header line
+            continue
+        name = fields[2].rstrip()
+        # Nested imports are indented by two spaces per level
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        timings.append(ImportTiming(stripped, depth, self_us, cumulative_us))
+    return timings
+
+
+def profile_import(modules: Tuple[str, ...]) -> Tuple[float, List[ImportTiming]]:
+    """
+    Import modules in a fresh interpreter and time it.
+    
+    Args:
+        modules: Names of the modules to import, in order
+    
+    Returns:
+        Wall-clock seconds for the whole interpreter run, and the import timings
+    """
+    module = ", ".join(modules)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip()}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def _own_imports(timings: List[ImportTiming], modules: Tuple[str, ...]) -> Optional[Tuple[int, List[ImportTiming]]]:
+    """
+    Find the cost of importing ``modules`` in a run's timings.
+    
+    Returns:
+        Their cumulative microseconds and the nested imports they caused,
+        or None if one of them wasn't reported
+    """
+    cumulative_us, nested = 0, []
+    for module in modules:
+        root_index = next(
+            (i for i, t in enumerate(timings) if t.name == module and t.depth == 0), None
+        )
+        if root_index is None:
+            return None
+        # Timings are reported after the imports they caused, so the module's
+        # own imports are the nested lines just before it
+        start = root_index
+        while start > 0 and timings[start - 1].depth > 0:
+            start -= 1
+        cumulative_us += timings[root_index].cumulative_us
+        nested.extend(timings[start:root_index])
+    return cumulative_us, nested
+
+
+def print_startup_profile(top: int = 10) -> None:
+    """Print where each mode spends its startup time."""
+    for mode, modules in STARTUP_MODES:
+        module = ", ".join(modules)
+        try:
+            elapsed, timings = profile_import(modules)
+        except RuntimeError as e:
+            print(f"{mode}: {e}")
+            continue
+        
+        own_imports = _own_imports(timings, modules)
+        if own_imports is None:
+            print(f"{mode}: no import timings reported for {module}")
+            continue
+        cumulative_us, nested = own_imports
+        print(f"\n{mode} mode (import {module}): {cumulative_us / 1000:.1f} ms importing "
+              f"{len(nested)} modules, {elapsed * 1000:.0f} ms including interpreter start")
+        
+        print(f"  {'cumulative':>10}  {'self':>8}  module")
+        for timing in sorted(nested, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+            print(f"  {timing.cumulative_us / 1000:8.1f}ms  {timing.self_us / 1000:6.1f}ms  {timing.name}")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Live status messages for Lexicon Track Adder Bot
+"""
+
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Optional
+from telegram import Message
+from telegram.error import TelegramError
+from utils import format_file_size
+
+if TYPE_CHECKING:
+    from outbound import OutboundScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class StatusMessage:
+    """
+    A single Telegram message that is edited to show a job's progress.
+    
+    Edits are throttled to ``edits_per_second``. Intermediate updates that
+    arrive faster than that are coalesced, so only the latest text is sent
+    once the throttle allows it. Final updates are always delivered.
+    
+    With an outbound scheduler, the message and its edits are queued rather
+    than sent directly, so updating the status never waits on Telegram.
+    """
+    
+    def __init__(
+        self,
+        message: Any,
+        edits_per_second: float = 1.0,
+        outbound: Optional['OutboundScheduler'] = None,
+        chat_id: Optional[int] = None
+    ):
+        # With a scheduler this may be the future of the message's send
+        self.message = message
+        self.outbound = outbound
+        self.chat_id = chat_id if chat_id is not None else getattr(message, 'chat_id', None)
+        self.min_interval = 1.0 / edits_per_second if edits_per_second > 0 else 0.0
+        self._text = getattr(message, 'text', None)
+        self._sent_text = self._text
+        self._last_edit = time.monotonic()
+        self._pending: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+    
+    @classmethod
+    async def send(
+        cls,
+        reply_to: Message,
+        text: str,
+        edits_per_second: float = 1.0,
+        outbound: Optional['OutboundScheduler'] = None
+    ) -> 'StatusMessage':
+        """
+        Reply to a message with a new status message.
+        
+        Args:
+            reply_to: The message to reply to
+            text: Initial status text
+            edits_per_second: Maximum edit rate for this status message
+            outbound: Optional scheduler to queue the message and its edits on
+        
+        Returns:
+            The status message
+        """
+        if outbound is not None:
+            return cls.queue(outbound, reply_to.chat_id, text, reply_to.message_id, edits_per_second)
+        message = await reply_to.reply_text(text)
+        return cls(message, edits_per_second)
+    
+    @classmethod
+    def queue(
+        cls,
+        outbound: 'OutboundScheduler',
+        chat_id: int,
+        text: str,
+        reply_to_message_id: Optional[int] = None,
+        edits_per_second: float = 1.0
+    ) -> 'StatusMessage':
+        """
+        Queue a new status message on an outbound scheduler.
+        
+        Updates made before the message goes out replace its text.
+        
+        Args:
+            outbound: The scheduler to send the message and its edits through
+            chat_id: Chat to send the message to
+            text: Initial status text
+            reply_to_message_id: Optional message to reply to
+            edits_per_second: Maximum edit rate for this status message
+        
+        Returns:
+            The status message
+        """
+        status = cls(None, edits_per_second, outbound, chat_id)
+        status.message = outbound.send(chat_id, text, reply_to_message_id, key=status)
+        status._text = status._sent_text = text
+        return status
+    
+    async def update(self, text: str, final: bool = False) -> None:
+        """
+        Change the status text.
+        
+        Args:
+            text: New status text
+            final: Deliver this text even if it has to wait for the throttle
+        """
+        self._text = text
+        wait = self._last_edit + self.min_interval - time.monotonic()
+        
+        if final:
+            if self._pending:
+                self._pending.cancel()
+                self._pending = None
+            # The scheduler coalesces edits itself, so don't hold up the caller
+            if wait > 0 and self.outbound is None:
+                await asyncio.sleep(wait)
+            await self._flush()
+        elif wait <= 0:
+            await self._flush()
+        elif self._pending is None:
+            self._pending = asyncio.create_task(self._flush_later(wait))
+    
+    async def progress(self, label: str, done: int, total: int) -> None:
+        """
+        Show a byte progress line.
+        
+        Args:
+            label: What is in progress, e.g. "📥 Downloading song.mp3"
+            done: Bytes processed so far
+            total: Total bytes, or 0 if unknown
+        """
+        if total:
+            percent = done * 100 // total
+            await self.update(f"{label}\n{format_file_size(done)} / {format_file_size(total)} ({percent}%)")
+        else:
+            await self.update(f"{label}\n{format_file_size(done)}")
+    
+    async def _flush_later(self, delay: float) -> None:
+        """Send the latest text once the throttle interval has passed."""
+        await asyncio.sleep(delay)
+        self._pending = None
+        await self._flush()
+    
+    async def _flush(self) -> None:
+        """Edit the message to the latest text if it changed."""
+        async with self._lock:
+            text = self._text
+            if text == self._sent_text:
+                return
+            if self.outbound is not None:
+                self.outbound.edit(self.chat_id, self.message, text, key=self)
+                self._sent_text = text
+                self._last_edit = time.monotonic()
+                return
+            try:
+                await self.message.edit_text(text)
+                self._sent_text = text
+            except TelegramError as e:
+                logger.warning(f"Failed to update status message: {e}")
+            finally:
+                self._last_edit = time.monotonic()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Logging pipeline for Lexicon Track Adder Bot
+"""
+
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Tuple
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Records waiting for the writer thread; beyond this they are dropped rather
+# than make the event loop wait
+LOG_QUEUE_SIZE = 10000
+
+# Payloads are cut to this many characters when written
+PAYLOAD_MAX_CHARS = 2000
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _payload_text(payload: Any) -> Tuple[str, bool]:
+    """Serialise a payload, returning the text and whether it was cut short."""
+    try:
+        text = json.dumps(payload, default=str, ensure_ascii=False)
+    except (TypeError, ValueError):
+        text = repr(payload)
+    if len(text) > PAYLOAD_MAX_CHARS:
+        return text[:PAYLOAD_MAX_CHARS] + "...", True
+    return text, False
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a JSON object on one line."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        
+        if "payload" in entry:
+            text, truncated = _payload_text(entry["payload"])
+            if truncated:
+                entry["payload"] = text
+                entry["payload_truncated"] = True
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, followed by the record's payload if it has one."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if hasattr(record, "payload"):
+            payload, _ = _payload_text(record.payload)
+            text = f"{text}: {payload}"
+        skipped = getattr(record, "payloads_skipped", 0)
+        if skipped:
+            text = f"{text} ({skipped} similar records skipped)"
+        dropped = getattr(record, "records_dropped", 0)
+        if dropped:
+            text = f"{text} ({dropped} records dropped while the log was backed up)"
+        return text
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Lets through at most ``per_minute`` records with a payload per logger.
+    
+    Records logged with ``extra={"payload": ...}`` carry whole API responses
+    and can arrive once per track under bulk load. Beyond the limit they are
+    dropped, and the next one let through counts how many were skipped.
+    Records without a payload always pass.
+    """
+    
+    def __init__(self, per_minute: int = 10):
+        super().__init__()
+        self.per_minute = per_minute
+        self._lock = threading.Lock()
+        # Logger name -> (window start, records let through, records skipped)
+        self._windows: Dict[str, Tuple[float, int, int]] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "payload"):
+            return True
+        if self.per_minute <= 0:
+            return False
+        
+        now = time.monotonic()
+        with self._lock:
+            start, count, skipped = self._windows.get(record.name, (now, 0, 0))
+            if now - start >= 60:
+                start, count = now, 0
+            if count >= self.per_minute:
+                self._windows[record.name] = (start, count, skipped + 1)
+                return False
+            self._windows[record.name] = (start, count + 1, 0)
+        
+        if skipped:
+            record.payloads_skipped = skipped
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them.
+    
+    The stock handler formats the message and traceback before queueing;
+    here tracebacks and payloads are formatted by the writer thread, so
+    logging an error costs the caller little more than a queue put. A full
+    queue drops the record instead of blocking, and the next record queued
+    says how many were lost.
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # Arguments may change after the call returns, so merge them now
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.records_dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+
+def setup_logging(level: str = "INFO", log_format: str = "json",
+                  payloads_per_minute: int = 10) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue to a writer thread.
+    
+    Log calls on the event loop only put the record on a queue; formatting
+    and writing to stderr happen on the listener's thread. Replaces any
+    handlers already on the root logger.
+    
+    Args:
+        level: Level name for the root logger
+        log_format: "json" for one JSON object per line, or "text"
+        payloads_per_minute: Records with a payload let through per logger
+            and minute (0 drops them all)
+    
+    Returns:
+        The running listener; it is also stopped, flushing the queue, at exit
+    """
+    if log_format == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter(TEXT_FORMAT)
+    stream = logging.StreamHandler()
+    stream.setFormatter(formatter)
+    
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(PayloadSampler(payloads_per_minute))
+    
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    # httpx logs every request at INFO, which is one line per download
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -5,6 +5,15 @@ Test script for Lexicon Track Adder Bot
 
 import os
 import sys
+import json
+import time
+import queue
+import logging
+import socket
+import asyncio
+import threading
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import tempfile
 import unittest
 from unittest.mock import Mock, patch, AsyncMock
@@ -12,10 +21,32 @@ from unittest.mock import Mock, patch, AsyncMock
 # Add the current directory to the path so we can import our modules
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from config import Config, load_config, save_config
-from utils import is_admin, is_mp3_file, validate_directory, sanitize_filename
+from config import Config, ConfigReloader, load_config, save_config
+from utils import is_admin, is_authorized, is_mp3_file, validate_directory, sanitize_filename
+from users import load_user_profiles
+import httpx
 from lexicon_client import LexiconClient
-from download_manager import DownloadManager
+from async_lexicon_client import AsyncLexiconClient
+from download_manager import DownloadManager, FilenameIndex, take_local_file
+from lexicon_batcher import LexiconBatcher
+from download_queue import DownloadJob, DownloadQueue
+from dedup_index import DedupIndex, hash_file
+from disk_space import DiskSpaceManager
+from id3 import read_tags
+from bulk_import import BulkImporter
+from status_message import StatusMessage
+from outbound import OutboundScheduler, TokenBucket
+from media_group import MediaGroupCollector
+from lexicon_index import LexiconLibraryIndex
+from resilience import RetryPolicy, CircuitBreaker
+from error_handler import DownloadError, LexiconError, LexiconRejectedError, InsufficientSpaceError
+from job_journal import JobJournal, RECEIVED, DOWNLOADING, DOWNLOADED, LEXICON_ADDED, DONE, FAILED
+from pipeline_stats import PipelineStats
+from metrics import Counter, Histogram, Registry, start_metrics_server
+from benchmark import synthetic_mp3, percentile
+from startup_profile import parse_importtime
+import profiling
+from structured_logging import JsonFormatter, PayloadSampler, _QueueHandler
 
 
 class TestConfig(unittest.TestCase):
@@ -52,6 +83,46 @@ class TestConfig(unittest.TestCase):
         config = Config.from_dict(data)
         self.assertEqual(config.bot_token, "test")
         self.assertEqual(config.admin_user_id, 123)
+    
+    def test_config_reloader(self):
+        """Test the config file is only reloaded after it changes."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config_file = os.path.join(temp_dir, "config.json")
+            with open(config_file, 'w') as f:
+                json.dump({"bot_token": "test", "admin_user_id": 1}, f)
+            reloader = ConfigReloader(config_file)
+            self.assertEqual(reloader.config.admin_user_id, 1)
+            self.assertEqual(reloader.check(), [])
+            
+            with open(config_file, 'w') as f:
+                json.dump({"bot_token": "test", "admin_user_id": 2}, f)
+            os.utime(config_file, ns=(0, 1))
+            self.assertEqual(reloader.check(), ["admin_user_id"])
+            self.assertEqual(reloader.config.admin_user_id, 2)
+            
+            # A broken edit keeps the previous settings
+            with open(config_file, 'w') as f:
+                f.write("{")
+            os.utime(config_file, ns=(0, 2))
+            with patch('builtins.print'):
+                self.assertEqual(reloader.check(), [])
+            self.assertEqual(reloader.config.admin_user_id, 2)
+    
+    def test_apply_config(self):
+        """Test reloadable settings apply and the download manager follows the directory."""
+        from handlers import apply_config
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config = Config(bot_token="test", admin_user_id=1, download_dir=temp_dir, metrics_port=0)
+            application = Mock(bot_data={'config': config, 'download_manager': DownloadManager(temp_dir)})
+            new_dir = os.path.join(temp_dir, "new")
+            os.makedirs(new_dir)
+            new_config = Config(bot_token="test", admin_user_id=2, download_dir=new_dir, metrics_port=9090)
+            
+            apply_config(application, new_config, ["admin_user_id", "download_dir", "metrics_port"])
+        
+        self.assertEqual(application.bot_data['config'].admin_user_id, 2)
+        self.assertEqual(application.bot_data['config'].metrics_port, 0)
+        self.assertEqual(application.bot_data['download_manager'].download_dir, new_dir)
 
 
 class TestUtils(unittest.TestCase):
@@ -63,6 +134,30 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(is_admin(12345, config))
         self.assertFalse(is_admin(54321, config))
     
+    def test_user_profiles(self):
+        """Test authorised users inherit the top-level settings they don't override."""
+        temp_dir = tempfile.mkdtemp()
+        config = Config(
+            admin_user_id=1,
+            download_dir="/music",
+            lexicon_api_url="http://lexicon:48624/v1",
+            users=[
+                {"user_id": 2, "download_dir": temp_dir, "weight": 2},
+                {"user_id": 3, "lexicon_api_url": "http://other:48624/v1"},
+                {"download_dir": temp_dir}
+            ]
+        )
+        users = load_user_profiles(config)
+        
+        self.assertEqual(set(users), {1, 2, 3})
+        self.assertTrue(is_authorized(3, users))
+        self.assertFalse(is_authorized(4, users))
+        self.assertEqual(users[1].download_dir, "/music")
+        self.assertEqual((users[2].download_dir, users[2].weight), (temp_dir, 2.0))
+        self.assertEqual(users[2].lexicon_api_url, "http://lexicon:48624/v1")
+        self.assertEqual((users[3].download_dir, users[3].lexicon_api_url), ("/music", "http://other:48624/v1"))
+        os.rmdir(temp_dir)
+    
     def test_is_mp3_file(self):
         """Test MP3 file validation."""
         # Mock document with MP3 file
@@ -115,6 +210,632 @@ class TestLexiconClient(unittest.TestCase):
         self.assertFalse(result)
 
 
+class TestAsyncLexiconClient(unittest.IsolatedAsyncioTestCase):
+    """Test asynchronous Lexicon API client."""
+    
+    def make_client(self, handler):
+        """Create a client backed by a mock transport."""
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return AsyncLexiconClient(
+            "http://test.example.com/v1",
+            client=http_client,
+            retry_policy=RetryPolicy(attempts=3, base_delay=0)
+        )
+    
+    async def test_add_track_success(self):
+        """Test adding a track returns the first track in the response."""
+        def handler(request):
+            self.assertEqual(request.url.path, "/v1/tracks")
+            return httpx.Response(200, json={"data": {"tracks": [{"title": "Song", "artist": "Artist"}]}})
+        
+        client = self.make_client(handler)
+        track = await client.add_track("/music/song.mp3")
+        await client.close()
+        self.assertEqual(track["title"], "Song")
+    
+    async def test_add_track_error(self):
+        """Test a non-200 response raises LexiconError."""
+        client = self.make_client(lambda request: httpx.Response(500, text="boom"))
+        with self.assertRaises(LexiconError) as raised:
+            await client.add_track("/music/song.mp3")
+        await client.close()
+        self.assertNotIsInstance(raised.exception, LexiconRejectedError)
+    
+    async def test_add_track_rejected(self):
+        """Test a client error means the track won't be accepted on a retry either."""
+        client = self.make_client(lambda request: httpx.Response(400, text="not an audio file"))
+        with self.assertRaises(LexiconRejectedError):
+            await client.add_track("/music/song.mp3")
+        await client.close()
+    
+    async def test_transient_failures_are_retried(self):
+        """Test a 503 followed by success is retried transparently."""
+        responses = [httpx.Response(503), httpx.Response(200, json={"data": {"track": {"title": "Song"}}})]
+        client = self.make_client(lambda request: responses.pop(0))
+        track = await client.add_track("/music/song.mp3")
+        await client.close()
+        self.assertEqual(track["title"], "Song")
+    
+    async def test_circuit_breaker_fails_fast(self):
+        """Test an open circuit breaker stops requests reaching Lexicon."""
+        from error_handler import LexiconUnavailableError
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError("Connection refused")
+        
+        client = self.make_client(handler)
+        client.circuit_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        with self.assertRaises(LexiconError):
+            await client.add_track("/music/song.mp3")
+        with self.assertRaises(LexiconUnavailableError):
+            await client.add_track("/music/song.mp3")
+        await client.close()
+        self.assertEqual(len(calls), 3)
+    
+    async def test_test_connection_failure(self):
+        """Test a transport error is reported as a failed connection."""
+        def handler(request):
+            raise httpx.ConnectError("Connection error")
+        
+        client = self.make_client(handler)
+        self.assertFalse(await client.test_connection())
+        await client.close()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test the circuit breaker state machine."""
+    
+    def test_opens_half_opens_and_closes(self):
+        """Test the breaker opens on failures and probes after the timeout."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+        
+        import time
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        # Only one probe is let through while half-open
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_failed_probe_reopens(self):
+        """Test a failed probe re-opens the breaker."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.reset_timeout = 60
+        breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+
+class TestLexiconBatcher(unittest.IsolatedAsyncioTestCase):
+    """Test batched Lexicon ingestion."""
+    
+    async def test_tracks_are_coalesced(self):
+        """Test concurrent adds are sent as one request and mapped back."""
+        requests_seen = []
+        
+        def handler(request):
+            locations = json.loads(request.content)["locations"]
+            requests_seen.append(locations)
+            tracks = [{"location": path, "title": os.path.basename(path)} for path in reversed(locations)]
+            return httpx.Response(200, json={"data": {"tracks": tracks}})
+        
+        client = AsyncLexiconClient(
+            "http://test.example.com/v1",
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+        batcher = LexiconBatcher(client, window=0.05, max_size=10)
+        
+        results = await asyncio.gather(*(batcher.add_track(f"/music/{i}.mp3") for i in range(3)))
+        await batcher.close()
+        await client.close()
+        
+        self.assertEqual(len(requests_seen), 1)
+        self.assertEqual([track["title"] for track in results], ["0.mp3", "1.mp3", "2.mp3"])
+    
+    async def test_batch_size_limit(self):
+        """Test a full batch is sent without waiting for the window."""
+        client = Mock()
+        client.add_tracks = AsyncMock(side_effect=lambda paths: [{"title": path} for path in paths])
+        batcher = LexiconBatcher(client, window=60, max_size=2)
+        
+        results = await asyncio.wait_for(
+            asyncio.gather(batcher.add_track("a.mp3"), batcher.add_track("b.mp3")),
+            timeout=1
+        )
+        self.assertEqual(results, [{"title": "a.mp3"}, {"title": "b.mp3"}])
+    
+    async def test_batch_failure_propagates(self):
+        """Test every caller in a failed batch receives the error."""
+        client = Mock()
+        client.add_tracks = AsyncMock(side_effect=LexiconError("down"))
+        batcher = LexiconBatcher(client, window=0.01)
+        
+        with self.assertRaises(LexiconError):
+            await batcher.add_track("a.mp3")
+    
+    async def test_cancelled_flush_fails_waiting_callers(self):
+        """Test callers get an error instead of waiting forever when a flush is cancelled."""
+        async def hang(paths):
+            await asyncio.sleep(60)
+        
+        client = Mock(add_tracks=hang)
+        batcher = LexiconBatcher(client, window=0)
+        
+        caller = asyncio.create_task(batcher.add_track("a.mp3"))
+        await asyncio.sleep(0.01)
+        for task in batcher._tasks:
+            task.cancel()
+        
+        with self.assertRaises(LexiconError):
+            await asyncio.wait_for(caller, timeout=1)
+
+
+class TestLexiconLibraryIndex(unittest.IsolatedAsyncioTestCase):
+    """Test the local Lexicon library index."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.index = LexiconLibraryIndex()
+        self.index.update([
+            {"id": 1, "title": "Around the World", "artist": "Daft Punk", "location": "/music/atw.mp3"},
+            {"id": 2, "title": "One More Time", "artist": "Daft Punk", "location": "/music/omt.mp3"},
+            {"id": 3, "title": "Windowlicker", "artist": "Aphex Twin", "location": "/music/wl.mp3"},
+        ])
+    
+    def test_lookups_and_search(self):
+        """Test tracks can be found by location, title/artist and words."""
+        self.assertEqual(self.index.find_location("/music/../music/wl.mp3")["id"], 3)
+        self.assertEqual([t["id"] for t in self.index.find_title_artist("one more time", "DAFT PUNK")], [2])
+        self.assertEqual([t["id"] for t in self.index.search("daft pu")], [1, 2])
+        self.assertEqual([t["id"] for t in self.index.search("punk world")], [1])
+        self.assertEqual(self.index.search("nothing"), [])
+    
+    def test_incremental_update(self):
+        """Test a refresh only applies changes and drops removed tracks."""
+        changed, removed = self.index.update([
+            {"id": 1, "title": "Around the World", "artist": "Daft Punk", "location": "/music/atw.mp3"},
+            {"id": 2, "title": "One More Time (Edit)", "artist": "Daft Punk", "location": "/music/omt.mp3"},
+        ])
+        self.assertEqual((changed, removed), (1, 1))
+        self.assertIsNone(self.index.find_location("/music/wl.mp3"))
+        self.assertEqual(self.index.search("aphex"), [])
+        self.assertEqual([t["id"] for t in self.index.search("edit")], [2])
+    
+    async def test_client_skips_known_locations(self):
+        """Test only unknown locations are posted and search stays local."""
+        posted = []
+        
+        def handler(request):
+            locations = json.loads(request.content)["locations"]
+            posted.append(locations)
+            tracks = [{"id": 10, "title": "New", "artist": "Artist", "location": path} for path in locations]
+            return httpx.Response(200, json={"data": {"tracks": tracks}})
+        
+        client = AsyncLexiconClient(
+            "http://test.example.com/v1",
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            library_index=self.index
+        )
+        tracks = await client.add_tracks(["/music/atw.mp3", "/music/new.mp3"])
+        self.assertEqual(posted, [["/music/new.mp3"]])
+        self.assertEqual([t["id"] for t in tracks], [1, 10])
+        
+        self.assertEqual((await client.add_track("/music/new.mp3"))["id"], 10)
+        self.assertEqual([t["id"] for t in await client.search_tracks("new")], [10])
+        self.assertEqual(len(posted), 1)
+        await client.close()
+
+
+class TestDownloadQueue(unittest.IsolatedAsyncioTestCase):
+    """Test the download job queue."""
+    
+    async def test_jobs_of_one_chat_run_in_parallel(self):
+        """Test one chat's jobs start in order and use every worker."""
+        started = []
+        running = 0
+        max_running = 0
+        done = asyncio.Event()
+        
+        async def process(job):
+            nonlocal running, max_running
+            started.append(job.job_id)
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if len(started) == 6:
+                done.set()
+        
+        queue = DownloadQueue(process, workers=3)
+        queue.start()
+        jobs = [DownloadJob(queue.next_job_id(), 1, None, "a.mp3") for _ in range(6)]
+        for job in jobs:
+            queue.submit(job)
+        await asyncio.wait_for(done.wait(), timeout=1)
+        await queue.stop()
+        
+        self.assertEqual(started, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(max_running, 3)
+        self.assertIsNone(jobs[0].previous)
+        self.assertIs(jobs[1].previous, jobs[0].reported)
+    
+    async def test_results_are_shown_in_the_order_files_were_sent(self):
+        """Test a job that finishes early waits for the chat's previous job to show its result."""
+        from handlers import report_status
+        shown = []
+        context = Mock(bot_data={})
+        context.application.create_task = lambda coroutine, update=None: asyncio.create_task(coroutine)
+        context.bot.send_message = AsyncMock(side_effect=lambda chat_id, text: shown.append(text))
+        
+        async def process(job):
+            # The first file is the slowest to download
+            await asyncio.sleep(0.05 if job.job_id == 1 else 0.01)
+            await report_status(job, f"done {job.job_id}", final=True)
+        
+        queue = DownloadQueue(process, workers=2)
+        queue.start()
+        jobs = [DownloadJob(queue.next_job_id(), 1, None, "a.mp3", context=context) for _ in range(2)]
+        for job in jobs:
+            queue.submit(job)
+        await asyncio.wait_for(jobs[1].reported, timeout=1)
+        await queue.stop()
+        
+        self.assertEqual(shown, ["done 1", "done 2"])
+    
+    async def test_unexpected_lexicon_error_still_shows_the_result(self):
+        """Test a crash while adding to Lexicon doesn't hold up the chat's later results."""
+        from handlers import add_to_lexicon
+        context = Mock(bot_data={})
+        context.bot.send_message = AsyncMock()
+        batcher = Mock(add_track=AsyncMock(side_effect=RuntimeError("bug")))
+        job = DownloadJob(1, 1, None, "a.mp3", context=context, key="1:1")
+        job.reported = asyncio.get_running_loop().create_future()
+        
+        with patch('handlers.lexicon_for', return_value=(Mock(), batcher)), \
+                patch('handlers.record_job') as record_job:
+            await add_to_lexicon(job, "/music/a.mp3")
+        
+        self.assertTrue(job.reported.done())
+        record_job.assert_called_once_with(job, FAILED)
+        self.assertIn("unexpected error", context.bot.send_message.call_args.args[1])
+    
+    async def test_rejected_track_is_not_retried_on_restart(self):
+        """Test a track Lexicon refuses is failed rather than left for the next restart."""
+        from handlers import add_to_lexicon
+        context = Mock(bot_data={})
+        context.bot.send_message = AsyncMock()
+        job = DownloadJob(1, 1, None, "a.mp3", context=context, key="1:1")
+        
+        for error, recorded in ((LexiconRejectedError("400"), [((job, FAILED),)]), (LexiconError("500"), [])):
+            batcher = Mock(add_track=AsyncMock(side_effect=error))
+            with patch('handlers.lexicon_for', return_value=(Mock(), batcher)), \
+                    patch('handlers.record_job') as record_job:
+                await add_to_lexicon(job, "/music/a.mp3")
+            self.assertEqual(record_job.call_args_list, recorded)
+    
+    async def test_users_share_workers_fairly(self):
+        """Test a single track from one user isn't stuck behind another user's bulk forward."""
+        order = []
+        running = {}
+        max_running = {}
+        done = asyncio.Event()
+        
+        async def process(job):
+            order.append(job.user_id)
+            running[job.chat_id] = running.get(job.chat_id, 0) + 1
+            max_running[job.chat_id] = max(max_running.get(job.chat_id, 0), running[job.chat_id])
+            await asyncio.sleep(0.005)
+            running[job.chat_id] -= 1
+            if len(order) == 14:
+                done.set()
+        
+        queue = DownloadQueue(process, workers=2, weight=lambda user_id: 2.0 if user_id == 3 else 1.0)
+        # Each user sends from their own private chat: user 1 forwards ten
+        # files, then users 2 and 3 send theirs
+        for _ in range(10):
+            queue.submit(DownloadJob(queue.next_job_id(), 1, None, "a.mp3", user_id=1))
+        queue.submit(DownloadJob(queue.next_job_id(), 2, None, "b.mp3", user_id=2))
+        for _ in range(3):
+            queue.submit(DownloadJob(queue.next_job_id(), 3, None, "c.mp3", user_id=3))
+        queue.start()
+        await asyncio.wait_for(done.wait(), timeout=1)
+        await queue.stop()
+        
+        self.assertLessEqual(order.index(2), 1)
+        # User 3's weight of 2 gets them two turns for each of user 1's
+        self.assertEqual(order[:6].count(3), 3)
+        # Once the others are done, user 1's files use both workers
+        self.assertEqual(max_running[1], 2)
+    
+    async def test_users_in_one_group_chat_share_workers_fairly(self):
+        """Test a user's bulk forward in a group doesn't hold up another member's track."""
+        order = []
+        done = asyncio.Event()
+        
+        async def process(job):
+            order.append(job.user_id)
+            await asyncio.sleep(0.005)
+            job.reported.set_result(None)
+            if len(order) == 11:
+                done.set()
+        
+        queue = DownloadQueue(process, workers=1)
+        jobs = [DownloadJob(queue.next_job_id(), -100, None, "a.mp3", user_id=1) for _ in range(10)]
+        jobs.append(DownloadJob(queue.next_job_id(), -100, None, "b.mp3", user_id=2))
+        for job in jobs:
+            queue.submit(job)
+        queue.start()
+        await asyncio.wait_for(done.wait(), timeout=1)
+        await queue.stop()
+        
+        self.assertLessEqual(order.index(2), 1)
+        # Results are still chained in the order the files were sent to the chat
+        self.assertIs(jobs[-1].previous, jobs[-2].reported)
+    
+    async def test_submit_reports_jobs_ahead(self):
+        """Test submit returns the number of jobs ahead."""
+        queue = DownloadQueue(AsyncMock(), workers=1)
+        self.assertEqual(queue.submit(DownloadJob(1, 1, None, "a.mp3")), 0)
+        self.assertEqual(queue.submit(DownloadJob(2, 2, None, "b.mp3")), 1)
+        self.assertEqual(queue.pending, 2)
+
+
+class TestMediaGroupCollector(unittest.IsolatedAsyncioTestCase):
+    """Test album collection."""
+    
+    async def test_groups_items_until_window_closes(self):
+        """Test items sharing a group ID are delivered together."""
+        groups = []
+        
+        async def on_complete(items):
+            groups.append(items)
+        
+        collector = MediaGroupCollector(on_complete, window=0.05)
+        collector.add("a", 1)
+        collector.add("b", 10)
+        await asyncio.sleep(0.02)
+        collector.add("a", 2)
+        await asyncio.sleep(0.1)
+        await collector.close()
+        
+        self.assertEqual(sorted(groups), [[1, 2], [10]])
+    
+    async def test_album_is_reported_in_one_message(self):
+        """Test an album's files are downloaded together with a single summary."""
+        from handlers import process_album
+        download_manager = Mock(disk_space=None)
+        download_manager.find_existing.side_effect = lambda document: "/music/old.mp3" if document.file_id == "b" else None
+        download_manager.download_file = AsyncMock(side_effect=lambda document, *args: f"/music/{document.file_id}.mp3")
+        download_manager.register_download = AsyncMock(side_effect=lambda document, path: path)
+        context = Mock(bot_data={
+            'config': Config(download_dir="/music"),
+            'download_manager': download_manager
+        })
+        parts = [
+            DownloadJob(job_id=index, chat_id=1, document=Mock(file_id=file_id, file_size=10),
+                        file_name=f"{file_id}.mp3", context=context, key=f"1:{index}")
+            for index, file_id in enumerate(["a", "b", "c"], 1)
+        ]
+        status = Mock(update=AsyncMock(), progress=AsyncMock())
+        album = DownloadJob(job_id=4, chat_id=1, document=None, file_name="Album (3 files)",
+                            context=context, status=status, parts=parts)
+        
+        await process_album(album)
+        
+        self.assertEqual(download_manager.download_file.await_count, 2)
+        status.update.assert_awaited_once()
+        text = status.update.call_args.args[0]
+        self.assertIn("Downloaded 2 of 3 files", text)
+        self.assertIn("♻️ b.mp3", text)
+        self.assertTrue(status.update.call_args.kwargs["final"])
+
+
+class TestDiskSpaceManager(unittest.IsolatedAsyncioTestCase):
+    """Test disk space admission control."""
+    
+    def setUp(self):
+        """Set up a download directory holding 400 bytes."""
+        self.temp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.temp_dir, "old.mp3"), 'wb') as f:
+            f.write(b"\0" * 400)
+        self.disk_space = DiskSpaceManager(self.temp_dir, quota_bytes=1000)
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.temp_dir)
+    
+    def test_quota_refuses_files_that_can_never_fit(self):
+        """Test files larger than the remaining quota are refused outright."""
+        self.assertEqual(self.disk_space.used, 400)
+        self.assertIsNone(self.disk_space.check(600))
+        self.assertIn("quota", self.disk_space.check(601))
+    
+    def test_reservations_share_the_remaining_space(self):
+        """Test queued downloads reserve space until they are committed."""
+        self.assertTrue(self.disk_space.reserve("a", 400))
+        self.assertTrue(self.disk_space.reserve("a", 400))
+        self.assertFalse(self.disk_space.reserve("b", 300))
+        self.assertIsNone(self.disk_space.check(300))
+        self.assertEqual(self.disk_space.reserved, 400)
+        
+        self.disk_space.commit("a", 400)
+        self.assertEqual(self.disk_space.reserved, 0)
+        self.assertEqual(self.disk_space.used, 800)
+        self.assertIsNotNone(self.disk_space.check(300))
+    
+    async def test_files_removed_outside_the_bot_free_quota(self):
+        """Test the directory is rescanned before a file is refused for the quota."""
+        self.assertIsNone(await self.disk_space.check_fresh(600))
+        self.assertIn("quota", await self.disk_space.check_fresh(700))
+        
+        os.remove(os.path.join(self.temp_dir, "old.mp3"))
+        self.assertIsNone(await self.disk_space.check_fresh(700))
+        self.assertEqual(self.disk_space.used, 0)
+    
+    async def test_acquire_waits_for_released_space(self):
+        """Test a download waits for another to give up its reservation."""
+        self.disk_space.reserve("a", 400)
+        waiter = asyncio.create_task(self.disk_space.acquire("b", 300, timeout=5))
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiter.done())
+        
+        self.disk_space.release("a")
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(self.disk_space.reserved, 300)
+    
+    async def test_acquire_fails_once_space_is_gone(self):
+        """Test a waiting download is refused when the others fill the quota."""
+        self.disk_space.reserve("a", 400)
+        waiter = asyncio.create_task(self.disk_space.acquire("b", 300, timeout=5))
+        await asyncio.sleep(0.05)
+        
+        with open(os.path.join(self.temp_dir, "a.mp3"), 'wb') as f:
+            f.write(b"\0" * 400)
+        self.disk_space.commit("a", 400)
+        with self.assertRaises(InsufficientSpaceError):
+            await asyncio.wait_for(waiter, 1)
+    
+    async def test_refused_job_is_not_queued(self):
+        """Test a file over the quota is refused before it reaches the queue."""
+        from handlers import queue_job
+        download_manager = DownloadManager(self.temp_dir, disk_space=self.disk_space)
+        download_queue = Mock(backlog=0)
+        message = Mock(reply_text=AsyncMock())
+        context = Mock(bot_data={
+            'config': Config(download_dir=self.temp_dir),
+            'download_manager': download_manager,
+            'download_queue': download_queue,
+            'job_journal': None
+        })
+        job = DownloadJob(job_id=1, chat_id=1, document=Mock(file_size=700, file_unique_id="u"),
+                          file_name="big.mp3", update=Mock(message=message), context=context, key="1:1")
+        
+        await queue_job(job, "Queued")
+        
+        download_queue.submit.assert_not_called()
+        self.assertIn("quota", message.reply_text.call_args.args[0])
+
+
+class TestOutboundScheduler(unittest.IsolatedAsyncioTestCase):
+    """Test rate-limited, coalescing message delivery."""
+    
+    def setUp(self):
+        """Set up a scheduler with a fake bot."""
+        self.bot = Mock()
+        self.bot.send_message = AsyncMock(side_effect=lambda chat_id, text, **kwargs: Mock(message_id=len(text)))
+        self.bot.edit_message_text = AsyncMock()
+        self.outbound = OutboundScheduler(self.bot, messages_per_second=100, chat_messages_per_second=100)
+    
+    async def asyncTearDown(self):
+        await self.outbound.close(timeout=1)
+    
+    def test_token_bucket(self):
+        """Test the bucket allows its burst, then its rate."""
+        bucket = TokenBucket(rate=2, burst=2)
+        now = 1000.0
+        bucket._updated = now
+        bucket.take(now)
+        bucket.take(now)
+        self.assertAlmostEqual(bucket.wait_time(now), 0.5)
+        self.assertEqual(bucket.wait_time(now + 0.5), 0)
+    
+    async def test_pending_messages_are_coalesced(self):
+        """Test waiting replies to a chat are merged and status edits replace each other."""
+        self.outbound.send(1, "first", reply_to_message_id=10)
+        last = self.outbound.send(1, "second", reply_to_message_id=11)
+        status = self.outbound.send(1, "Queued", key="status")
+        self.outbound.edit(1, status, "Downloading", key="status")
+        self.outbound.edit(1, status, "Done", key="status")
+        
+        self.outbound.start()
+        await asyncio.wait_for(asyncio.gather(last, status), 1)
+        
+        texts = [call.args[1] for call in self.bot.send_message.await_args_list]
+        self.assertEqual(texts, ["first\n\nsecond", "Done"])
+        self.assertEqual(self.bot.send_message.await_args_list[0].kwargs["reply_to_message_id"], 10)
+        self.bot.edit_message_text.assert_not_awaited()
+    
+    async def test_spaced_messages_keep_the_chat_rate(self):
+        """Test messages arriving a little apart still wait for the chat's rate."""
+        sent = []
+        
+        async def send_message(chat_id, text, **kwargs):
+            sent.append(time.monotonic())
+            return Mock(message_id=len(sent))
+        
+        self.bot.send_message = AsyncMock(side_effect=send_message)
+        self.outbound = OutboundScheduler(self.bot, messages_per_second=100, chat_messages_per_second=10)
+        self.outbound.start()
+        futures = []
+        for index in range(8):
+            futures.append(self.outbound.send(1, f"message {index}", key=index))
+            await asyncio.sleep(0.02)
+        await asyncio.wait_for(asyncio.gather(*futures), 2)
+        
+        # A burst of three, then the other five at ten per second
+        self.assertGreaterEqual(sent[-1] - sent[0], 0.45)
+    
+    async def test_retry_after_pauses_only_that_chat(self):
+        """Test a flood limit delays its own chat and not the others."""
+        from datetime import timedelta
+        from telegram.error import RetryAfter
+        sent = []
+        
+        async def send_message(chat_id, text, **kwargs):
+            if chat_id == 1 and not sent:
+                sent.append("flood")
+                raise RetryAfter(timedelta(milliseconds=200))
+            sent.append(text)
+            return Mock(message_id=1)
+        
+        self.bot.send_message = AsyncMock(side_effect=send_message)
+        self.outbound.start()
+        slow = self.outbound.send(1, "chat 1")
+        await asyncio.sleep(0.05)
+        fast = self.outbound.send(2, "chat 2")
+        
+        await asyncio.wait_for(fast, 0.1)
+        self.assertFalse(slow.done())
+        await asyncio.wait_for(slow, 1)
+        self.assertEqual(sent, ["flood", "chat 2", "chat 1"])
+
+
+class TestStatusMessage(unittest.IsolatedAsyncioTestCase):
+    """Test throttled status message updates."""
+    
+    async def test_updates_are_throttled_and_coalesced(self):
+        """Test rapid updates collapse into one edit and the final text is sent."""
+        message = Mock(text="Queued")
+        message.edit_text = AsyncMock()
+        status = StatusMessage(message, edits_per_second=20)
+        
+        for percent in range(10):
+            await status.update(f"Downloading {percent}%")
+        await status.update("Done", final=True)
+        
+        edited = [call.args[0] for call in message.edit_text.call_args_list]
+        self.assertEqual(edited, ["Done"])
+    
+    async def test_pending_update_is_sent_after_interval(self):
+        """Test a throttled update is delivered once the interval passes."""
+        message = Mock(text="Queued")
+        message.edit_text = AsyncMock()
+        status = StatusMessage(message, edits_per_second=50)
+        
+        await status.update("Downloading 50%")
+        await asyncio.sleep(0.05)
+        message.edit_text.assert_awaited_once_with("Downloading 50%")
+
+
 class TestDownloadManager(unittest.TestCase):
     """Test download manager."""
     
@@ -142,6 +863,854 @@ class TestDownloadManager(unittest.TestCase):
         # Test with non-existent file
         info = self.manager.get_download_info("non_existent.mp3")
         self.assertEqual(info, {})
+    
+    def test_name_from_tags(self):
+        """Test downloads can be named after their ID3 tags."""
+        manager = DownloadManager(self.temp_dir, name_from_tags=True)
+        part_path = os.path.join(self.temp_dir, ".uid.part")
+        with open(part_path, 'wb') as f:
+            f.write(id3v2_tag(id3v2_frame(b"TIT2", "Around/World") + id3v2_frame(b"TPE1", "Daft Punk")))
+        reserved = manager.filename_index.allocate("upload.mp3")
+        
+        file_path = manager._tag_file_path(part_path, reserved)
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "Daft Punk - Around_World.mp3"))
+        # The original name is free again
+        self.assertEqual(manager.filename_index.allocate("upload.mp3"), reserved)
+    
+    def test_download_resumes_and_renames_atomically(self):
+        """Test an interrupted download resumes from the part file."""
+        content = b"0123456789" * 1000
+        ranges = []
+        
+        async def broken_stream():
+            yield content[:4000]
+            raise httpx.ReadError("connection reset")
+        
+        def handler(request):
+            ranges.append(request.headers.get("Range"))
+            if len(ranges) == 1:
+                return httpx.Response(200, content=broken_stream())
+            offset = int(request.headers["Range"][len("bytes="):-1])
+            return httpx.Response(206, content=content[offset:])
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        manager = DownloadManager(self.temp_dir, http_client=http_client)
+        document = Mock(file_name="song.mp3", file_id="id", file_unique_id="uid", file_size=len(content))
+        context = Mock()
+        context.bot.get_file = AsyncMock(return_value=Mock(file_path="http://files.example.com/song.mp3"))
+        update = Mock()
+        update.message.reply_text = AsyncMock()
+        
+        with patch('download_manager.asyncio.sleep', AsyncMock()):
+            file_path = asyncio.run(manager.download_file(document, context, update))
+        
+        self.assertEqual(ranges, [None, "bytes=4000-"])
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "song.mp3"))
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.temp_dir), ["song.mp3"])
+    
+    def test_download_errors_do_not_reveal_the_bot_token(self):
+        """Test errors quoting the file URL have the bot token removed."""
+        url = "https://api.telegram.org/file/bot123456:AAH-secret_token/music/file_1.mp3"
+        
+        def handler(request):
+            raise httpx.ConnectError(f"Could not connect to {request.url}")
+        
+        manager = DownloadManager(self.temp_dir, http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        document = Mock(file_name="song.mp3", file_id="id", file_unique_id="uid", file_size=4)
+        context = Mock()
+        context.bot.get_file = AsyncMock(return_value=Mock(file_path=url))
+        
+        with patch('download_manager.asyncio.sleep', AsyncMock()), self.assertLogs('download_manager') as logs:
+            with self.assertRaises(DownloadError) as raised:
+                asyncio.run(manager.download_file(document, context, Mock(), progress_callback=AsyncMock()))
+        
+        self.assertIn("bot<token>", str(raised.exception))
+        for text in [str(raised.exception)] + logs.output:
+            self.assertNotIn("secret_token", text)
+        # The original error, URL and all, isn't chained into tracebacks either
+        self.assertTrue(raised.exception.__suppress_context__)
+    
+    def test_failed_directory_flush_keeps_the_download(self):
+        """Test a file already moved into place is returned, and its name kept, if the flush fails."""
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=b"song")))
+        manager = DownloadManager(self.temp_dir, http_client=http_client)
+        document = Mock(file_name="song.mp3", file_id="id", file_unique_id="uid", file_size=4)
+        context = Mock()
+        context.bot.get_file = AsyncMock(return_value=Mock(file_path="http://files.example.com/song.mp3"))
+        
+        with patch('download_manager._fsync_directory', side_effect=OSError("I/O error")):
+            file_path = asyncio.run(manager.download_file(document, context, Mock(), progress_callback=AsyncMock()))
+        
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "song.mp3"))
+        self.assertTrue(os.path.exists(file_path))
+        self.assertEqual(manager.filename_index.allocate("song.mp3"), os.path.join(self.temp_dir, "song_1.mp3"))
+    
+    def test_downloads_of_the_same_file_take_turns(self):
+        """Test two jobs for one Telegram file don't write its part file at once."""
+        content = os.urandom(64 * 1024)
+        
+        async def slow_stream():
+            for offset in range(0, len(content), 8192):
+                await asyncio.sleep(0.001)
+                yield content[offset:offset + 8192]
+        
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=slow_stream())))
+        manager = DownloadManager(self.temp_dir, http_client=http_client)
+        document = Mock(file_name="song.mp3", file_id="id", file_unique_id="uid", file_size=len(content))
+        context = Mock()
+        context.bot.get_file = AsyncMock(return_value=Mock(file_path="http://files.example.com/song.mp3"))
+        
+        async def download_twice():
+            return await asyncio.gather(*(
+                manager.download_file(document, context, Mock(), progress_callback=AsyncMock()) for _ in range(2)
+            ))
+        
+        paths = asyncio.run(download_twice())
+        
+        self.assertEqual(sorted(os.path.basename(path) for path in paths), ["song.mp3", "song_1.mp3"])
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+    
+    def test_local_bot_api_file_is_linked(self):
+        """Test a file path from a local Bot API server is taken over without HTTP."""
+        from telegram import Bot
+        server_dir = tempfile.mkdtemp(dir=self.temp_dir)
+        source = os.path.join(server_dir, "file_1.mp3")
+        with open(source, 'wb') as f:
+            f.write(b"local" * 100)
+        
+        FakeBotAPIHandler.results = {"getFile": {"file_id": "id", "file_unique_id": "uid", "file_path": source}}
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPIHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        
+        def no_http(request):
+            raise AssertionError("file contents were fetched over HTTP")
+        
+        manager = DownloadManager(self.temp_dir, http_client=httpx.AsyncClient(transport=httpx.MockTransport(no_http)))
+        bot = Bot("123:abc", base_url=f"http://127.0.0.1:{server.server_port}/bot", local_mode=True)
+        document = Mock(file_name="song.mp3", file_id="id", file_unique_id="uid", file_size=500)
+        
+        async def download():
+            async with bot:
+                return await manager.download_file(document, Mock(bot=bot), Mock(), progress_callback=AsyncMock())
+        
+        try:
+            file_path = asyncio.run(download())
+        finally:
+            server.shutdown()
+            server.server_close()
+            FakeBotAPIHandler.results = {}
+        
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "song.mp3"))
+        self.assertTrue(os.path.samefile(file_path, source))
+    
+    def test_local_file_is_copied_across_filesystems(self):
+        """Test the copy fallback when a hard link can't cross filesystems."""
+        import errno
+        source = os.path.join(self.temp_dir, "source.mp3")
+        destination = os.path.join(self.temp_dir, "destination.mp3")
+        content = os.urandom(3 * 1024 * 1024)
+        with open(source, 'wb') as f:
+            f.write(content)
+        
+        cross_device = OSError(errno.EXDEV, "Invalid cross-device link")
+        with patch('download_manager.os.link', side_effect=cross_device):
+            self.assertEqual(take_local_file(source, destination), "copy")
+        
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertTrue(os.path.exists(source))
+    
+    def test_download_does_not_overwrite_a_file_added_after_indexing(self):
+        """Test a name taken since the directory was indexed is skipped, not replaced."""
+        part_path = os.path.join(self.temp_dir, ".uid.part")
+        with open(part_path, 'w') as f:
+            f.write("new")
+        reserved = self.manager.filename_index.allocate("song.mp3")
+        with open(reserved, 'w') as f:
+            f.write("added by hand")
+        
+        file_path = self.manager._move_into_place(part_path, reserved)
+        
+        self.assertEqual(file_path, os.path.join(self.temp_dir, "song_1.mp3"))
+        with open(reserved) as f:
+            self.assertEqual(f.read(), "added by hand")
+        with open(file_path) as f:
+            self.assertEqual(f.read(), "new")
+        self.assertFalse(os.path.exists(part_path))
+        # Both names stay taken in the index
+        self.assertEqual(self.manager.filename_index.allocate("song.mp3"), os.path.join(self.temp_dir, "song_2.mp3"))
+    
+    def test_filename_index_allocates_unique_names(self):
+        """Test clashing names get the next free suffix without reuse."""
+        for name in ("song.mp3", "song_1.mp3"):
+            with open(os.path.join(self.temp_dir, name), 'w') as f:
+                f.write("x")
+        
+        index = FilenameIndex(self.temp_dir)
+        self.assertEqual(index.allocate("other.mp3"), os.path.join(self.temp_dir, "other.mp3"))
+        self.assertEqual(index.allocate("song.mp3"), os.path.join(self.temp_dir, "song_2.mp3"))
+        self.assertEqual(index.allocate("Song.mp3"), os.path.join(self.temp_dir, "Song_3.mp3"))
+        
+        index.release(os.path.join(self.temp_dir, "other.mp3"))
+        self.assertEqual(index.allocate("other.mp3"), os.path.join(self.temp_dir, "other.mp3"))
+
+
+def id3v2_frame(frame_id: bytes, text: str, version: int = 3, encoding: int = 3) -> bytes:
+    """Build an ID3v2.3/2.4 text frame."""
+    data = bytes([encoding]) + text.encode("utf-8" if encoding == 3 else "latin-1")
+    if version == 4:
+        size = bytes((len(data) >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    else:
+        size = len(data).to_bytes(4, "big")
+    return frame_id + size + b"\x00\x00" + data
+
+
+def id3v2_tag(frames: bytes, version: int = 3, padding: int = 64) -> bytes:
+    """Wrap frames in an ID3v2 header."""
+    size = len(frames) + padding
+    header = b"ID3" + bytes([version, 0, 0]) + bytes((size >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    return header + frames + bytes(padding)
+
+
+class TestID3(unittest.TestCase):
+    """Test ID3 tag reading."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def write(self, content: bytes) -> str:
+        path = os.path.join(self.temp_dir, "track.mp3")
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+    
+    def test_id3v23_tags(self):
+        """Test title, artist and BPM are read past a large artwork frame."""
+        artwork = b"APIC" + (200000).to_bytes(4, "big") + b"\x00\x00" + bytes(200000)
+        frames = (
+            id3v2_frame(b"TIT2", "One More Time") + artwork
+            + id3v2_frame(b"TPE1", "Daft Punk") + id3v2_frame(b"TBPM", "123", encoding=0)
+        )
+        tags = read_tags(self.write(id3v2_tag(frames) + b"\xff\xfb" * 1000))
+        self.assertEqual(tags.title, "One More Time")
+        self.assertEqual(tags.artist, "Daft Punk")
+        self.assertEqual(tags.bpm, 123.0)
+    
+    def test_id3v24_tags_with_id3v1_fallback(self):
+        """Test ID3v2.4 values win and ID3v1 fills the gaps."""
+        frames = id3v2_frame(b"TIT2", "Été", version=4)
+        v1 = b"TAG" + b"Old Title".ljust(30, b"\x00") + b"Artist".ljust(30, b"\x00") + b"Album".ljust(30, b"\x00")
+        v1 = v1.ljust(128, b"\x00")
+        tags = read_tags(self.write(id3v2_tag(frames, version=4) + bytes(1000) + v1))
+        self.assertEqual(tags.title, "Été")
+        self.assertEqual(tags.artist, "Artist")
+        self.assertEqual(tags.album, "Album")
+        self.assertIsNone(tags.bpm)
+    
+    def test_untagged_files(self):
+        """Test files without tags, and empty files, have no tags."""
+        self.assertIsNone(read_tags(self.write(b"\xff\xfb" * 1000)))
+        self.assertIsNone(read_tags(self.write(b"")))
+        self.assertIsNone(read_tags(os.path.join(self.temp_dir, "missing.mp3")))
+
+
+class TestDedupIndex(unittest.IsolatedAsyncioTestCase):
+    """Test the persistent dedup index."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = DedupIndex(os.path.join(self.temp_dir, "dedup.db"))
+        self.track = os.path.join(self.temp_dir, "track.mp3")
+        with open(self.track, 'wb') as f:
+            f.write(b"ID3 track content")
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        self.index.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_lookup_by_unique_id_and_hash(self):
+        """Test files can be found by file_unique_id or content hash."""
+        sha256 = hash_file(self.track)
+        self.index.record(sha256, self.track, 17, "unique-1")
+        
+        self.assertEqual(self.index.lookup("unique-1"), self.track)
+        self.assertEqual(self.index.lookup_hash(sha256), self.track)
+        self.assertIsNone(self.index.lookup("unique-2"))
+    
+    def test_stale_entries_are_dropped(self):
+        """Test entries for deleted files are ignored."""
+        self.index.record(hash_file(self.track), self.track, 17, "unique-1")
+        os.remove(self.track)
+        self.assertIsNone(self.index.lookup("unique-1"))
+    
+    async def test_register_download_removes_duplicate(self):
+        """Test a new download with known content resolves to the existing file."""
+        manager = DownloadManager(self.temp_dir, self.index)
+        first = await manager.register_download(Mock(file_unique_id="unique-1"), self.track)
+        
+        copy = os.path.join(self.temp_dir, "track_1.mp3")
+        with open(copy, 'wb') as f:
+            f.write(b"ID3 track content")
+        document = Mock(file_unique_id="unique-2")
+        
+        self.assertEqual(first, self.track)
+        self.assertEqual(await manager.register_download(document, copy), self.track)
+        self.assertFalse(os.path.exists(copy))
+        self.assertEqual(manager.find_existing(document), self.track)
+
+
+class TestBulkImporter(unittest.TestCase):
+    """Test importing existing folders into Lexicon."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.music_dir = os.path.join(self.temp_dir, "music")
+        os.makedirs(os.path.join(self.music_dir, "album"))
+        for name, content in [
+            ("one.mp3", b"one"), ("album/two.mp3", b"two"), ("album/copy.mp3", b"one"),
+            ("cover.jpg", b"jpg"), (".hidden.mp3", b"hidden")
+        ]:
+            with open(os.path.join(self.music_dir, name), 'wb') as f:
+                f.write(content)
+        self.dedup_index = DedupIndex(os.path.join(self.temp_dir, "dedup.db"))
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        self.dedup_index.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_import_batches_and_resumes(self):
+        """Test files are imported once in batches and duplicates are skipped."""
+        client = Mock()
+        client.add_tracks.side_effect = lambda paths: [{"location": path} for path in paths]
+        
+        stats = BulkImporter(client, self.dedup_index, batch_size=1, hash_workers=2).run(self.music_dir)
+        self.assertEqual((stats.found, stats.imported, stats.duplicates), (3, 2, 1))
+        sent = sorted(os.path.basename(call.args[0][0]) for call in client.add_tracks.call_args_list)
+        self.assertEqual(len(sent), 2)
+        self.assertIn("two.mp3", sent)
+        
+        # A second run skips everything the first one finished
+        client.add_tracks.reset_mock()
+        stats = BulkImporter(client, self.dedup_index).run(self.music_dir)
+        self.assertEqual(stats.imported, 0)
+        self.assertEqual(stats.already_imported, 2)
+        client.add_tracks.assert_not_called()
+    
+    def test_failed_batches_are_retried(self):
+        """Test files from a failed batch are imported on the next run."""
+        client = Mock()
+        client.add_tracks.side_effect = LexiconError("down")
+        stats = BulkImporter(client, self.dedup_index).run(self.music_dir)
+        self.assertEqual((stats.imported, stats.failed), (0, 2))
+        
+        client.add_tracks.side_effect = lambda paths: [{"location": path} for path in paths]
+        stats = BulkImporter(client, self.dedup_index).run(self.music_dir)
+        self.assertEqual(stats.imported, 2)
+    
+    def test_files_the_bot_downloaded_are_still_imported(self):
+        """Test a download record doesn't count as the file being in Lexicon."""
+        two = os.path.join(self.music_dir, "album", "two.mp3")
+        self.dedup_index.record(hash_file(two), two, os.path.getsize(two), "uid")
+        client = Mock()
+        client.add_tracks.side_effect = lambda paths: [{"location": path} for path in paths]
+        
+        stats = BulkImporter(client, self.dedup_index).run(self.music_dir)
+        
+        self.assertEqual((stats.imported, stats.already_imported, stats.duplicates), (2, 0, 1))
+        sent = [path for call in client.add_tracks.call_args_list for path in call.args[0]]
+        self.assertIn(two, sent)
+
+
+class TestPipelineStats(unittest.TestCase):
+    """Test the statistics behind /status."""
+    
+    def test_recent_jobs_are_bounded(self):
+        """Test only the most recent jobs are kept, and stage averages come from them."""
+        stats = PipelineStats(capacity=2)
+        start = stats.started
+        for index, key in enumerate(["a", "b", "c"]):
+            now = start + index * 10
+            stats.record(key, RECEIVED, 1000, now=now)
+            stats.record(key, DOWNLOADING, now=now + 1)
+            stats.record(key, DOWNLOADED, now=now + 1 + index)
+            stats.record(key, LEXICON_ADDED, now=now + 5)
+        stats.record("d", RECEIVED, 500, now=start + 40)
+        stats.record("d", DOWNLOADING, now=start + 41)
+        stats.record("d", FAILED, now=start + 42)
+        
+        self.assertEqual([record.key for record in stats.recent], ["c", "d"])
+        summary = stats.summary(window=60, now=start + 50)
+        self.assertEqual((summary.completed, summary.failed, summary.bytes_completed), (1, 1, 1000))
+        self.assertEqual(summary.stage_averages, {"queued": 1, "download": 2, "lexicon": 2, "total": 5})
+        
+        # Jobs that never finish can't grow the tracked set without limit either
+        for index in range(5):
+            stats.record(f"stuck{index}", DOWNLOADED, now=start + 60)
+        self.assertEqual(stats.summary(now=start + 60).awaiting_lexicon, 2)
+    
+    def test_status_report(self):
+        """Test /status shows running downloads, recent jobs and Lexicon health."""
+        from handlers import describe_status
+        from download_manager import ActiveDownload
+        stats = PipelineStats()
+        stats.record("a", RECEIVED, 2048, now=stats.started)
+        stats.record("a", DOWNLOADING, now=stats.started)
+        stats.record("a", DONE, now=stats.started + 1)
+        
+        download_manager = DownloadManager(tempfile.gettempdir())
+        download = download_manager.active_downloads["/music/song.mp3"] = ActiveDownload("song.mp3", 4096)
+        download.done = 1024
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        
+        text = describe_status({
+            'config': Config(lexicon_enabled=True),
+            'download_queue': Mock(active_jobs={1: Mock()}, pending=3),
+            'download_manager': download_manager,
+            'pipeline_stats': stats,
+            'lexicon_client': Mock(base_url="http://lexicon", circuit_breaker=breaker),
+        })
+        
+        self.assertIn("Jobs: 1 running, 3 queued", text)
+        self.assertIn("song.mp3: 1.0KB of 4.0KB (25%)", text)
+        self.assertIn("1 done, 0 failed", text)
+        self.assertIn("download 1.0s", text)
+        self.assertIn("Lexicon (http://lexicon): ❌ unavailable", text)
+
+
+class TestJobJournal(unittest.TestCase):
+    """Test the write-ahead job journal."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "journal.jsonl")
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_unfinished_jobs_survive_restart(self):
+        """Test replay returns the latest state of unfinished jobs only."""
+        journal = JobJournal(self.path)
+        journal.record("1:10", RECEIVED, chat_id=1, file_name="a.mp3")
+        journal.record("1:11", RECEIVED, chat_id=1, file_name="b.mp3")
+        journal.record("1:10", DOWNLOADED, file_path="/music/a.mp3")
+        journal.record("1:11", DOWNLOADED, file_path="/music/b.mp3")
+        journal.record("1:11", LEXICON_ADDED)
+        journal.close()
+        
+        # Simulate a crash in the middle of writing a line
+        with open(self.path, 'a') as f:
+            f.write('{"key": "1:12", "sta')
+        
+        journal = JobJournal(self.path)
+        unfinished = journal.unfinished()
+        journal.close()
+        
+        self.assertEqual(len(unfinished), 1)
+        self.assertEqual(unfinished[0]["state"], DOWNLOADED)
+        self.assertEqual(unfinished[0]["file_name"], "a.mp3")
+        self.assertEqual(unfinished[0]["file_path"], "/music/a.mp3")
+        
+        # The journal was compacted to the unfinished job
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+    
+    def test_journal_is_compacted_while_running(self):
+        """Test finished jobs are dropped from the file once enough have finished."""
+        journal = JobJournal(self.path, compact_after=2)
+        journal.record("1:10", RECEIVED, file_name="a.mp3")
+        journal.record("1:11", RECEIVED, file_name="b.mp3")
+        journal.record("1:10", DONE)
+        journal.record("1:12", RECEIVED, file_name="c.mp3")
+        journal.record("1:12", FAILED)
+        journal.close()
+        
+        with open(self.path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry["key"] for entry in entries], ["1:11"])
+        self.assertEqual(entries[0]["file_name"], "b.mp3")
+    
+    def test_resume_unfinished_jobs(self):
+        """Test jobs left in flight are downloaded or added to Lexicon again on startup."""
+        from handlers import resume_unfinished_jobs
+        file_path = os.path.join(self.temp_dir, "b.mp3")
+        with open(file_path, 'w') as f:
+            f.write("x")
+        
+        journal = JobJournal(self.path)
+        journal.record("1:10", RECEIVED, chat_id=1, file_id="f10", file_unique_id="u10",
+                       file_name="a.mp3", file_size=100, message_id=10)
+        journal.record("1:10", DOWNLOADING)
+        journal.record("1:11", RECEIVED, chat_id=1, file_id="f11", file_unique_id="u11",
+                       file_name="b.mp3", file_size=1, message_id=11)
+        journal.record("1:11", DOWNLOADED, file_path=file_path)
+        journal.close()
+        
+        journal = JobJournal(self.path)
+        download_queue = Mock()
+        download_queue.next_job_id.side_effect = [1, 2]
+        application = Mock(bot_data={
+            'config': Config(lexicon_enabled=True),
+            'download_queue': download_queue,
+            'job_journal': journal,
+            'outbound': Mock()
+        })
+        
+        with patch('handlers.add_to_lexicon', Mock(return_value="add")) as add_to_lexicon:
+            asyncio.run(resume_unfinished_jobs(application))
+        journal.close()
+        
+        # The pending download is queued again, under its original key
+        job = download_queue.submit.call_args.args[0]
+        self.assertEqual((job.key, job.chat_id, job.message_id), ("1:10", 1, 10))
+        self.assertEqual(job.document.file_id, "f10")
+        # The downloaded file only needs adding to Lexicon
+        resumed, path = add_to_lexicon.call_args.args
+        self.assertEqual((resumed.key, path), ("1:11", file_path))
+        application.create_task.assert_called_once_with("add")
+
+
+class TestMetrics(unittest.TestCase):
+    """Test the metrics registry and endpoint."""
+    
+    def test_render_counter_and_histogram(self):
+        """Test labelled counters and cumulative histogram buckets are rendered."""
+        registry = Registry()
+        errors = registry.register(Counter("errors_total", "Errors.", ["type"]))
+        latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)))
+        errors.labels("DownloadError").inc()
+        errors.labels("DownloadError").inc()
+        for value in (0.05, 0.5, 5.0):
+            latency.observe(value)
+        
+        text = registry.render()
+        self.assertIn("# TYPE errors_total counter", text)
+        self.assertIn('errors_total{type="DownloadError"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("latency_seconds_count 3", text)
+        self.assertIn("latency_seconds_sum 5.55", text)
+    
+    def test_metrics_endpoint(self):
+        """Test metrics are served over HTTP."""
+        server = start_metrics_server("127.0.0.1", 0)
+        try:
+            url = f"http://127.0.0.1:{server.server_port}"
+            response = httpx.get(f"{url}/metrics")
+            missing = httpx.get(f"{url}/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE download_queue_depth gauge", response.text)
+        self.assertEqual(missing.status_code, 404)
+
+
+class TestStructuredLogging(unittest.TestCase):
+    """Test the queued, sampled logging pipeline."""
+    
+    def record(self, message="message", exc_info=None, **extra):
+        record = logging.LogRecord("lexicon_client", logging.INFO, __file__, 1, message, None, exc_info)
+        record.__dict__.update(extra)
+        return record
+    
+    def test_payloads_are_sampled(self):
+        """Test only a few payload records per minute get through, and skipped ones are counted."""
+        sampler = PayloadSampler(per_minute=2)
+        with patch('structured_logging.time.monotonic', return_value=100.0):
+            passed = [sampler.filter(self.record(payload={"n": n})) for n in range(5)]
+            self.assertTrue(sampler.filter(self.record()))
+        self.assertEqual(passed, [True, True, False, False, False])
+        
+        with patch('structured_logging.time.monotonic', return_value=161.0):
+            record = self.record(payload={"n": 5})
+            self.assertTrue(sampler.filter(record))
+        self.assertEqual(record.payloads_skipped, 3)
+    
+    def test_tracebacks_are_formatted_by_the_writer(self):
+        """Test queued records keep their traceback unformatted until written as JSON."""
+        log_queue = queue.Queue(1)
+        handler = _QueueHandler(log_queue)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            handler.handle(self.record("failed", exc_info=sys.exc_info(), payload={"tracks": ["x" * 5000]}))
+        handler.handle(self.record("lost"))
+        
+        queued = log_queue.get_nowait()
+        self.assertIsNone(queued.exc_text)
+        self.assertEqual(handler.dropped, 1)
+        
+        entry = json.loads(JsonFormatter().format(queued))
+        self.assertEqual(entry["message"], "failed")
+        self.assertIn("ValueError: boom", entry["exception"])
+        self.assertTrue(entry["payload_truncated"])
+        self.assertLess(len(entry["payload"]), 2100)
+        
+        handler.handle(self.record("next"))
+        self.assertEqual(log_queue.get_nowait().records_dropped, 1)
+
+
+class TestProfiling(unittest.IsolatedAsyncioTestCase):
+    """Test stage tracing and on-demand profiles."""
+    
+    async def test_cpu_profile_reports_stages(self):
+        """Test a CPU profile lists hot functions and the stages of traced handlers."""
+        @profiling.trace_stage
+        async def fetch():
+            await asyncio.sleep(0.02)
+        
+        @profiling.trace_update
+        async def handle():
+            await fetch()
+            return sum(i * i for i in range(10000))
+        
+        async def load():
+            await asyncio.sleep(0.01)
+            for _ in range(3):
+                await handle()
+        
+        task = asyncio.create_task(load())
+        summary = await profiling.profile_for(0.2)
+        await task
+        
+        self.assertIn("Hottest functions", summary)
+        self.assertIn("<genexpr>", summary)
+        self.assertIn("TestProfiling.test_cpu_profile_reports_stages.<locals>.fetch", summary)
+        self.assertFalse(profiling.is_profiling())
+    
+    async def test_task_profile_reports_awaits(self):
+        """Test sampling tasks finds where they wait, and only one profile runs at a time."""
+        async def stuck_on_lexicon():
+            await asyncio.sleep(1)
+        
+        async def worker():
+            await stuck_on_lexicon()
+        
+        task = asyncio.create_task(worker())
+        profile = asyncio.create_task(profiling.profile_for(0.1, profiling.TASKS))
+        await asyncio.sleep(0)
+        with self.assertRaises(RuntimeError):
+            await profiling.profile_for(0.1)
+        summary = await profile
+        task.cancel()
+        
+        self.assertIn("Slowest awaits", summary)
+        self.assertIn("stuck_on_lexicon", summary)
+    
+    async def test_concurrent_profile_commands(self):
+        """Test a second /profile sent at the same time is told a profile is running."""
+        from handlers import profile_command
+        replies = []
+        
+        async def slow_reply(text):
+            replies.append(text)
+            await asyncio.sleep(0.01)
+        
+        def command():
+            update = Mock(effective_user=Mock(id=1))
+            update.message.reply_text = slow_reply
+            context = Mock(bot_data={'config': Config(admin_user_id=1)}, args=["0.05"])
+            return profile_command(update, context)
+        
+        await asyncio.gather(command(), command())
+        
+        self.assertEqual(replies.count("⏱️ A profile is already running."), 1)
+        self.assertEqual(sum(text.startswith("📊 Profile") for text in replies), 1)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the benchmark helpers."""
+    
+    def test_synthetic_mp3(self):
+        """Test synthetic files have the requested size and distinct content."""
+        first = synthetic_mp3("file1", 10000)
+        second = synthetic_mp3("file2", 10000)
+        self.assertEqual(len(first), 10000)
+        self.assertTrue(first.startswith(b"ID3"))
+        self.assertNotEqual(first, second)
+    
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+class TestStartup(unittest.TestCase):
+    """Test startup imports and their profiling."""
+    
+    def test_parse_importtime(self):
+        """Test importtime lines are parsed with their nesting depth."""
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:        41 |         41 |   marshal\n"
+            "import time:       580 |       1393 | config\n"
+        )
+        timings = parse_importtime(output)
+        self.assertEqual([t.name for t in timings], ["marshal", "config"])
+        self.assertEqual([t.depth for t in timings], [1, 0])
+        self.assertEqual(timings[1].self_us, 580)
+        self.assertEqual(timings[1].cumulative_us, 1393)
+    
+    def test_setup_path_does_not_import_telegram(self):
+        """Test the command-line entry point leaves telegram and HTTP clients unloaded."""
+        import subprocess
+        result = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, bot; print(sorted({'telegram', 'httpx', 'requests'} & set(sys.modules)))"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+    
+    def test_setup_and_import_paths_do_not_import_httpx(self):
+        """Test the synchronous Lexicon client used by setup and --import leaves httpx unloaded."""
+        import subprocess
+        result = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, bot, lexicon_client, bulk_import; print(sorted({'telegram', 'httpx'} & set(sys.modules)))"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Telegram Bot API."""
+    
+    calls = []
+    # Extra results by method name, set by individual tests
+    results = {}
+    
+    def do_POST(self):
+        """Answer Bot API method calls."""
+        method = self.path.rsplit('/', 1)[-1]
+        self.calls.append(method)
+        results = {
+            "getMe": {"id": 1, "is_bot": True, "first_name": "Test", "username": "test_bot"},
+            **self.results
+        }
+        body = json.dumps({"ok": True, "result": results.get(method, True)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Keep test output quiet."""
+
+
+def free_port() -> int:
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@unittest.skipUnless(importlib.util.find_spec("tornado"), "webhook support is not installed")
+class TestWebhookMode(unittest.IsolatedAsyncioTestCase):
+    """Test webhook mode end to end against a fake Bot API."""
+    
+    def setUp(self):
+        """Start the fake Bot API server."""
+        FakeBotAPIHandler.calls = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPIHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.config = Config(
+            bot_token="123:abc",
+            download_dir="/tmp",
+            telegram_base_url=f"http://127.0.0.1:{self.server.server_port}/bot",
+            webhook_port=free_port(),
+            webhook_path="/hook/",
+            webhook_secret_token="s3cret"
+        )
+    
+    def tearDown(self):
+        """Stop the fake Bot API server."""
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_webhook_options(self):
+        """Test webhook options are built from the config."""
+        from handlers import build_webhook_options, webhook_unavailable_reason
+        options = build_webhook_options(self.config)
+        self.assertEqual(options["url_path"], "hook")
+        self.assertEqual(options["webhook_url"], f"http://127.0.0.1:{self.config.webhook_port}/hook")
+        self.assertEqual(options["secret_token"], "s3cret")
+        self.assertIsNone(webhook_unavailable_reason(self.config))
+        
+        self.config.telegram_base_url = ""
+        self.assertIsNotNone(webhook_unavailable_reason(self.config))
+    
+    async def test_updates_are_received_through_webhook(self):
+        """Test updates posted to the webhook reach the handlers."""
+        from telegram.ext import Application, MessageHandler, filters
+        from handlers import build_webhook_options
+        
+        received = asyncio.Event()
+        
+        async def on_message(update, context):
+            received.set()
+        
+        application = Application.builder().token(self.config.bot_token).base_url(self.config.telegram_base_url).build()
+        application.add_handler(MessageHandler(filters.ALL, on_message))
+        options = build_webhook_options(self.config)
+        
+        await application.initialize()
+        await application.start()
+        await application.updater.start_webhook(**options)
+        try:
+            update = {
+                "update_id": 1,
+                "message": {
+                    "message_id": 1, "date": 0, "text": "hi",
+                    "chat": {"id": 5, "type": "private"},
+                    "from": {"id": 5, "is_bot": False, "first_name": "User"}
+                }
+            }
+            async with httpx.AsyncClient() as client:
+                forged = await client.post(options["webhook_url"], json=update)
+                accepted = await client.post(
+                    options["webhook_url"], json=update,
+                    headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+                )
+            await asyncio.wait_for(received.wait(), timeout=5)
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+        
+        self.assertEqual(forged.status_code, 403)
+        self.assertEqual(accepted.status_code, 200)
+        self.assertIn("setWebhook", FakeBotAPIHandler.calls)
 
 
 if __name__ == "__main__":
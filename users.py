@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Authorised users for Lexicon Track Adder Bot
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Dict
+from config import Config
+from utils import validate_directory
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """An authorised user and where their tracks go."""
+    user_id: int
+    download_dir: str
+    lexicon_api_url: str
+    weight: float = 1.0
+
+
+def load_user_profiles(config: Config) -> Dict[int, UserProfile]:
+    """
+    Build the authorised users from the config.
+    
+    The admin is always authorised. Entries in ``users`` may set their own
+    ``download_dir``, ``lexicon_api_url`` and fair-share ``weight``; anything
+    they leave out falls back to the top-level settings.
+    
+    Args:
+        config: The bot configuration
+    
+    Returns:
+        Profiles keyed by Telegram user ID, so authorisation is a dict lookup
+    """
+    profiles = {}
+    if config.admin_user_id is not None:
+        profiles[config.admin_user_id] = UserProfile(
+            config.admin_user_id, config.download_dir, config.lexicon_api_url
+        )
+    
+    for entry in config.users:
+        try:
+            user_id = int(entry["user_id"])
+            weight = float(entry.get("weight", 1.0))
+        except (KeyError, TypeError, ValueError):
+            logger.error(f"Ignoring invalid entry in users: {entry}")
+            continue
+        
+        download_dir = entry.get("download_dir") or config.download_dir
+        if download_dir != config.download_dir and not validate_directory(download_dir):
+            logger.error(f"Download directory of user {user_id} is not writable, using {config.download_dir}")
+            download_dir = config.download_dir
+        
+        profiles[user_id] = UserProfile(
+            user_id,
+            download_dir,
+            entry.get("lexicon_api_url") or config.lexicon_api_url,
+            weight if weight > 0 else 1.0
+        )
+    return profiles
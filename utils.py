@@ -4,8 +4,7 @@ Utility functions for Lexicon Track Adder Bot
 """
 
 import os
-from typing import Optional
-from telegram import Document
+import re
 
 
 def is_admin(user_id: int, config) -> bool:
@@ -13,6 +12,11 @@ def is_admin(user_id: int, config) -> bool:
     return user_id == config.admin_user_id
 
 
+def is_authorized(user_id: int, users) -> bool:
+    """Check if user is one of the authorised users (a set or dict keyed by user ID)."""
+    return user_id in users
+
+
 def is_mp3_file(file_name: str) -> bool:
     """Check if file is an MP3 file."""
     if not file_name:
@@ -60,6 +64,15 @@ def format_file_size(size_bytes: int) -> str:
     return f"{size_bytes:.1f}{size_names[i]}"
 
 
+# Bot API URLs carry the token as ".../bot<id>:<secret>/..."
+BOT_TOKEN_PATTERN = re.compile(r"bot\d+:[A-Za-z0-9_-]+")
+
+
+def redact_bot_token(text: str) -> str:
+    """Hide any bot token in text, such as an error message quoting a file URL."""
+    return BOT_TOKEN_PATTERN.sub("bot<token>", text)
+
+
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename for safe file system usage."""
     # Remove or replace invalid characters